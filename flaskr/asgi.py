@@ -0,0 +1,42 @@
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+from flaskr import create_app
+from flaskr.async_db import warm_up
+from flaskr.turnstile import create_async_client
+
+
+class FlaskASGI:
+    # the server's event loop reads request bodies and writes responses, so
+    # idle and slow connections cost no thread, a request only takes one
+    # from the time its body has arrived until its response is handed back
+    def __init__(self, app):
+        self.app = app
+        self.asgi_app = WsgiToAsgi(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        # WsgiToAsgi runs every request on one shared thread otherwise
+        async with ThreadSensitiveContext():
+            await self.asgi_app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await warm_up(self.app.async_db_pool)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.app.async_db_pool.dispose()
+                await self.app.turnstile_async_client.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(custom_config=None):
+    """uvicorn --factory flaskr.asgi:create_asgi_app"""
+    app = create_app(custom_config, asgi=True)
+    # turnstile keeps its connections alive on the server's loop too
+    app.turnstile_async_client = create_async_client(app)
+    return FlaskASGI(app)
@@ -0,0 +1,179 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+from werkzeug.exceptions import NotFound
+
+try:
+    import brotli
+except ImportError:  # optional, pip install flaskr[assets]
+    brotli = None
+
+MANIFEST = "manifest.json"
+# a year, the filename changes whenever the content does
+MAX_AGE = 31536000
+COMPRESSED_TYPES = (".css", ".js", ".svg", ".html", ".txt", ".json")
+# relative references to other static files, ES module imports and css url()
+REFERENCE_RE = re.compile(
+    r"""(?P<prefix>\bfrom\s*|\bimport\s*\(?\s*|url\(\s*)"""
+    r"""(?P<quote>['"]?)(?P<path>\.\.?/[^'")\s]+|[\w-][^'":)\s]*\.\w+)(?P=quote)"""
+)
+# checked in this order against the client's Accept-Encoding
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def fingerprint(filename, content) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def compress(content):
+    """The precompressed variants worth keeping, by file suffix."""
+    variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(content, quality=11)
+    return {
+        suffix: data for suffix, data in variants.items() if len(data) < len(content)
+    }
+
+
+def build(source, target):
+    """Copy every file of source into target under a content hashed name,
+    with .gz and .br next to it, and return the manifest."""
+    sources = {}
+    for root, _, files in os.walk(source):
+        for name in files:
+            path = os.path.join(root, name)
+            sources[os.path.relpath(path, source).replace(os.sep, "/")] = path
+
+    manifest = {}
+
+    def resolve(filename, seen=()):
+        # a file's hash covers the hashed names of what it references, so
+        # the references are built first
+        if filename in manifest:
+            return manifest[filename]
+        with open(sources[filename], "rb") as f:
+            content = f.read()
+
+        if filename.endswith((".css", ".js")):
+            directory = os.path.dirname(filename)
+
+            def replace(match):
+                path = match["path"]
+                name = os.path.normpath(os.path.join(directory, path)).replace(
+                    os.sep, "/"
+                )
+                if name not in sources or name in seen:
+                    return match[0]
+                # only the file name changes, the path to it stays as written
+                hashed = path.rpartition("/")[0] + "/" if "/" in path else ""
+                hashed += os.path.basename(resolve(name, (*seen, filename)))
+                return f"{match['prefix']}{match['quote']}{hashed}{match['quote']}"
+
+            content = REFERENCE_RE.sub(replace, content.decode("utf8")).encode("utf8")
+
+        hashed = fingerprint(filename, content)
+        path = os.path.join(target, hashed)
+        if not os.path.exists(path):
+            _write(path, content)
+            if filename.endswith(COMPRESSED_TYPES):
+                for suffix, data in compress(content).items():
+                    _write(path + suffix, data)
+        manifest[filename] = hashed
+        return hashed
+
+    for filename in sorted(sources):
+        resolve(filename)
+
+    # earlier builds are left in place, pages rendered before a deploy may
+    # still ask for them
+    _write(
+        os.path.join(target, MANIFEST),
+        json.dumps(manifest, indent=2, sort_keys=True).encode("utf8"),
+    )
+    return manifest
+
+
+def load_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def asset_url(filename):
+    """url_for("static") for templates, the fingerprinted file once built."""
+    hashed = current_app.asset_manifest.get(filename)
+    if hashed is None:
+        return url_for("static", filename=filename)
+    return url_for("assets", filename=hashed)
+
+
+def serve_asset(filename):
+    directory = current_app.config["ASSETS_DIR"]
+    if filename == MANIFEST or filename.endswith((".gz", ".br")):
+        raise NotFound()
+    mimetype = None
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if name in request.accept_encodings and os.path.isfile(
+            os.path.join(directory, filename + suffix)
+        ):
+            encoding = name
+            # the type of the original file, not of the compressed one
+            mimetype = mimetypes.guess_type(filename)[0]
+            filename += suffix
+            break
+
+    response = send_from_directory(
+        directory, filename, mimetype=mimetype, max_age=MAX_AGE
+    )
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+assets_cli = AppGroup("assets", help="Fingerprinted and precompressed static files.")
+
+
+@assets_cli.command("build")
+def build_command():
+    """Build the static files into ASSETS_DIR."""
+    target = current_app.config["ASSETS_DIR"]
+    current_app.asset_manifest = build(current_app.static_folder, target)
+    for filename, hashed in sorted(current_app.asset_manifest.items()):
+        click.echo(f"{filename} -> {hashed}")
+    if brotli is None:
+        click.echo("brotli isn't installed, only gzip variants were written.")
+
+
+def init_app(app):
+    app.cli.add_command(assets_cli)
+    app.asset_manifest = load_manifest(app.config["ASSETS_DIR"])
+    app.add_url_rule(
+        f"{app.config.get('ASSETS_URL_PATH', '/assets')}/<path:filename>",
+        "assets",
+        serve_asset,
+    )
+    app.jinja_env.globals["asset_url"] = asset_url
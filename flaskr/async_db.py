@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from flaskr.db import set_sqlite_pragmas
+from flaskr.metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+asyncmy",
+    "mariadb": "mysql+asyncmy",
+}
+
+
+def async_database_uri(db_uri):
+    url = make_url(db_uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_async_db_engine(app, pooled=False) -> AsyncEngine:
+    url = make_url(
+        app.config.get("ASYNC_SQLALCHEMY_DATABASE_URI")
+        or async_database_uri(app.config.get("SQLALCHEMY_DATABASE_URI"))
+    )
+    is_sqlite = url.get_backend_name() == "sqlite"
+    if is_sqlite and url.database in (None, "", ":memory:"):
+        raise ValueError(
+            "An in-memory SQLite database can't be shared with async views"
+        )
+
+    # a pooled connection is bound to the event loop that opened it, only an
+    # ASGI server keeps one loop alive across requests, under WSGI every async
+    # view runs in a loop of its own
+    options = {} if pooled else {"poolclass": NullPool}
+    if not is_sqlite:
+        options["pool_pre_ping"] = True
+    engine = create_async_engine(url, **options)
+
+    if is_sqlite:
+        set_sqlite_pragmas(app, engine.sync_engine)
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+async def warm_up(engine):
+    # the first connection initializes the dialect under an asyncio lock,
+    # event loops in several threads racing for it deadlock, so open it once
+    # up front, disposing the engine afterwards would reset that again
+    try:
+        async with engine.connect():
+            pass
+    except Exception as e:
+        logger.warning("async engine warm up failed: %s", e)
+
+
+def init_app(app, pooled=False):
+    app.async_db_pool = create_async_db_engine(app, pooled=pooled)
+    if not pooled:
+        asyncio.run(warm_up(app.async_db_pool))
@@ -0,0 +1,225 @@
+import asyncio
+
+from flask import (
+    current_app,
+    flash,
+    g,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
+from werkzeug.exceptions import HTTPException
+
+from flaskr import async_db, queries
+from flaskr.auth import login_required
+from flaskr.blog import (
+    decode_cursor,
+    posts_page_query,
+    posts_page_result,
+    render_listing,
+    search_query,
+)
+from flaskr.db import get_db_type
+from flaskr.page_cache import cached_page, invalidate_pages
+from flaskr.passwords import check_password, hash_password, needs_rehash
+from flaskr.ratelimit import rate_limited
+from flaskr.sessions import regenerate_session
+from flaskr.turnstile import allow_retry, cf_turnstile_required
+
+# async versions of the busiest blog and auth views, they await the database
+# and turnstile instead of blocking, and push password hashing off the loop
+
+
+async def index():
+    try:
+        after = decode_cursor(request.args.get("after"))
+        before = decode_cursor(request.args.get("before"))
+        per_page = current_app.config.get("POSTS_PER_PAGE", 20)
+        statement, params = posts_page_query(after, before, per_page)
+        async with current_app.async_db_pool.connect() as db:
+            posts = (await db.execute(statement, params)).fetchall()
+        posts, prev_cursor, next_cursor = posts_page_result(
+            posts, after, before, per_page
+        )
+
+        return render_listing(
+            "blog/index.html",
+            posts=posts,
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
+        )
+    except Exception as e:
+        flash(f"System error {e}")
+
+    return redirect(url_for("blog.index"))
+
+
+async def search():
+    q = request.args.get("q", "").strip()
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        page = 1
+    posts = []
+    has_more = False
+
+    if q:
+        try:
+            per_page = current_app.config.get("POSTS_PER_PAGE", 20)
+            async with current_app.async_db_pool.connect() as db:
+                statement, params = search_query(get_db_type(db), q, page, per_page)
+                posts = (await db.execute(statement, params)).fetchall()
+            has_more = len(posts) > per_page
+            posts = posts[:per_page]
+        except Exception as e:
+            flash(f"System error {e}")
+
+    return render_template(
+        "blog/search.html", q=q, posts=posts, page=page, has_more=has_more
+    )
+
+
+async def create():
+    if request.method == "POST":
+        title = request.form.get("title")
+        body = request.form.get("body")
+
+        if not title:
+            flash("Title is required.")
+            allow_retry()
+        else:
+            try:
+                async with current_app.async_db_pool.begin() as db:
+                    await db.execute(
+                        queries.insert_post,
+                        {
+                            "title": title,
+                            "body": body,
+                            "author_id": g.user["id"],
+                            "author_username": g.user["username"],
+                        },
+                    )
+                invalidate_pages()
+                return redirect(url_for("blog.index"))
+            except Exception as e:
+                flash(f"System error {e}")
+
+    return render_template("blog/create.html")
+
+
+async def register():
+    if request.method == "POST":
+        username = request.form.get("username")
+        password = request.form.get("password")
+        message = None
+
+        if not username or not password:
+            message = "Username and password is required."
+            allow_retry()
+
+        if message is None:
+            try:
+                async with current_app.async_db_pool.begin() as db:
+                    result = (
+                        await db.execute(
+                            queries.user_id_by_username, {"username": username}
+                        )
+                    ).scalar_one_or_none()
+                    if result is not None:
+                        message = f"User {username} is already registered."
+                    else:
+                        await db.execute(
+                            queries.insert_user,
+                            {
+                                "username": username,
+                                "password": await asyncio.to_thread(
+                                    hash_password, password
+                                ),
+                            },
+                        )
+                if message is None:
+                    flash(
+                        f"User registration completed, you can now login with {username}"
+                    )
+                    return redirect(url_for("auth.login"))
+            except HTTPException:
+                raise
+            except Exception as e:
+                message = f"System error {e}"
+
+        flash(message)
+        return redirect(url_for("auth.register"))
+
+    return render_template("auth/register.html")
+
+
+async def login():
+    if request.method == "POST":
+        username = request.form.get("username")
+        password = request.form.get("password")
+        message = None
+
+        if not username or not password:
+            message = "Username and password is required."
+            allow_retry()
+
+        if message is None:
+            try:
+                async with current_app.async_db_pool.connect() as db:
+                    result = (
+                        await db.execute(
+                            queries.user_login_by_username, {"username": username}
+                        )
+                    ).fetchone()
+                    if result is not None and result.id > 0:
+                        if await asyncio.to_thread(
+                            check_password, result.password, password
+                        ):
+                            if needs_rehash(result.password):
+                                # upgrade hashes made with older cost settings
+                                await db.execute(
+                                    queries.update_user,
+                                    {
+                                        "user_id": result.id,
+                                        "password": await asyncio.to_thread(
+                                            hash_password, password
+                                        ),
+                                    },
+                                )
+                                await db.commit()
+                            session.clear()
+                            regenerate_session()
+                            session["id"] = result.id
+                            session["username"] = username
+                            return redirect(url_for("index"))
+                message = "Incorrect username or password."
+            except HTTPException:
+                raise
+            except Exception as e:
+                message = f"System error {e}"
+
+        flash(message)
+        return redirect(url_for("auth.login"))
+
+    return render_template("auth/login.html")
+
+
+ASYNC_VIEWS = {
+    "blog.index": cached_page(index),
+    "blog.search": search,
+    "blog.create": login_required(cf_turnstile_required(create)),
+    "auth.register": rate_limited(cf_turnstile_required(register)),
+    "auth.login": rate_limited(cf_turnstile_required(login)),
+}
+
+
+def init_app(app, pooled=False):
+    # once per app, a second call would replace the engine and leak the first
+    if "flaskr.async_views" in app.extensions:
+        return
+    app.extensions["flaskr.async_views"] = {"pooled": pooled}
+    # the routes stay as the blueprints declared them, only the functions
+    # behind the endpoints are swapped
+    async_db.init_app(app, pooled=pooled)
+    app.view_functions.update(ASYNC_VIEWS)
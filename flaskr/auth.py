@@ -1,7 +1,9 @@
 import functools
+import inspect
 
 from flask import (
     Blueprint,
+    current_app,
     flash,
     g,
     redirect,
@@ -11,16 +13,24 @@ from flask import (
     url_for,
 )
 
-from sqlalchemy import text
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.exceptions import HTTPException
 
-from flaskr.db import get_db
-from flaskr.turnstile import cf_turnstile_required
+from flaskr import queries
+from flaskr.cache import LRUCache
+from flaskr.db import get_db, get_read_db
+from flaskr.passwords import check_password, hash_password, needs_rehash
+from flaskr.ratelimit import rate_limited
+from flaskr.sessions import regenerate_session, revoke_user_sessions, trusts_session
+from flaskr.turnstile import allow_retry, cf_turnstile_required
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+# endpoints that never look at g.user, no need to touch the database for them
+SKIP_USER_LOOKUP = {"static", "assets", "hello", "metrics"}
+
 
 @bp.route("/register", methods=("GET", "POST"))
+@rate_limited
 @cf_turnstile_required
 def register():
     if request.method == "POST":
@@ -30,24 +40,22 @@ def register():
 
         if not username or not password:
             message = "Username and password is required."
+            allow_retry()
 
         if message is None:
             try:
                 db = get_db()
                 result = db.execute(
-                    text("SELECT id FROM user WHERE username = :username"),
-                    {"username": username},
+                    queries.user_id_by_username, {"username": username}
                 ).scalar_one_or_none()
                 if result is not None:
                     message = f"User {username} is already registered."
                 else:
                     db.execute(
-                        text(
-                            "INSERT INTO user (username, password) VALUES (:username, :password)"
-                        ),
+                        queries.insert_user,
                         {
                             "username": username,
-                            "password": generate_password_hash(password),
+                            "password": hash_password(password),
                         },
                     )
                     db.commit()
@@ -55,6 +63,8 @@ def register():
                         f"User registration completed, you can now login with {username}"
                     )
                     return redirect(url_for("auth.login"))
+            except HTTPException:
+                raise
             except Exception as e:
                 message = f"System error {e}"
 
@@ -65,6 +75,7 @@ def register():
 
 
 @bp.route("/login", methods=("GET", "POST"))
+@rate_limited
 @cf_turnstile_required
 def login():
     if request.method == "POST":
@@ -74,23 +85,36 @@ def login():
 
         if not username or not password:
             message = "Username and password is required."
+            allow_retry()
 
         if message is None:
             try:
                 db = get_db()
                 result = db.execute(
-                    text("SELECT id, password FROM user WHERE username = :username"),
-                    {"username": username},
+                    queries.user_login_by_username, {"username": username}
                 ).fetchone()
                 if result is not None:
-                    if result.id > 0 and check_password_hash(result.password, password):
+                    if result.id > 0 and check_password(result.password, password):
+                        if needs_rehash(result.password):
+                            # upgrade hashes made with older cost settings
+                            db.execute(
+                                queries.update_user,
+                                {
+                                    "user_id": result.id,
+                                    "password": hash_password(password),
+                                },
+                            )
+                            db.commit()
                         session.clear()
+                        regenerate_session()
                         session["id"] = result.id
                         session["username"] = username
                         return redirect(url_for("index"))
                     else:
                         pass
                 message = "Incorrect username or password."
+            except HTTPException:
+                raise
             except Exception as e:
                 message = f"System error {e}"
 
@@ -102,31 +126,57 @@ def login():
 
 def verify_user(user_id, username):
     if user_id is not None and username is not None:
+        cache = current_app.user_cache
+        cached = cache.get(user_id)
+        if cached is not None:
+            return cached == username
         try:
-            db = get_db()
+            db = get_read_db()
             result = db.execute(
-                text("SELECT username FROM user WHERE id = :user_id"),
-                {"user_id": user_id},
+                queries.username_by_id, {"user_id": user_id}
             ).scalar_one_or_none()
-            if result is not None and result == username:
-                return True
+            if result is not None:
+                cache.set(user_id, result)
+                if result == username:
+                    return True
         except Exception:
             pass
 
     return False
 
 
+def invalidate_user(user_id):
+    current_app.user_cache.delete(user_id)
+
+
 @bp.before_app_request
 def load_logged_in_user():
+    g.user = None
+    if request.endpoint in SKIP_USER_LOOKUP:
+        return
     user_id = session.get("id")
+    if user_id is None:
+        return
     username = session.get("username")
-    if verify_user(user_id, username) is True:
+    # a revocable server side session is dropped as soon as the user is,
+    # what it holds needs no second look in the database
+    if trusts_session() or verify_user(user_id, username) is True:
         g.user = {"id": user_id, "username": username}
-    else:
-        g.user = None
 
 
 def login_required(view):
+    if inspect.iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapped_view(**kwargs):
+            if g.user is None:
+                flash("Login required")
+                return redirect(url_for("auth.login"))
+
+            return await view(**kwargs)
+
+        return async_wrapped_view
+
     @functools.wraps(view)
     def wrapped_view(**kwargs):
         if g.user is None:
@@ -148,11 +198,15 @@ def logout():
 @bp.route("/dashboard")
 @login_required
 def dashboard():
-    return render_template("auth/dashboard.html")
+    post_count = get_read_db().execute(
+        queries.post_count_by_id, {"user_id": g.user["id"]}
+    ).scalar_one_or_none()
+    return render_template("auth/dashboard.html", post_count=post_count or 0)
 
 
 @bp.route("/change_password", methods=("GET", "POST"))
 @login_required
+@rate_limited
 @cf_turnstile_required
 def change_password():
     if request.method == "POST":
@@ -172,25 +226,26 @@ def change_password():
         elif current_password == new_password:
             message = "New passwords is the same as current password."
 
-        if message is None:
+        if message is not None:
+            allow_retry()
+        else:
             db = get_db()
             try:
                 result = db.execute(
-                    text("SELECT password FROM user WHERE id = :id"),
-                    {"id": g.user["id"]},
+                    queries.password_by_id, {"user_id": g.user["id"]}
                 ).scalar_one_or_none()
                 if result is not None:
-                    if check_password_hash(result, current_password):
+                    if check_password(result, current_password):
                         db.execute(
-                            text(
-                                "UPDATE user SET password = :new_password WHERE id = :id"
-                            ),
+                            queries.update_user,
                             {
-                                "id": g.user["id"],
-                                "new_password": generate_password_hash(new_password),
+                                "user_id": g.user["id"],
+                                "password": hash_password(new_password),
                             },
                         )
                         db.commit()
+                        invalidate_user(g.user["id"])
+                        revoke_user_sessions(g.user["id"])
                         g.user = None
                         session.clear()
                         flash(
@@ -202,6 +257,8 @@ def change_password():
                         pass
                 else:
                     message = "Unexpected error"
+            except HTTPException:
+                raise
             except Exception as e:
                 message = f"System error {e}"
 
@@ -209,3 +266,10 @@ def change_password():
         return redirect(url_for("auth.change_password"))
 
     return render_template("auth/change_password.html")
+
+
+def init_app(app):
+    app.user_cache = LRUCache(
+        maxsize=app.config.get("USER_CACHE_SIZE", 1024),
+        ttl=app.config.get("USER_CACHE_TTL", 60),
+    )
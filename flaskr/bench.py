@@ -0,0 +1,740 @@
+import json
+import os
+import platform
+import secrets
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
+
+from flaskr import queries
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+BENCH_PASSWORD = "bench"
+# cloudflare's dummy secret key passes any token, used by the HTTP mode
+TURNSTILE_DUMMY_TOKEN = "XXXX.DUMMY.TOKEN.XXXX"
+
+# name: (method, path, form, needs login, (expected status, redirect path))
+# a failed login or a refused page redirects too, so the target is checked
+SCENARIOS = {
+    "blog.index": ("GET", "/", None, False, (200, None)),
+    "auth.login": (
+        "POST",
+        "/auth/login",
+        {"username": "bench0", "password": BENCH_PASSWORD},
+        False,
+        (302, "/"),
+    ),
+    "blog.create": (
+        "POST",
+        "/create",
+        {"title": "bench", "body": "bench body"},
+        True,
+        (302, "/"),
+    ),
+    # bench0 is the admin, the first user of a seeded database
+    "manage.index": ("GET", "/manage/", None, True, (200, None)),
+}
+
+
+def seed(db, users, posts, batch_size=10000):
+    # every user shares one hash, hashing 100k passwords would be the benchmark
+    pwhash = generate_password_hash(BENCH_PASSWORD)
+    for start in range(0, users, batch_size):
+        db.execute(
+            queries.insert_user,
+            [
+                {"username": f"bench{i}", "password": pwhash}
+                for i in range(start, min(start + batch_size, users))
+            ],
+        )
+        db.commit()
+
+    first_id = db.execute(select(func.min(queries.user.c.id))).scalar_one()
+    base = datetime(2020, 1, 1)
+    for start in range(0, posts, batch_size):
+        db.execute(
+            queries.insert_post,
+            [
+                {
+                    "title": f"bench post {i}",
+                    "body": f"body of bench post {i}\nwith a second line",
+                    "author_id": first_id + i % users,
+                    "author_username": f"bench{i % users}",
+                    "created": base + timedelta(seconds=i),
+                }
+                for i in range(start, min(start + batch_size, posts))
+            ],
+        )
+        db.commit()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(q * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return rss // 1024 if platform.system() == "Darwin" else rss
+
+
+def turnstile_token():
+    # the app spends a token once its form goes through, so each POST needs
+    # its own
+    return f"{TURNSTILE_DUMMY_TOKEN}.{secrets.token_urlsafe(8)}"
+
+
+def _login(client):
+    return client.post(
+        "/auth/login",
+        data={
+            "username": "bench0",
+            "password": BENCH_PASSWORD,
+            "cf-turnstile-response": turnstile_token(),
+        },
+    )
+
+
+def unexpected(response, expected) -> bool:
+    status, location = expected
+    if response.status_code != status:
+        return True
+    return (
+        location is not None
+        and urlsplit(response.headers.get("Location", "")).path != location
+    )
+
+
+def confirm_seed(database, yes):
+    # init_db drops every table, only the throwaway file is seeded unasked
+    if database and not yes:
+        click.confirm(f"Seeding drops every table in {database}, continue?", abort=True)
+
+
+def run_scenario(make_client, name, requests, concurrency=1):
+    method, path, form, needs_login, expected = SCENARIOS[name]
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    rate_limited = threading.Event()
+
+    def worker(count):
+        client = make_client()
+        if needs_login:
+            _login(client)
+        local = []
+        failed = 0
+        for _ in range(count):
+            if rate_limited.is_set():
+                break
+            start = time.perf_counter()
+            if method == "GET":
+                response = client.get(path)
+            else:
+                response = client.post(
+                    path,
+                    data=dict(form, **{"cf-turnstile-response": turnstile_token()}),
+                )
+            # streamed pages only finish rendering once the body is read
+            if hasattr(response, "read"):
+                response.read()
+            else:
+                response.get_data()
+            response.close()
+            local.append(time.perf_counter() - start)
+            if response.status_code == 429:
+                rate_limited.set()
+                break
+            if unexpected(response, expected):
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    counts = [requests // concurrency] * concurrency
+    for i in range(requests % concurrency):
+        counts[i] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(c,)) for c in counts if c]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if rate_limited.is_set():
+        raise click.ClickException(
+            f"{name} was rate limited (429), every bench request comes from one"
+            " IP, run the target with RATELIMIT_BACKEND = None."
+        )
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    lines = []
+    for name, result in results["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        for key in ("throughput", "p50_ms", "p95_ms", "p99_ms"):
+            if before.get(key) and result.get(key) is not None:
+                change = (result[key] - before[key]) / before[key] * 100
+                lines.append(
+                    f"{name:14} {key:10} {before[key]:10.2f} -> "
+                    f"{result[key]:10.2f} ({change:+.1f}%)"
+                )
+    return lines
+
+
+@click.command("bench")
+@click.option(
+    "--users",
+    default=1000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Users to seed.",
+)
+@click.option("--posts", default=10000, show_default=True, help="Posts to seed.")
+@click.option("--batch-size", default=10000, show_default=True)
+@click.option("--requests", "requests_", default=200, show_default=True)
+@click.option("--concurrency", default=1, show_default=True)
+@click.option(
+    "--scenario",
+    "scenarios",
+    multiple=True,
+    type=click.Choice(list(SCENARIOS)),
+    help="Endpoints to drive, all of them by default.",
+)
+@click.option(
+    "--database",
+    help="Database URI to seed, a throwaway SQLite file in the instance folder "
+    "by default. With --url point it at the server's database, or use --no-seed.",
+)
+@click.option("--no-seed", is_flag=True, help="Benchmark the database as it is.")
+@click.option("--yes", is_flag=True, help="Seed --database without asking.")
+@click.option(
+    "--url",
+    help="Drive a running server over HTTP instead of the in-process test client.",
+)
+@click.option("--page-cache/--no-page-cache", default=True, show_default=True)
+@click.option("--async-views", is_flag=True, help="Serve the async views in-process.")
+@click.option("--output", type=click.Path(), help="Where to write the JSON results.")
+@click.option(
+    "--compare",
+    "baseline_path",
+    type=click.Path(exists=True),
+    help="Earlier results to compare against.",
+)
+@with_appcontext
+def bench_command(
+    users,
+    posts,
+    batch_size,
+    requests_,
+    concurrency,
+    scenarios,
+    database,
+    no_seed,
+    yes,
+    url,
+    page_cache,
+    async_views,
+    output,
+    baseline_path,
+):
+    """Seed a database and measure the main endpoints."""
+    from flaskr import create_app
+    from flaskr.db import dispose_engines, get_db, get_engine, init_db
+
+    if not no_seed:
+        confirm_seed(database, yes)
+    scenarios = scenarios or tuple(SCENARIOS)
+    config = dict(current_app.config)
+    config.update(
+        {
+            "SQLALCHEMY_DATABASE_URI": database
+            or "sqlite:///" + os.path.join(current_app.instance_path, "bench.sqlite"),
+            # in-process requests skip the turnstile round trip
+            "TESTING": True,
+            "METRICS_DIR": None,
+            # every bench request comes from one IP and logs in as bench0
+            "RATELIMIT_BACKEND": None,
+        }
+    )
+    if not page_cache:
+        config["PAGE_CACHE_BACKEND"] = None
+    config["ASYNC_VIEWS"] = async_views
+    app = create_app(config)
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "database": get_engine(app).url.render_as_string(hide_password=True),
+        "mode": "http" if url else "in-process",
+        "page_cache": page_cache,
+        "async_views": async_views,
+        "seed": None,
+        "results": {},
+    }
+
+    if not no_seed:
+        click.echo(f"Seeding {users} users and {posts} posts...")
+        start = time.perf_counter()
+        with app.app_context():
+            init_db()
+            seed(get_db(), users, posts, batch_size)
+        results["seed"] = {
+            "users": users,
+            "posts": posts,
+            "seconds": time.perf_counter() - start,
+        }
+
+    if url:
+        import httpx
+
+        def make_client():
+            return httpx.Client(base_url=url, timeout=30.0)
+
+    else:
+
+        def make_client():
+            return app.test_client()
+
+    for name in scenarios:
+        click.echo(f"Running {name}...")
+        results["results"][name] = run_scenario(
+            make_client, name, requests_, concurrency
+        )
+    results["peak_rss_kb"] = peak_rss_kb()
+    dispose_engines(app)
+
+    for name, result in results["results"].items():
+        click.echo(
+            f"{name:14} {result['throughput']:9.1f} req/s  "
+            f"p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+            f"p99 {result['p99_ms']:8.2f}ms  errors {result['errors']}"
+        )
+    click.echo(f"peak RSS {results['peak_rss_kb']} KiB")
+
+    if output is None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(current_app.instance_path, "bench", f"{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf8") as f:
+        json.dump(results, f, indent=2)
+    click.echo(f"Results written to {output}")
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf8") as f:
+            baseline = json.load(f)
+        for line in compare(baseline, results):
+            click.echo(line)
+
+
+def time_per_call(fn, calls):
+    fn()  # warm up caches
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1_000_000
+
+
+def bench_statements(calls=10000, rows=1000):
+    from sqlalchemy import create_engine, text
+
+    from flaskr.db import split_statements
+
+    engine = create_engine("sqlite://")
+    results = {}
+    with engine.connect() as db:
+        with open(
+            os.path.join(os.path.dirname(__file__), "schema_sqlite.sql"),
+            "r",
+            encoding="utf8",
+        ) as f:
+            for statement in split_statements(f.read()):
+                db.exec_driver_sql(statement)
+        db.execute(queries.insert_user, {"username": "bench", "password": "x"})
+        db.execute(queries.insert_post, {"title": "t", "body": "b", "author_id": 1})
+
+        # what the views did before the registry, a new text() per call
+        results["post_by_id"] = {
+            "inline_us": time_per_call(
+                lambda: db.execute(
+                    text(
+                        "SELECT p.id, title, body, created, author_id, username "
+                        "FROM post p JOIN user u ON p.author_id = u.id "
+                        "WHERE p.id = :id"
+                    ),
+                    {"id": 1},
+                ).fetchone(),
+                calls,
+            ),
+            "registry_us": time_per_call(
+                lambda: db.execute(queries.post_by_id, {"post_id": 1}).fetchone(),
+                calls,
+            ),
+        }
+
+        params = [{"title": f"t{i}", "body": "b", "author_id": 1} for i in range(rows)]
+
+        def insert_one_by_one():
+            for row in params:
+                db.execute(
+                    text(
+                        "INSERT INTO post (title, body, author_id) "
+                        "VALUES (:title, :body, :author_id)"
+                    ),
+                    row,
+                )
+
+        # per inserted row
+        results["insert_post"] = {
+            "inline_us": time_per_call(insert_one_by_one, max(1, calls // rows)) / rows,
+            "registry_us": time_per_call(
+                lambda: db.execute(queries.insert_post, params),
+                max(1, calls // rows),
+            )
+            / rows,
+        }
+        db.rollback()
+    engine.dispose()
+
+    for result in results.values():
+        result["saved_us"] = result["inline_us"] - result["registry_us"]
+    return results
+
+
+@click.command("bench-queries")
+@click.option("--calls", default=10000, show_default=True)
+@click.option("--rows", default=1000, show_default=True, help="Rows per executemany.")
+def bench_queries_command(calls, rows):
+    """Compare inline text() statements with the precompiled registry."""
+    for name, result in bench_statements(calls, rows).items():
+        click.echo(
+            f"{name:12} inline {result['inline_us']:8.2f}us  "
+            f"registry {result['registry_us']:8.2f}us  "
+            f"saved {result['saved_us']:8.2f}us per call"
+        )
+
+
+def bench_feed(db, calls=200, per_page=20):
+    # the listing as it was before author_username, joining user per row
+    join_listing = (
+        select(
+            queries.post.c.id,
+            queries.post.c.title,
+            queries.post.c.body,
+            queries.post.c.created,
+            queries.post.c.author_id,
+            queries.user.c.username,
+        )
+        .select_from(
+            queries.post.join(
+                queries.user, queries.post.c.author_id == queries.user.c.id
+            )
+        )
+        .order_by(*queries.newest_first)
+    )
+    middle = db.execute(
+        select(queries.post.c.created, queries.post.c.id)
+        .order_by(*queries.newest_first)
+        .offset(db.execute(select(func.count(queries.post.c.id))).scalar_one() // 2)
+        .limit(1)
+    ).one()
+    cursor = {"created": middle.created, "id": middle.id, "limit": per_page}
+    pages = {
+        "first_page": (
+            join_listing.limit(per_page),
+            queries.posts_first_page,
+            {"limit": per_page},
+        ),
+        "middle_page": (
+            join_listing.where(
+                queries.post.c.created <= middle.created,
+                (queries.post.c.created < middle.created)
+                | (queries.post.c.id < middle.id),
+            ).limit(per_page),
+            queries.posts_after,
+            cursor,
+        ),
+    }
+
+    results = {}
+    for name, (join_statement, statement, params) in pages.items():
+        results[name] = {
+            "join_us": time_per_call(
+                lambda: db.execute(join_statement).fetchall(), calls
+            ),
+            "no_join_us": time_per_call(
+                lambda: db.execute(statement, params).fetchall(), calls
+            ),
+        }
+    return results
+
+
+@click.command("bench-feed")
+@click.option("--posts", default=1000000, show_default=True, help="Posts to seed.")
+@click.option("--users", default=1000, show_default=True, type=click.IntRange(min=1))
+@click.option("--calls", default=200, show_default=True)
+@click.option(
+    "--database",
+    help="Database URI to seed, a throwaway SQLite file in the instance folder "
+    "by default.",
+)
+@click.option("--no-seed", is_flag=True, help="Benchmark the database as it is.")
+@click.option("--yes", is_flag=True, help="Seed --database without asking.")
+@with_appcontext
+def bench_feed_command(posts, users, calls, database, no_seed, yes):
+    """Compare the feed with and without the join to user."""
+    from flaskr import create_app
+    from flaskr.db import dispose_engines, get_db, init_db
+
+    if not no_seed:
+        confirm_seed(database, yes)
+
+    config = dict(current_app.config)
+    config.update(
+        {
+            "SQLALCHEMY_DATABASE_URI": database
+            or "sqlite:///"
+            + os.path.join(current_app.instance_path, "bench-feed.sqlite"),
+            "METRICS_DIR": None,
+        }
+    )
+    app = create_app(config)
+    with app.app_context():
+        db = get_db()
+        if not no_seed:
+            click.echo(f"Seeding {users} users and {posts} posts...")
+            init_db()
+            seed(db, users, posts)
+        for name, result in bench_feed(db, calls).items():
+            click.echo(
+                f"{name:12} join {result['join_us']:10.2f}us  "
+                f"no join {result['no_join_us']:10.2f}us per page"
+            )
+    dispose_engines(app)
+
+
+def bench_cold_start(config, rounds=5, path="/auth/login"):
+    """Startup and first request of a fresh app, what a new worker costs."""
+    from flaskr import create_app
+    from flaskr.db import dispose_engines
+
+    cache_dir = tempfile.mkdtemp(prefix="flaskr-jinja-")
+    modes = {
+        # every template parsed and compiled on its first request
+        "compile": {"TEMPLATE_CACHE_DIR": None, "TEMPLATE_WARM_UP": False},
+        # compiled code loaded from a cache an earlier worker filled
+        "bytecode_cache": {"TEMPLATE_CACHE_DIR": cache_dir, "TEMPLATE_WARM_UP": False},
+        # loaded up front, create_app pays instead of the first request
+        "warm_up": {"TEMPLATE_CACHE_DIR": cache_dir, "TEMPLATE_WARM_UP": True},
+    }
+    results = {}
+    try:
+        for name, overrides in modes.items():
+            startups = []
+            first_requests = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                app = create_app({**config, **overrides})
+                startups.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                app.test_client().get(path)
+                first_requests.append(time.perf_counter() - start)
+                dispose_engines(app)
+            results[name] = {
+                "startup_ms": statistics.median(startups) * 1000,
+                "first_request_ms": statistics.median(first_requests) * 1000,
+            }
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+@click.command("bench-templates")
+@click.option("--rounds", default=5, show_default=True)
+@with_appcontext
+def bench_templates_command(rounds):
+    """Cold start of a worker with and without compiled templates."""
+    config = dict(current_app.config)
+    config.update({"METRICS_DIR": None, "PAGE_CACHE_BACKEND": None})
+    for name, result in bench_cold_start(config, rounds).items():
+        click.echo(
+            f"{name:14} startup {result['startup_ms']:8.2f}ms  "
+            f"first request {result['first_request_ms']:8.2f}ms"
+        )
+
+
+# run in a fresh interpreter, the last line of stdout is the result
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+create_app()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (time.perf_counter() - imported) * 1000,
+}))
+"""
+
+
+def parse_importtime(output):
+    """-X importtime's lines as {module: (self_ms, cumulative_ms)}."""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = [field.strip() for field in line[12:].split("|")]
+        if len(fields) != 3 or not fields[0].isdigit():
+            continue  # the header
+        modules[fields[2]] = (int(fields[0]) / 1000, int(fields[1]) / 1000)
+    return modules
+
+
+def startup_profile(root, top=15):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        path for path in (root, env.get("PYTHONPATH")) if path
+    )
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    results = json.loads(completed.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(completed.stderr)
+    results["total_ms"] = results["import_ms"] + results["create_app_ms"]
+    results["modules"] = len(modules)
+    results["slowest"] = [
+        {"module": name, "self_ms": self_ms, "cumulative_ms": cumulative_ms}
+        for name, (self_ms, cumulative_ms) in sorted(
+            modules.items(), key=lambda item: item[1][1], reverse=True
+        )[:top]
+    ]
+    return results
+
+
+@click.command("startup-profile")
+@click.option("--top", default=15, show_default=True, help="Slowest imports to list.")
+@click.option(
+    "--rounds",
+    default=3,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Fresh interpreters to start, the fastest is reported.",
+)
+@click.option("--output", type=click.Path(), help="Where to write the JSON results.")
+@click.option(
+    "--compare",
+    "baseline_path",
+    type=click.Path(exists=True),
+    help="Earlier results to compare against.",
+)
+@click.option(
+    "--budget-ms",
+    type=float,
+    help="Exit with an error when startup takes longer than this.",
+)
+@with_appcontext
+def startup_profile_command(top, rounds, output, baseline_path, budget_ms):
+    """Import and create_app time of a new worker, and its slowest imports."""
+    root = os.path.dirname(current_app.root_path)
+    try:
+        results = min(
+            (startup_profile(root, top) for _ in range(rounds)),
+            key=lambda result: result["total_ms"],
+        )
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"create_app failed:\n{e.stderr}")
+
+    click.echo(
+        f"import {results['import_ms']:8.2f}ms  "
+        f"create_app {results['create_app_ms']:8.2f}ms  "
+        f"total {results['total_ms']:8.2f}ms  ({results['modules']} modules)"
+    )
+    for module in results["slowest"]:
+        click.echo(
+            f"{module['cumulative_ms']:8.2f}ms {module['self_ms']:8.2f}ms  "
+            f"{module['module']}"
+        )
+
+    if output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Results written to {output}")
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf8") as f:
+            baseline = json.load(f)
+        for key in ("import_ms", "create_app_ms", "total_ms"):
+            if baseline.get(key):
+                change = (results[key] - baseline[key]) / baseline[key] * 100
+                click.echo(
+                    f"{key:14} {baseline[key]:10.2f} -> "
+                    f"{results[key]:10.2f} ({change:+.1f}%)"
+                )
+
+    if budget_ms is not None and results["total_ms"] > budget_ms:
+        raise click.ClickException(
+            f"Startup took {results['total_ms']:.2f}ms, over the {budget_ms:g}ms budget."
+        )
+
+
+def init_app(app):
+    app.cli.add_command(bench_command)
+    app.cli.add_command(bench_templates_command)
+    app.cli.add_command(startup_profile_command)
+    app.cli.add_command(bench_queries_command)
+    app.cli.add_command(bench_feed_command)
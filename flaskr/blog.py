@@ -1,32 +1,209 @@
-from flask import Blueprint, flash, g, redirect, render_template, request, url_for
-from sqlalchemy import text
+import base64
+from datetime import datetime
 
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    flash,
+    g,
+    redirect,
+    render_template,
+    request,
+    stream_template,
+    url_for,
+)
+from flaskr import queries
 from flaskr.auth import login_required
-from flaskr.db import get_db
-from flaskr.turnstile import cf_turnstile_required
+from flaskr.db import get_db, get_db_type, get_read_db
+from flaskr.page_cache import cached_page, invalidate_pages
+from flaskr.turnstile import allow_retry, cf_turnstile_required
 
 bp = Blueprint("blog", __name__)
 
 
+def encode_cursor(post) -> str:
+    raw = f"{post.created}|{post.id}".encode("utf8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf8")
+        created, id = raw.rsplit("|", 1)
+        return {"created": datetime.fromisoformat(created), "id": int(id)}
+    except Exception:
+        return None
+
+
+def posts_page_query(after=None, before=None, per_page=None, author_id=None):
+    # keyset pagination on (created, id), each page is a range scan on
+    # idx_post_created_id no matter how deep into the feed it is
+    params = {"limit": per_page + 1}
+    if author_id is None:
+        first_page, posts_after, posts_before = (
+            queries.posts_first_page,
+            queries.posts_after,
+            queries.posts_before,
+        )
+    else:
+        params["author_id"] = author_id
+        first_page, posts_after, posts_before = (
+            queries.author_posts_first_page,
+            queries.author_posts_after,
+            queries.author_posts_before,
+        )
+    if before is not None:
+        statement = posts_before
+        params.update(before)
+    elif after is not None:
+        statement = posts_after
+        params.update(after)
+    else:
+        statement = first_page
+    return statement, params
+
+
+def posts_page_result(posts, after=None, before=None, per_page=None):
+    has_more = len(posts) > per_page
+    posts = posts[:per_page]
+    if before is not None:
+        posts.reverse()
+
+    prev_cursor = None
+    next_cursor = None
+    if posts:
+        if (before is not None and has_more) or (before is None and after is not None):
+            prev_cursor = encode_cursor(posts[0])
+        if (before is None and has_more) or before is not None:
+            next_cursor = encode_cursor(posts[-1])
+
+    return posts, prev_cursor, next_cursor
+
+
+def get_posts_page(after=None, before=None, per_page=None, author_id=None):
+    if per_page is None:
+        per_page = current_app.config.get("POSTS_PER_PAGE", 20)
+
+    statement, params = posts_page_query(after, before, per_page, author_id)
+    db = get_read_db()
+    posts = db.execute(statement, params).fetchall()
+    return posts_page_result(posts, after, before, per_page)
+
+
+def render_listing(template_name_or_list, **context):
+    # streamed pages send their header while rows are still being read,
+    # a page cache miss buffers the stream once to store it
+    if current_app.config.get("STREAM_LISTINGS", False):
+        return current_app.response_class(
+            stream_template(template_name_or_list, **context)
+        )
+    return render_template(template_name_or_list, **context)
+
+
 @bp.route("/")
+@cached_page
 def index():
     try:
-        db = get_db()
-        posts = db.execute(
-            text(
-                "SELECT p.id, title, body, created, author_id, username "
-                "FROM post p JOIN user u ON p.author_id = u.id "
-                "ORDER BY created DESC"
-            )
-        ).fetchall()
-
-        return render_template("blog/index.html", posts=posts)
+        posts, prev_cursor, next_cursor = get_posts_page(
+            after=decode_cursor(request.args.get("after")),
+            before=decode_cursor(request.args.get("before")),
+        )
+
+        return render_listing(
+            "blog/index.html",
+            posts=posts,
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
+        )
     except Exception as e:
         flash(f"System error {e}")
 
     return redirect(url_for("blog.index"))
 
 
+@bp.route("/u/<username>")
+@cached_page
+def author(username):
+    profile = (
+        get_read_db()
+        .execute(queries.author_by_username, {"username": username})
+        .fetchone()
+    )
+    if profile is None:
+        abort(404, f"User {username} doesn't exist.")
+
+    try:
+        posts, prev_cursor, next_cursor = get_posts_page(
+            after=decode_cursor(request.args.get("after")),
+            before=decode_cursor(request.args.get("before")),
+            author_id=profile.id,
+        )
+
+        return render_listing(
+            "blog/author.html",
+            author=profile,
+            posts=posts,
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
+        )
+    except Exception as e:
+        flash(f"System error {e}")
+
+    return redirect(url_for("blog.index"))
+
+
+def fts_query(q: str) -> str:
+    # quote every term, so user input is never parsed as FTS5 syntax
+    terms = ['"' + term.replace('"', '""') + '"' for term in q.split()]
+    return " ".join(terms)
+
+
+def search_query(db_type, q, page=1, per_page=None):
+    params = {"limit": per_page + 1, "offset": (page - 1) * per_page}
+    match db_type:
+        case "sqlite":
+            params["q"] = fts_query(q)
+            statement = queries.search_posts_sqlite
+        case "mariadb":
+            params["q"] = q
+            statement = queries.search_posts_mariadb
+    return statement, params
+
+
+def search_posts(q, page=1, per_page=None):
+    if per_page is None:
+        per_page = current_app.config.get("POSTS_PER_PAGE", 20)
+
+    db = get_db()
+    statement, params = search_query(get_db_type(db), q, page, per_page)
+    posts = db.execute(statement, params).fetchall()
+    has_more = len(posts) > per_page
+    return posts[:per_page], has_more
+
+
+@bp.route("/search")
+def search():
+    q = request.args.get("q", "").strip()
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        page = 1
+    posts = []
+    has_more = False
+
+    if q:
+        try:
+            posts, has_more = search_posts(q, page)
+        except Exception as e:
+            flash(f"System error {e}")
+
+    return render_template(
+        "blog/search.html", q=q, posts=posts, page=page, has_more=has_more
+    )
+
+
 @bp.route("/create", methods=("GET", "POST"))
 @login_required
 @cf_turnstile_required
@@ -37,16 +214,21 @@ def create():
 
         if not title:
             flash("Title is required.")
+            allow_retry()
         else:
             try:
                 db = get_db()
                 db.execute(
-                    text(
-                        "INSERT INTO post (title, body, author_id) VALUES (:title, :body, :author_id)"
-                    ),
-                    {"title": title, "body": body, "author_id": g.user["id"]},
+                    queries.insert_post,
+                    {
+                        "title": title,
+                        "body": body,
+                        "author_id": g.user["id"],
+                        "author_username": g.user["username"],
+                    },
                 )
                 db.commit()
+                invalidate_pages()
                 return redirect(url_for("blog.index"))
             except Exception as e:
                 flash(f"System error {e}")
@@ -58,15 +240,9 @@ def get_post(id, check_author=True):
     error = None
     post = None
     try:
+        # decides who may change the post, a lagging replica mustn't
         db = get_db()
-        post = db.execute(
-            text(
-                "SELECT p.id, title, body, created, author_id, username "
-                "FROM post p JOIN user u ON p.author_id = u.id "
-                "WHERE p.id = :id"
-            ),
-            {"id": id},
-        ).fetchone()
+        post = db.execute(queries.post_by_id, {"post_id": id}).fetchone()
     except Exception as e:
         flash(f"System error {e}")
         return None
@@ -98,14 +274,16 @@ def update(id):
 
         if not title:
             flash("Title is required.")
+            allow_retry()
         else:
             try:
                 db = get_db()
                 db.execute(
-                    text("UPDATE post SET title = :title, body = :body WHERE id = :id"),
-                    {"title": title, "body": body, "id": id},
+                    queries.update_post,
+                    {"title": title, "body": body, "post_id": id},
                 )
                 db.commit()
+                invalidate_pages()
                 return redirect(url_for("blog.index"))
             except Exception as e:
                 flash(f"System error {e}")
@@ -123,8 +301,9 @@ def delete(id):
 
     try:
         db = get_db()
-        db.execute(text("DELETE FROM post WHERE id = :id"), {"id": id})
+        db.execute(queries.delete_post, {"post_id": id})
         db.commit()
+        invalidate_pages()
     except Exception as e:
         flash(f"System error {e}")
 
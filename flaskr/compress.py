@@ -0,0 +1,155 @@
+import gzip
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # optional, pip install flaskr[compress]
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, pip install flaskr[compress]
+    zstandard = None
+
+
+def _available():
+    available = {"gzip"}
+    if brotli is not None:
+        available.add("br")
+    if zstandard is not None:
+        available.add("zstd")
+    return available
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    match encoding:
+        case "gzip":
+            return gzip.compress(data, compresslevel=level, mtime=0)
+        case "br":
+            return brotli.compress(data, quality=level)
+        case "zstd":
+            return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def stream_compressor(encoding: str, level: int):
+    """(compress, flush, finish) for one stream, flush sends what was
+    compressed so far without ending it."""
+    match encoding:
+        case "gzip":
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            return (
+                compressor.compress,
+                lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+                lambda: compressor.flush(zlib.Z_FINISH),
+            )
+        case "br":
+            compressor = brotli.Compressor(quality=level)
+            return compressor.process, compressor.flush, compressor.finish
+        case "zstd":
+            compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            return (
+                compressor.compress,
+                lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+                compressor.flush,
+            )
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def negotiate():
+    """The encoding to answer this request with, None for identity."""
+    config = current_app.config
+    available = _available()
+    best = None
+    best_quality = 0
+    # ties go to the first of COMPRESS_ALGORITHMS
+    for encoding in config.get("COMPRESS_ALGORITHMS", ()):
+        if encoding not in available:
+            continue
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def level(encoding):
+    return current_app.config.get("COMPRESS_LEVELS", {}).get(encoding, 6)
+
+
+def compressible(response) -> bool:
+    config = current_app.config
+    return (
+        response.status_code == 200
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in config.get("COMPRESS_MIMETYPES", ())
+        and not response.cache_control.no_transform
+    )
+
+
+def set_encoded(response, data: bytes, encoding: str):
+    response.set_data(data)
+    response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        # a strong etag names the exact bytes, these are different ones
+        response.set_etag(f"{etag}-{encoding}")
+
+
+def _compressed_stream(iterable, compressor, buffer_size):
+    compress_chunk, flush, finish = compressor
+    # flushing every small fragment the template yields costs most of the
+    # compression, so the client gets a block every buffer_size bytes
+    pending = 0
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf8")
+            if not chunk:
+                continue
+            data = compress_chunk(chunk)
+            pending += len(chunk)
+            if pending >= buffer_size:
+                data += flush()
+                pending = 0
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+
+
+def compress_response(response):
+    if not compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # the length isn't known up front, streamed pages are always
+        # compressed, block by block
+        response.response = _compressed_stream(
+            response.response,
+            stream_compressor(encoding, level(encoding)),
+            current_app.config.get("COMPRESS_STREAM_BUFFER", 8192),
+        )
+        response.headers.pop("Content-Length", None)
+        response.content_encoding = encoding
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config.get("COMPRESS_MIN_SIZE", 500):
+        return response
+    set_encoded(response, compress(data, encoding, level(encoding)), encoding)
+    return response
+
+
+def init_app(app):
+    if app.config.get("COMPRESS_ALGORITHMS"):
+        app.after_request(compress_response)
@@ -1,48 +1,242 @@
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+
 import click
-from flask import current_app, g
-from sqlalchemy import Connection, NullPool, create_engine, text
+from flask import current_app, g, has_request_context, session
+from sqlalchemy import (
+    Connection,
+    Engine,
+    NullPool,
+    QueuePool,
+    SingletonThreadPool,
+    create_engine,
+    event,
+    make_url,
+    text,
+)
+from sqlalchemy.exc import DBAPIError
+
+from flaskr.metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
+
+WRITTEN_AT_KEY = "db_written_at"
+
+_engine_lock = threading.Lock()
+
+
+def get_engine(app=None) -> Engine:
+    """The app's engine, built on first use rather than in create_app."""
+    if app is None:
+        app = current_app._get_current_object()
+    if app.db_pool is None:
+        with _engine_lock:
+            if app.db_pool is None:
+                engine = create_primary_engine(app)
+                instrument_engine(engine)
+                event.listen(engine, "commit", mark_written)
+                app.db_pool = engine
+    return app.db_pool
+
+
+def get_replica_engines(app=None) -> list[Engine]:
+    if app is None:
+        app = current_app._get_current_object()
+    if app.db_replicas is None:
+        with _engine_lock:
+            if app.db_replicas is None:
+                engines = create_replica_engines(app)
+                for engine in engines:
+                    instrument_engine(engine)
+                app.db_replicas = engines
+    return app.db_replicas
+
+
+def dispose_engines(app):
+    for engine in (app.db_pool, *(app.db_replicas or ())):
+        if engine is not None:
+            engine.dispose()
 
 
 def get_db() -> Connection:
     if "db" not in g:
-        g.db = current_app.db_pool.connect()
+        g.db = get_engine().connect()
     return g.db
 
 
+def _read_from_primary() -> bool:
+    if not get_replica_engines() or g.get("db_written"):
+        return True
+    # read your writes, a session that just wrote keeps reading the primary
+    # until the replicas had time to catch up
+    written_at = session.get(WRITTEN_AT_KEY)
+    sticky = current_app.config.get("REPLICA_STICKY_SECONDS", 5)
+    return written_at is not None and time.time() - written_at < sticky
+
+
+def get_read_db() -> Connection:
+    """A connection for read-only work, a replica when there is one."""
+    if _read_from_primary():
+        return get_db()
+    if "read_db" not in g:
+        replicas = list(get_replica_engines())
+        random.shuffle(replicas)
+        for replica in replicas:
+            try:
+                g.read_db = replica.connect()
+                break
+            except DBAPIError as e:
+                logger.warning("replica %s unavailable: %s", replica.url, e)
+        else:
+            return get_db()
+    return g.read_db
+
+
+def mark_written(conn):
+    if has_request_context():
+        g.db_written = True
+        session[WRITTEN_AT_KEY] = time.time()
+
+
 def close_db(e=None):
-    db = g.pop("db", None)
-    if db is not None:
-        db.close()
+    for key in ("db", "read_db"):
+        db = g.pop(key, None)
+        if db is not None:
+            db.close()
+
+
+# one MariaDB token per match, quotes take backslash escapes, "--" only opens
+# a comment when followed by a space
+_MARIADB_TOKEN = re.compile(
+    r"""
+    (?P<space>\s+)
+    | (?P<comment>--(?=\s|$)[^\n]*|\#[^\n]*|/\*.*?\*/)
+    | (?P<quoted>'(?:\\.|''|[^'\\])*'|"(?:\\.|""|[^"\\])*"|`(?:``|[^`])*`)
+    | (?P<word>\w+)
+    | (?P<other>.)
+    """,
+    re.S | re.X,
+)
+# an END followed by one of these closes that construct, not a BEGIN block
+_END_SUFFIXES = {"IF", "LOOP", "WHILE", "REPEAT"}
+
+
+def _split_sqlite(script):
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        # keeps going until the statement is really over, trigger bodies
+        # have their own ; inside BEGIN ... END
+        if sqlite3.complete_statement(statement):
+            statement = statement.strip().rstrip(";").strip()
+            if statement:  # Avoid executing empty statements
+                yield statement
+            statement = ""
+    statement = statement.strip().rstrip(";").strip()
+    if statement:
+        yield statement
+
+
+def _next_token(script, pos):
+    # the next token that isn't space or a comment, upper cased, and its end
+    while pos < len(script):
+        match = _MARIADB_TOKEN.match(script, pos)
+        pos = match.end()
+        if match.lastgroup not in ("space", "comment"):
+            return match.group().upper(), pos
+    return None, pos
+
+
+def _split_mariadb(script):
+    delimiter = ";"
+    start = pos = 0
+    # open BEGIN ... END blocks and CASE ... END, a delimiter inside them
+    # doesn't end the statement
+    depth = 0
+    has_code = False
+    while pos < len(script):
+        if depth == 0 and script.startswith(delimiter, pos):
+            if has_code:
+                yield script[start:pos].strip()
+            pos = start = pos + len(delimiter)
+            has_code = False
+            continue
+        match = _MARIADB_TOKEN.match(script, pos)
+        pos = match.end()
+        if match.lastgroup in ("space", "comment"):
+            continue
+        token = match.group().upper()
+        if token == "DELIMITER" and not has_code:
+            # a client command, the rest of the line is the new delimiter
+            end = script.find("\n", pos)
+            end = len(script) if end == -1 else end
+            delimiter = script[pos:end].strip() or ";"
+            pos = start = end
+            continue
+        has_code = True
+        if token == "BEGIN":
+            following, _ = _next_token(script, pos)
+            # BEGIN and BEGIN WORK on their own start a transaction
+            if following not in (None, "WORK", delimiter.upper()):
+                depth += 1
+        elif token == "CASE":
+            depth += 1
+        elif token == "END" and depth:
+            following, end = _next_token(script, pos)
+            if following == "CASE":
+                pos = end
+                depth -= 1
+            elif following not in _END_SUFFIXES:
+                depth -= 1
+    if has_code:
+        yield script[start:].strip()
+
+
+def split_statements(script, db_type="sqlite"):
+    """The statements of a script, each without its delimiter."""
+    if db_type == "sqlite":
+        return _split_sqlite(script)
+    return _split_mariadb(script)
 
 
 def executescript(schema_sql):
     db = get_db()
-    sql_command = schema_sql.split(";")
-    for statement in sql_command:
-        # Strip any whitespace or newlines at the end
-        statement = statement.strip()
-        if statement:  # Avoid executing empty statements
-            db.execute(text(statement))
+    for statement in split_statements(schema_sql, get_db_type(db)):
+        db.execute(text(statement))
     db.commit()
 
 
-def init_db():
-    db = get_db()
+def get_db_type(db=None) -> str:
+    if db is None:
+        db = get_db()
     driver_name = db.engine.url.drivername
     # this gives 'sqlite', 'mysql', 'postgresql', etc.
     db_type = driver_name.split("+")[0]
     match db_type:
         case "sqlite":
-            sql_file = "schema_sqlite.sql"
+            return "sqlite"
         case "mysql" | "mariadb":  # treat mariadb as mysql for schema purposes
-            sql_file = "schema_mariadb.sql"
+            return "mariadb"
         case _:
             raise ValueError(f"Unsupported DB type: {db_type}")
 
+
+def init_db():
+    sql_file = f"schema_{get_db_type()}.sql"
+
     with current_app.open_resource(sql_file) as f:
         schema_sql = f.read().decode("utf8")
         executescript(schema_sql)
 
+    from flaskr.migrate import stamp
+
+    # the schema file is always the latest migration
+    stamp(get_db())
+
 
 @click.command("init-db")
 def init_db_command():
@@ -51,21 +245,111 @@ def init_db_command():
     click.echo("Initialized the database.")
 
 
-def init_app(app):
-    app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
+def create_sqlite_engine(app, db_uri, pool_size=None, max_overflow=None):
+    pool = app.config.get("SQLITE_POOL", "queue")
+    database = make_url(db_uri).database
+    if pool == "queue" and database in (None, "", ":memory:"):
+        # every pooled connection would get its own empty in-memory database
+        pool = "singleton"
+
+    match pool:
+        case "queue":
+            engine = create_engine(
+                db_uri,
+                poolclass=QueuePool,
+                pool_size=pool_size or app.config.get("SQLITE_POOL_SIZE", 5),
+                max_overflow=(
+                    app.config.get("SQLITE_MAX_OVERFLOW", 5)
+                    if max_overflow is None
+                    else max_overflow
+                ),
+            )
+        case "singleton":
+            engine = create_engine(db_uri, poolclass=SingletonThreadPool)
+        case "null":
+            engine = create_engine(db_uri, poolclass=NullPool)
+        case _:
+            raise ValueError(f"Unsupported SQLite pool: {pool}")
+
+    set_sqlite_pragmas(app, engine)
+    return engine
+
+
+def set_sqlite_pragmas(app, engine):
+    pragmas = []
+    if app.config.get("SQLITE_BUSY_TIMEOUT") is not None:
+        # set first, so switching journal mode already waits on a locked file
+        pragmas.append(
+            f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT'])}"
+        )
+    if app.config.get("SQLITE_JOURNAL_MODE"):
+        pragmas.append(f"PRAGMA journal_mode = {app.config['SQLITE_JOURNAL_MODE']}")
+    if app.config.get("SQLITE_SYNCHRONOUS"):
+        pragmas.append(f"PRAGMA synchronous = {app.config['SQLITE_SYNCHRONOUS']}")
+    if app.config.get("SQLITE_CACHE_SIZE") is not None:
+        pragmas.append(f"PRAGMA cache_size = {int(app.config['SQLITE_CACHE_SIZE'])}")
+    if app.config.get("SQLITE_MMAP_SIZE") is not None:
+        pragmas.append(f"PRAGMA mmap_size = {int(app.config['SQLITE_MMAP_SIZE'])}")
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def create_db_engine(app, db_uri, pool_size=None, max_overflow=None):
+    if db_uri.startswith("sqlite"):
+        return create_sqlite_engine(app, db_uri, pool_size, max_overflow)
+    return create_engine(
+        db_uri,
+        # Number of connections to keep open
+        pool_size=pool_size or 5,
+        # Number of extra connections to open if needed
+        max_overflow=5 if max_overflow is None else max_overflow,
+        pool_pre_ping=True,  # Check connection before using it
+    )
+
+
+def create_replica_engines(app):
+    engines = []
+    for replica in app.config.get("SQLALCHEMY_REPLICA_URIS") or ():
+        # a plain URI, or a dict with its own pool_size and max_overflow
+        if isinstance(replica, str):
+            replica = {"uri": replica}
+        engines.append(
+            create_db_engine(
+                app,
+                replica["uri"],
+                replica.get(
+                    "pool_size", app.config.get("SQLALCHEMY_REPLICA_POOL_SIZE")
+                ),
+                replica.get(
+                    "max_overflow", app.config.get("SQLALCHEMY_REPLICA_MAX_OVERFLOW")
+                ),
+            )
+        )
+    return engines
+
+
+def create_primary_engine(app):
     db_uri = app.config.get(
         "SQLALCHEMY_DATABASE_URI", f"sqlite:///{app.config['SQLITE_PATH']}"
     )
     if db_uri.startswith("sqlite"):
-        app.db_pool = create_engine(db_uri, poolclass=NullPool)  # No pooling for SQLite
-    else:
-        app.db_pool = create_engine(
-            app.config.get(
-                "SQLALCHEMY_DATABASE_URI",
-                f"sqlite:///{app.config['SQLITE_PATH']}",
-            ),
-            pool_size=5,  # Number of connections to keep open
-            max_overflow=5,  # Number of extra connections to open if needed
-            pool_pre_ping=True,  # Check connection before using it
-        )
+        return create_sqlite_engine(app, db_uri)
+    return create_db_engine(
+        app,
+        db_uri,
+        app.config.get("SQLALCHEMY_POOL_SIZE"),
+        app.config.get("SQLALCHEMY_MAX_OVERFLOW"),
+    )
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+    app.cli.add_command(init_db_command)
+    # a worker that is started and stopped again never pays for the engines
+    app.db_pool = None
+    app.db_replicas = None
@@ -1,10 +1,20 @@
-from flask import Blueprint, flash, g, redirect, render_template, request, url_for
-from sqlalchemy import text
-
+from flask import (
+    Blueprint,
+    current_app,
+    flash,
+    g,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+
+from flaskr import queries
 from flaskr.auth import login_required
-from flaskr.db import get_db
-from flaskr.blog import get_post
-from flaskr.turnstile import cf_turnstile_required
+from flaskr.db import get_db, get_read_db
+from flaskr.blog import get_post, render_listing
+from flaskr.page_cache import invalidate_pages
+from flaskr.turnstile import allow_retry, cf_turnstile_required
 
 bp = Blueprint("manage", __name__, url_prefix="/manage")
 
@@ -22,16 +32,17 @@ def index():
         flash(f"You don't had permission to access {request.path}")
         return redirect(url_for("index"))
     try:
-        db = get_db()
+        db = get_read_db()
+        # rows are read in chunks while the template renders, so memory
+        # stays flat however many posts there are
         posts = db.execute(
-            text(
-                "SELECT p.id, title, body, created, author_id, username "
-                "FROM post p JOIN user u ON p.author_id = u.id "
-                "ORDER BY created DESC"
+            queries.all_posts.execution_options(
+                stream_results=True,
+                yield_per=current_app.config.get("STREAM_CHUNK_SIZE", 500),
             )
-        ).fetchall()
+        )
 
-        return render_template("manage/index.html", posts=posts)
+        return render_listing("manage/index.html", posts=posts)
     except Exception as e:
         flash(f"System error {e}")
 
@@ -56,14 +67,16 @@ def update(id):
 
         if not title:
             flash("Title is required.")
+            allow_retry()
         else:
             try:
                 db = get_db()
                 db.execute(
-                    text("UPDATE post SET title = :title, body = :body WHERE id = :id"),
-                    {"title": title, "body": body, "id": id},
+                    queries.update_post,
+                    {"title": title, "body": body, "post_id": id},
                 )
                 db.commit()
+                invalidate_pages()
                 return redirect(url_for("manage.index"))
             except Exception as e:
                 flash(f"System error {e}")
@@ -85,10 +98,126 @@ def delete(id):
 
     try:
         db = get_db()
-        db.execute(text("DELETE FROM post WHERE id = :id"), {"id": id})
+        db.execute(queries.delete_post, {"post_id": id})
         db.commit()
+        invalidate_pages()
+        return redirect(url_for("manage.index"))
+    except Exception as e:
+        flash(f"System error {e}")
+
+    return redirect(url_for("manage.index"))
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def bulk_delete(db, ids, chunk_size):
+    """Yields (ids done, posts deleted) after each chunk."""
+    deleted = 0
+    for number, chunk in enumerate(chunked(ids, chunk_size), 1):
+        deleted += db.execute(queries.delete_posts, {"ids": chunk}).rowcount
+        done = min(number * chunk_size, len(ids))
+        current_app.logger.info(
+            "bulk delete: chunk %d, %d/%d posts", number, done, len(ids)
+        )
+        yield done, deleted
+
+
+def bulk_update(db, ids, values, chunk_size):
+    """Yields (ids done, posts updated) after each chunk."""
+    updated = 0
+    for number, chunk in enumerate(chunked(ids, chunk_size), 1):
+        updated += db.execute(queries.update_posts, {"ids": chunk, **values}).rowcount
+        done = min(number * chunk_size, len(ids))
+        current_app.logger.info(
+            "bulk update: chunk %d, %d/%d posts", number, done, len(ids)
+        )
+        yield done, updated
+
+
+@bp.route("/bulk", methods=("POST",))
+@login_required
+@cf_turnstile_required
+def bulk():
+    if is_admin() is False:
+        flash("You don't had permission todo this operation")
+        return redirect(url_for("index"))
+
+    action = request.form.get("action")
+    ids = sorted(set(request.form.getlist("ids", type=int)))
+    chunk_size = current_app.config.get("BULK_CHUNK_SIZE", 500)
+
+    if not ids:
+        flash("No post selected.")
         return redirect(url_for("manage.index"))
+
+    values = {}
+    if action == "update":
+        # blank fields are left as they are
+        for column in ("title", "body"):
+            if request.form.get(column):
+                values[column] = request.form.get(column)
+        if not values:
+            flash("Title or body is required.")
+            return redirect(url_for("manage.index"))
+    elif action != "delete":
+        flash(f"Unknown bulk action {action}")
+        return redirect(url_for("manage.index"))
+
+    db = get_db()
+    done = count = 0
+    try:
+        # every chunk runs in the same transaction, all or nothing
+        if action == "delete":
+            progress = bulk_delete(db, ids, chunk_size)
+        else:
+            progress = bulk_update(db, ids, values, chunk_size)
+        for done, count in progress:
+            pass
+        db.commit()
+        invalidate_pages()
+        verb = "Deleted" if action == "delete" else "Updated"
+        flash(f"{verb} {count} of {len(ids)} selected posts, {chunk_size} per chunk.")
+    except Exception as e:
+        db.rollback()
+        flash(f"System error {e}, rolled back at {done} of {len(ids)} posts.")
+
+    return redirect(url_for("manage.index"))
+
+
+@bp.route("/delete_by_author", methods=("POST",))
+@login_required
+@cf_turnstile_required
+def delete_by_author():
+    if is_admin() is False:
+        flash("You don't had permission todo this operation")
+        return redirect(url_for("index"))
+
+    username = request.form.get("username")
+    if not username:
+        flash("Username is required.")
+        return redirect(url_for("manage.index"))
+
+    db = get_db()
+    try:
+        author_id = db.execute(
+            queries.user_id_by_username, {"username": username}
+        ).scalar_one_or_none()
+        if author_id is None:
+            flash(f"User {username} doesn't exist.")
+            return redirect(url_for("manage.index"))
+
+        # one statement, the ids never leave the database
+        count = db.execute(
+            queries.delete_posts_by_author, {"author_id": author_id}
+        ).rowcount
+        db.commit()
+        invalidate_pages()
+        flash(f"Deleted {count} posts by {username}.")
     except Exception as e:
+        db.rollback()
         flash(f"System error {e}")
 
     return redirect(url_for("manage.index"))
@@ -0,0 +1,346 @@
+import atexit
+import contextlib
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import (
+    before_render_template,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+from werkzeug.exceptions import NotFound, Unauthorized
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# the summed counters of workers that are gone
+RETAINED = "retained.json"
+
+# phases reported in the Server-Timing header, in this order
+PHASES = ("db", "template", "turnstile")
+
+
+class Metrics:
+    """Counters of one worker process, flushed to a file per process so the
+    /metrics endpoint can add up every worker sharing the directory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._last_flush = 0.0
+        self._pid = None
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                [name, list(labels), value]
+                for (name, labels), value in self._values.items()
+            ]
+
+    def flush(self, path, force=False, interval=1.0):
+        now = time.monotonic()
+        if not force and now - self._last_flush < interval:
+            return
+        self._last_flush = now
+        os.makedirs(path, exist_ok=True)
+        name = f"{os.getpid()}.json"
+        if self._pid != os.getpid():
+            # a file under our pid was left by a dead process that had it
+            # before, its counts are kept instead of overwritten
+            self._pid = os.getpid()
+            with _locked(path):
+                retire(path, name)
+        _write(path, name, self.snapshot())
+
+    def close(self, path):
+        """Flush one last time and hand the counts over to the retained
+        totals, called when the worker exits."""
+        self.flush(path, force=True)
+        with _locked(path):
+            retire(path, f"{os.getpid()}.json")
+
+
+@contextlib.contextmanager
+def _locked(path):
+    with open(os.path.join(path, ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _read(filename):
+    try:
+        with open(filename, "r", encoding="utf8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _write(path, name, values):
+    fd, tmp_path = tempfile.mkstemp(dir=path, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf8") as f:
+        json.dump(values, f)
+    os.replace(tmp_path, os.path.join(path, name))
+
+
+def _add(totals, values):
+    for metric, labels, value in values:
+        key = (metric, tuple(labels))
+        totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def retire(path, name):
+    """Add a worker's file to the retained totals and remove it, the caller
+    holds the lock."""
+    values = _read(os.path.join(path, name))
+    if values:
+        totals = _add(_add({}, _read(os.path.join(path, RETAINED))), values)
+        _write(
+            path,
+            RETAINED,
+            [
+                [metric, list(labels), value]
+                for (metric, labels), value in totals.items()
+            ],
+        )
+    try:
+        os.unlink(os.path.join(path, name))
+    except OSError:
+        pass
+
+
+def _alive(pid) -> bool:
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def record_timing(phase, seconds):
+    if has_request_context():
+        timings = g.setdefault("timings", {})
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - start)
+
+
+def _endpoint():
+    return request.endpoint or "none"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if not has_request_context():
+        return
+    record_timing("db", elapsed)
+    g.db_queries = g.get("db_queries", 0) + 1
+
+    threshold = current_app.config.get("SLOW_QUERY_THRESHOLD")
+    if threshold is not None and elapsed * 1000 >= threshold:
+        current_app.metrics.inc("flaskr_db_slow_queries_total", [_endpoint()])
+        logger.warning(
+            "slow query %.1fms on %s: %s", elapsed * 1000, _endpoint(), statement
+        )
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def _before_render_template(sender, template, context, **extra):
+    g.setdefault("template_start", []).append(time.perf_counter())
+
+
+def _template_rendered(sender, template, context, **extra):
+    starts = g.get("template_start")
+    if starts:
+        record_timing("template", time.perf_counter() - starts.pop())
+
+
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+def _record(app, state, labels, total):
+    timings = state.get("timings", {})
+    endpoint = labels[0]
+    metrics = app.metrics
+
+    metrics.inc("flaskr_requests_total", labels)
+    metrics.inc("flaskr_request_duration_seconds_sum", [endpoint], total)
+    metrics.inc("flaskr_request_duration_seconds_count", [endpoint])
+    metrics.inc("flaskr_db_queries_total", [endpoint], state.get("db_queries", 0))
+    for phase in PHASES:
+        if phase in timings:
+            metrics.inc(
+                f"flaskr_{phase}_duration_seconds_total", [endpoint], timings[phase]
+            )
+
+    path = app.config.get("METRICS_DIR")
+    if path:
+        metrics.flush(path, interval=app.config.get("METRICS_FLUSH_INTERVAL", 1.0))
+
+
+def _record_request(response):
+    start = g.get("request_start")
+    if start is None:
+        return response
+    app = current_app._get_current_object()
+    state = g._get_current_object()
+    labels = [_endpoint(), request.method, str(response.status_code)]
+
+    if response.is_streamed:
+        # the body is rendered, and its rows read, after this, so the request
+        # is counted once it's sent and there is no header to report it in
+        response.call_on_close(
+            lambda: _record(app, state, labels, time.perf_counter() - start)
+        )
+        return response
+
+    total = time.perf_counter() - start
+    _record(app, state, labels, total)
+    if current_app.config.get("SERVER_TIMING_HEADER", True):
+        timings = g.get("timings", {})
+        entries = [
+            f"{phase};dur={timings[phase] * 1000:.2f}"
+            for phase in PHASES
+            if phase in timings
+        ]
+        entries.append(f"total;dur={total * 1000:.2f}")
+        response.headers["Server-Timing"] = ", ".join(entries)
+    return response
+
+
+LABEL_NAMES = {
+    "flaskr_requests_total": ("endpoint", "method", "status"),
+    "flaskr_turnstile_verify_total": ("result",),
+    "flaskr_turnstile_cache_hits_total": ("result",),
+    "flaskr_turnstile_errors_total": ("code",),
+    "flaskr_turnstile_verify_duration_seconds_sum": (),
+    "flaskr_turnstile_verify_duration_seconds_count": (),
+}
+
+METRIC_TYPES = {
+    "flaskr_requests_total": "counter",
+    "flaskr_request_duration_seconds": "summary",
+    "flaskr_db_queries_total": "counter",
+    "flaskr_db_slow_queries_total": "counter",
+    "flaskr_db_duration_seconds_total": "counter",
+    "flaskr_template_duration_seconds_total": "counter",
+    "flaskr_turnstile_duration_seconds_total": "counter",
+    "flaskr_turnstile_verify_total": "counter",
+    "flaskr_turnstile_verify_duration_seconds": "summary",
+    "flaskr_turnstile_cache_hits_total": "counter",
+    "flaskr_turnstile_errors_total": "counter",
+}
+
+
+def collect(path=None):
+    totals = {}
+    if path:
+        current_app.metrics.flush(path, force=True)
+        with _locked(path):
+            for name in sorted(os.listdir(path)):
+                if not name.endswith(".json"):
+                    continue
+                pid = name.removesuffix(".json")
+                # a worker killed before it could retire its own file
+                if pid.isdigit() and not _alive(int(pid)):
+                    retire(path, name)
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".json"):
+                    _add(totals, _read(os.path.join(path, name)))
+    else:
+        for metric, labels, value in current_app.metrics.snapshot():
+            totals[(metric, tuple(labels))] = value
+    return totals
+
+
+def render_prometheus(totals) -> str:
+    lines = []
+    typed = set()
+    for (metric, labels), value in sorted(totals.items()):
+        family = metric.removesuffix("_sum").removesuffix("_count")
+        if METRIC_TYPES.get(family) != "summary":
+            family = metric
+        if family not in typed:
+            lines.append(f"# TYPE {family} {METRIC_TYPES.get(family, 'untyped')}")
+            typed.add(family)
+        names = LABEL_NAMES.get(metric, ("endpoint",))
+        label_text = ",".join(
+            f'{name}="{value_}"' for name, value_ in zip(names, labels)
+        )
+        if label_text:
+            lines.append(f"{metric}{{{label_text}}} {value}")
+        else:
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    config = current_app.config
+    if not config.get("METRICS_ENDPOINT", False):
+        raise NotFound()
+    token = config.get("METRICS_TOKEN")
+    if token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        raise Unauthorized()
+    totals = collect(current_app.config.get("METRICS_DIR"))
+    return current_app.response_class(
+        render_prometheus(totals), mimetype="text/plain; version=0.0.4"
+    )
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def init_app(app):
+    app.metrics = Metrics()
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    if app.config.get("METRICS_DIR"):
+        atexit.register(app.metrics.close, app.config["METRICS_DIR"])
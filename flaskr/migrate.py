@@ -0,0 +1,259 @@
+import os
+import re
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    delete,
+    func,
+    insert,
+    select,
+    text,
+    update,
+)
+
+from flaskr.db import get_db, get_db_type, split_statements
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+# <version>_<name>.<up|down|backfill>.sql, one folder per dialect
+FILENAME_RE = re.compile(r"^(\d+)_(\w+)\.(up|down|backfill)\.sql$")
+# first line of a backfill, the integer key walked in ranges
+BATCH_RE = re.compile(r"^--\s*batch:\s*(\w+)\.(\w+)\s*$", re.MULTILINE)
+
+metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+    # NULL while a backfill is still running, or was interrupted
+    Column("backfilled_at", DateTime),
+)
+
+
+class Migration:
+    def __init__(self, version, name):
+        self.version = version
+        self.name = name
+        self.scripts = {}
+
+    def __repr__(self):
+        return f"<Migration {self.version:04d}_{self.name}>"
+
+    def read(self, kind):
+        path = self.scripts.get(kind)
+        if path is None:
+            return None
+        with open(path, "r", encoding="utf8") as f:
+            return f.read()
+
+
+def load_migrations(db_type, migrations_dir=None) -> list[Migration]:
+    migrations = {}
+    path = os.path.join(migrations_dir or MIGRATIONS_DIR, db_type)
+    for filename in os.listdir(path):
+        match = FILENAME_RE.match(filename)
+        if match is None:
+            continue
+        version, name, kind = int(match[1]), match[2], match[3]
+        migration = migrations.setdefault(version, Migration(version, name))
+        if migration.name != name:
+            raise ValueError(f"Two migrations share version {version}")
+        migration.scripts[kind] = os.path.join(path, filename)
+
+    for migration in migrations.values():
+        if "up" not in migration.scripts:
+            raise ValueError(f"{migration} has no up script")
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def get_migrations(db):
+    return load_migrations(get_db_type(db), current_app.config.get("MIGRATIONS_DIR"))
+
+
+def applied_migrations(db) -> dict:
+    metadata.create_all(db, checkfirst=True)
+    rows = db.execute(select(schema_version)).fetchall()
+    db.commit()
+    return {row.version: row for row in rows}
+
+
+def run_script(db, script):
+    for statement in split_statements(script, get_db_type(db)):
+        db.exec_driver_sql(statement)
+
+
+def run_backfill(db, migration, batch_size=1000, pause=0.0):
+    # each range is its own short transaction and the pause between them
+    # leaves room for the app's writes, the table is never locked for long
+    script = migration.read("backfill")
+    match = BATCH_RE.search(script)
+    if match is None:
+        raise ValueError(f"{migration} backfill has no '-- batch: table.column'")
+    table, column = match[1], match[2]
+    statement = text(script.strip().rstrip(";"))
+
+    first, last = db.execute(
+        text(f"SELECT MIN({column}), MAX({column}) FROM {table}")
+    ).one()
+    db.commit()
+    if first is not None:
+        for start in range(first, last + 1, batch_size):
+            result = db.execute(statement, {"start": start, "end": start + batch_size})
+            db.commit()
+            yield min(start + batch_size - 1, last), result.rowcount
+            if pause:
+                time.sleep(pause)
+
+    db.execute(
+        update(schema_version)
+        .where(schema_version.c.version == migration.version)
+        .values(backfilled_at=func.now())
+    )
+    db.commit()
+
+
+def upgrade(db, target=None, batch_size=1000, pause=0.0):
+    """Apply pending migrations up to target, yields progress messages."""
+    applied = applied_migrations(db)
+    for migration in get_migrations(db):
+        if target is not None and migration.version > target:
+            break
+        row = applied.get(migration.version)
+        if row is None:
+            yield f"Applying {migration.version:04d}_{migration.name}"
+            run_script(db, migration.read("up"))
+            # DDL commits on its own in MariaDB, the version is recorded
+            # right after so a failed backfill isn't applied twice
+            db.execute(
+                insert(schema_version).values(
+                    version=migration.version,
+                    name=migration.name,
+                    applied_at=func.now(),
+                    backfilled_at=(
+                        None if "backfill" in migration.scripts else func.now()
+                    ),
+                )
+            )
+            db.commit()
+        elif row.backfilled_at is not None:
+            continue
+
+        if "backfill" in migration.scripts:
+            yield f"Backfilling {migration.version:04d}_{migration.name}"
+            total = 0
+            for last_id, updated in run_backfill(db, migration, batch_size, pause):
+                total += updated
+                yield f"  up to {last_id}, {total} rows updated"
+
+
+def downgrade(db, target=None):
+    """Revert applied migrations down to target, one step by default."""
+    applied = applied_migrations(db)
+    if target is None:
+        target = max(applied, default=1) - 1
+    for migration in reversed(get_migrations(db)):
+        if migration.version <= target or migration.version not in applied:
+            continue
+        script = migration.read("down")
+        if script is None:
+            raise click.ClickException(f"{migration} can't be reverted")
+        yield f"Reverting {migration.version:04d}_{migration.name}"
+        run_script(db, script)
+        db.execute(
+            delete(schema_version).where(
+                schema_version.c.version == bindparam("version")
+            ),
+            {"version": migration.version},
+        )
+        db.commit()
+
+
+def stamp(db, version=None):
+    """Record migrations up to version as applied without running them."""
+    migrations = get_migrations(db)
+    if version is None:
+        version = migrations[-1].version if migrations else 0
+    metadata.drop_all(db, checkfirst=True)
+    metadata.create_all(db)
+    for migration in migrations:
+        if migration.version <= version:
+            db.execute(
+                insert(schema_version).values(
+                    version=migration.version,
+                    name=migration.name,
+                    applied_at=func.now(),
+                    backfilled_at=func.now(),
+                )
+            )
+    db.commit()
+
+
+def status(db):
+    applied = applied_migrations(db)
+    for migration in get_migrations(db):
+        row = applied.get(migration.version)
+        if row is None:
+            state = "pending"
+        elif row.backfilled_at is None and "backfill" in migration.scripts:
+            state = f"applied {row.applied_at}, backfill pending"
+        else:
+            state = f"applied {row.applied_at}"
+        yield f"{migration.version:04d}_{migration.name:30} {state}"
+
+
+db_cli = AppGroup("db", help="Versioned schema migrations.")
+
+
+@db_cli.command("upgrade")
+@click.option("--to", "target", type=int, help="Stop at this version.")
+@click.option("--batch-size", type=int, help="Rows per backfill transaction.")
+@click.option("--pause", type=float, help="Seconds to sleep between batches.")
+def upgrade_command(target, batch_size, pause):
+    """Apply pending migrations."""
+    config = current_app.config
+    for message in upgrade(
+        get_db(),
+        target,
+        batch_size or config.get("MIGRATION_BATCH_SIZE", 1000),
+        config.get("MIGRATION_BATCH_PAUSE", 0.0) if pause is None else pause,
+    ):
+        click.echo(message)
+    click.echo("Database is up to date.")
+
+
+@db_cli.command("downgrade")
+@click.option("--to", "target", type=int, help="Revert down to this version.")
+def downgrade_command(target):
+    """Revert the last migration, or down to a version."""
+    for message in downgrade(get_db(), target):
+        click.echo(message)
+
+
+@db_cli.command("stamp")
+@click.argument("version", type=int, required=False)
+def stamp_command(version):
+    """Mark a database made before migrations as being at a version."""
+    stamp(get_db(), version)
+    click.echo("Stamped the database.")
+
+
+@db_cli.command("status")
+def status_command():
+    """Show applied and pending migrations."""
+    for line in status(get_db()):
+        click.echo(line)
+
+
+def init_app(app):
+    app.cli.add_command(db_cli)
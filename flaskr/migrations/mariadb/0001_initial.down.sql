@@ -0,0 +1,2 @@
+DROP TABLE IF EXISTS `post`;
+DROP TABLE IF EXISTS `user`;
@@ -0,0 +1,16 @@
+CREATE TABLE `user` (
+  `id` INT AUTO_INCREMENT PRIMARY KEY,
+  `username` VARCHAR(255) UNIQUE NOT NULL,
+  `password` VARCHAR(255) NOT NULL
+)ENGINE=InnoDB;
+
+CREATE TABLE `post` (
+  `id` INT AUTO_INCREMENT PRIMARY KEY,
+  `author_id` INT NOT NULL,
+  `created` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `title` VARCHAR(255) NOT NULL,
+  `body` TEXT NOT NULL,
+  FOREIGN KEY (`author_id`) REFERENCES `user` (`id`),
+  INDEX `idx_post_created_id` (`created`, `id`),
+  FULLTEXT INDEX `ft_post_title_body` (`title`, `body`)
+)ENGINE=InnoDB;
\ No newline at end of file
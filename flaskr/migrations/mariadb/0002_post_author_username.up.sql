@@ -0,0 +1,14 @@
+ALTER TABLE `post` ADD COLUMN `author_username` VARCHAR(255) NULL;
+
+-- author_username copies user.username so listings don't join user, writers
+-- may leave it out and get it filled in
+CREATE TRIGGER `post_author_username_insert` BEFORE INSERT ON `post` FOR EACH ROW BEGIN
+  SET NEW.`author_username` = COALESCE(
+    NEW.`author_username`,
+    (SELECT `username` FROM `user` WHERE `id` = NEW.`author_id`)
+  );
+END;
+
+CREATE TRIGGER `user_username_update` AFTER UPDATE ON `user` FOR EACH ROW BEGIN
+  UPDATE `post` SET `author_username` = NEW.`username` WHERE `author_id` = NEW.`id`;
+END;
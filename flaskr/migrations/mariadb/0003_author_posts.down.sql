@@ -0,0 +1,10 @@
+DROP TRIGGER IF EXISTS `post_count_delete`;
+DROP TRIGGER IF EXISTS `post_count_insert`;
+DROP TRIGGER IF EXISTS `user_username_update`;
+
+CREATE TRIGGER `user_username_update` AFTER UPDATE ON `user` FOR EACH ROW BEGIN
+  UPDATE `post` SET `author_username` = NEW.`username` WHERE `author_id` = NEW.`id`;
+END;
+
+DROP INDEX `idx_post_author_created_id` ON `post`;
+ALTER TABLE `user` DROP COLUMN `post_count`;
@@ -0,0 +1,23 @@
+ALTER TABLE `user` ADD COLUMN `post_count` INT NOT NULL DEFAULT 0;
+
+CREATE INDEX `idx_post_author_created_id` ON `post` (`author_id`, `created`, `id`);
+
+-- the post_count triggers update user, which fires this trigger, it may only
+-- touch post when the username really changed
+DROP TRIGGER IF EXISTS `user_username_update`;
+
+CREATE TRIGGER `user_username_update` AFTER UPDATE ON `user` FOR EACH ROW BEGIN
+  IF NEW.`username` <> OLD.`username` THEN
+    UPDATE `post` SET `author_username` = NEW.`username` WHERE `author_id` = NEW.`id`;
+  END IF;
+END;
+
+-- post_count is kept by triggers so every writer, bulk deletes and imports
+-- included, keeps it right and nothing has to COUNT(*) posts
+CREATE TRIGGER `post_count_insert` AFTER INSERT ON `post` FOR EACH ROW BEGIN
+  UPDATE `user` SET `post_count` = `post_count` + 1 WHERE `id` = NEW.`author_id`;
+END;
+
+CREATE TRIGGER `post_count_delete` AFTER DELETE ON `post` FOR EACH ROW BEGIN
+  UPDATE `user` SET `post_count` = `post_count` - 1 WHERE `id` = OLD.`author_id`;
+END;
@@ -0,0 +1,3 @@
+DROP TABLE IF EXISTS post_fts;
+DROP TABLE IF EXISTS post;
+DROP TABLE IF EXISTS user;
@@ -0,0 +1,36 @@
+CREATE TABLE user (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL
+);
+
+CREATE TABLE post (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+CREATE INDEX idx_post_created_id ON post (created, id);
+
+CREATE VIRTUAL TABLE post_fts USING fts5(
+  title,
+  body,
+  content='post',
+  content_rowid='id'
+);
+
+CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+
+CREATE TRIGGER post_fts_update AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
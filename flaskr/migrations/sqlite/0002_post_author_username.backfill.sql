@@ -0,0 +1,3 @@
+-- batch: post.id
+UPDATE post SET author_username = (SELECT username FROM user WHERE id = post.author_id)
+WHERE id >= :start AND id < :end AND author_username IS NULL;
@@ -0,0 +1,3 @@
+DROP TRIGGER IF EXISTS user_username_update;
+DROP TRIGGER IF EXISTS post_author_username_insert;
+ALTER TABLE post DROP COLUMN author_username;
@@ -0,0 +1,13 @@
+ALTER TABLE post ADD COLUMN author_username TEXT;
+
+-- author_username copies user.username so listings don't join user, writers
+-- may leave it out and get it filled in
+CREATE TRIGGER post_author_username_insert AFTER INSERT ON post
+WHEN new.author_username IS NULL BEGIN
+  UPDATE post SET author_username = (SELECT username FROM user WHERE id = new.author_id)
+  WHERE id = new.id;
+END;
+
+CREATE TRIGGER user_username_update AFTER UPDATE OF username ON user BEGIN
+  UPDATE post SET author_username = new.username WHERE author_id = new.id;
+END;
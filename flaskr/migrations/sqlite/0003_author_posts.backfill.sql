@@ -0,0 +1,3 @@
+-- batch: user.id
+UPDATE user SET post_count = (SELECT COUNT(*) FROM post WHERE author_id = user.id)
+WHERE id >= :start AND id < :end;
@@ -0,0 +1,4 @@
+DROP TRIGGER IF EXISTS post_count_delete;
+DROP TRIGGER IF EXISTS post_count_insert;
+DROP INDEX IF EXISTS idx_post_author_created_id;
+ALTER TABLE user DROP COLUMN post_count;
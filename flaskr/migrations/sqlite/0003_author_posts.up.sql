@@ -0,0 +1,13 @@
+ALTER TABLE user ADD COLUMN post_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX idx_post_author_created_id ON post (author_id, created, id);
+
+-- post_count is kept by triggers so every writer, bulk deletes and imports
+-- included, keeps it right and nothing has to COUNT(*) posts
+CREATE TRIGGER post_count_insert AFTER INSERT ON post BEGIN
+  UPDATE user SET post_count = post_count + 1 WHERE id = new.author_id;
+END;
+
+CREATE TRIGGER post_count_delete AFTER DELETE ON post BEGIN
+  UPDATE user SET post_count = post_count - 1 WHERE id = old.author_id;
+END;
@@ -0,0 +1,279 @@
+import base64
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlencode
+
+from flask import current_app, g, request, session
+
+from flaskr import compress
+from flaskr.cache import LRUCache
+
+# the query args the cached listings read, any other arg shows the same page
+# and must not add an entry
+CACHED_ARGS = ("after", "before")
+
+
+def _write_file(filename, content):
+    # readers see the old content or the new one, never a partial write
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            f.write(content)
+        os.replace(tmp_path, filename)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def _read_generation(filename):
+    try:
+        with open(filename, "r") as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+class MemoryPageCache:
+    # values are kept as they are, other backends get json friendly ones
+    stores_bytes = True
+
+    def __init__(self, maxsize=256, ttl=None, generation_file=None):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        # kept apart from the pages so it's never evicted with them, in a
+        # file every worker reads when given one, so a write in one worker
+        # retires the pages of all of them
+        self._generation = None
+        self.generation_file = generation_file
+        if generation_file and os.path.dirname(generation_file):
+            os.makedirs(os.path.dirname(generation_file), exist_ok=True)
+
+    def get_generation(self):
+        if self.generation_file:
+            return _read_generation(self.generation_file)
+        return self._generation
+
+    def set_generation(self, generation):
+        if self.generation_file:
+            _write_file(self.generation_file, repr(generation))
+        else:
+            self._generation = generation
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class FilePageCache:
+    # one json file per entry, so every worker process sharing the
+    # directory sees the same pages and the same invalidations
+    def __init__(self, path, ttl=None, maxsize=None):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        os.makedirs(path, exist_ok=True)
+
+    def _filename(self, key):
+        name = hashlib.sha1(key.encode("utf8")).hexdigest()
+        return os.path.join(self.path, f"{name}.json")
+
+    def get(self, key):
+        try:
+            with open(self._filename(key), "r", encoding="utf8") as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if item["expires"] is not None and item["expires"] <= time.time():
+            self.delete(key)
+            return None
+        return item["value"]
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        _write_file(
+            self._filename(key), json.dumps({"expires": expires, "value": value})
+        )
+        if self.maxsize:
+            self._evict()
+
+    def _evict(self):
+        # the oldest written pages go first, expired ones are always older
+        # than live ones since they share one ttl
+        pages = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".json"):
+                try:
+                    pages.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        pages.sort()
+        for _, path in pages[: max(len(pages) - self.maxsize, 0)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def get_generation(self):
+        return _read_generation(os.path.join(self.path, "generation"))
+
+    def set_generation(self, generation):
+        _write_file(os.path.join(self.path, "generation"), repr(generation))
+
+    def delete(self, key):
+        try:
+            os.unlink(self._filename(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith(".json"):
+                try:
+                    os.unlink(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+
+def create_backend(app):
+    backend = app.config.get("PAGE_CACHE_BACKEND")
+    match backend:
+        case None | "" | "null":
+            return None
+        case "memory":
+            return MemoryPageCache(
+                maxsize=app.config.get("PAGE_CACHE_SIZE", 256),
+                ttl=app.config.get("PAGE_CACHE_TTL"),
+                generation_file=app.config.get("PAGE_CACHE_GENERATION_FILE"),
+            )
+        case "file":
+            return FilePageCache(
+                app.config.get("PAGE_CACHE_DIR")
+                or os.path.join(app.instance_path, "page_cache"),
+                ttl=app.config.get("PAGE_CACHE_TTL"),
+                maxsize=app.config.get("PAGE_CACHE_SIZE", 256),
+            )
+        case str():
+            raise ValueError(f"Unsupported page cache backend: {backend}")
+        case _:
+            # any object, or a factory taking the app, with get/set/delete/clear
+            # and get_generation/set_generation
+            return backend(app) if callable(backend) else backend
+
+
+def get_generation(backend):
+    generation = backend.get_generation()
+    if generation is None:
+        generation = time.time()
+        backend.set_generation(generation)
+    return generation
+
+
+def invalidate_pages():
+    backend = current_app.page_cache
+    if backend is not None:
+        backend.clear()
+        backend.set_generation(time.time())
+
+
+def _cache_key():
+    user = g.user["id"] if g.get("user") else "anon"
+    args = urlencode(
+        [(name, request.args[name]) for name in CACHED_ARGS if name in request.args]
+    )
+    return f"{request.path}?{args}|{user}"
+
+
+def _maybe_stale(generation) -> bool:
+    # a replica may not have the write that cleared the cache yet, a page it
+    # rendered then would be served to everyone until the next write
+    if g.get("read_db") is None:
+        return False
+    lag = current_app.config.get("REPLICA_STICKY_SECONDS", 5)
+    return time.time() - generation < lag
+
+
+def _encode_cached(backend, key, entry, response):
+    # each encoding of a page is compressed once and kept with it, later
+    # hits send the stored bytes
+    if not current_app.config.get("COMPRESS_ALGORITHMS"):
+        return
+    response.vary.add("Accept-Encoding")
+    encoding = compress.negotiate()
+    if encoding is None:
+        return
+    stores_bytes = getattr(backend, "stores_bytes", False)
+    encoded = entry.setdefault("encoded", {})
+    if encoding not in encoded:
+        data = response.get_data()
+        if len(data) < current_app.config.get("COMPRESS_MIN_SIZE", 500):
+            return
+        data = compress.compress(data, encoding, compress.level(encoding))
+        encoded[encoding] = (
+            data if stores_bytes else base64.b64encode(data).decode("ascii")
+        )
+        backend.set(key, entry)
+    data = encoded[encoding]
+    compress.set_encoded(
+        response, data if stores_bytes else base64.b64decode(data), encoding
+    )
+
+
+def cached_page(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        backend = current_app.page_cache
+        # pages carrying flashed messages are one-off, never cache them
+        if backend is None or request.method != "GET" or session.get("_flashes"):
+            return current_app.ensure_sync(view)(**kwargs)
+
+        generation = get_generation(backend)
+        key = _cache_key()
+        etag = hashlib.sha1(f"{generation}|{key}".encode("utf8")).hexdigest()
+
+        # no Last-Modified, its whole seconds can't tell two writes apart
+        # from a fetch in between
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            entry = backend.get(key)
+            if entry is not None and entry["generation"] == generation:
+                response = current_app.response_class(
+                    entry["body"], mimetype="text/html"
+                )
+            else:
+                response = current_app.make_response(
+                    current_app.ensure_sync(view)(**kwargs)
+                )
+                if response.status_code != 200 or _maybe_stale(generation):
+                    return response
+                entry = {
+                    "generation": generation,
+                    "body": response.get_data(as_text=True),
+                }
+                backend.set(key, entry)
+            _encode_cached(backend, key, entry, response)
+
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response
+
+    return wrapped_view
+
+
+def init_app(app):
+    app.page_cache = create_backend(app)
@@ -0,0 +1,133 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+# one process pool per worker process, shared by every app in it
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class PasswordHasherBusy(ServiceUnavailable):
+    description = "Too many logins in progress, please try again shortly."
+
+
+def _get_executor(workers) -> ProcessPoolExecutor:
+    key = (os.getpid(), workers)
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            # an executor inherited through fork has no threads behind it
+            executor = ProcessPoolExecutor(max_workers=workers)
+            _executors[key] = executor
+            atexit.register(executor.shutdown, wait=False, cancel_futures=True)
+    return executor
+
+
+def _discard_executor(workers):
+    with _executors_lock:
+        executor = _executors.pop((os.getpid(), workers), None)
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def normalize_method(method: str) -> str:
+    # expand werkzeug's short forms so they compare equal to a stored hash
+    match method.split(":"):
+        case ["scrypt"]:
+            return "scrypt:32768:8:1"
+        case ["pbkdf2"]:
+            return f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"
+        case ["pbkdf2", hash_name]:
+            return f"pbkdf2:{hash_name}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        method="scrypt:32768:8:1",
+        salt_length=16,
+        workers=2,
+        max_pending=32,
+        timeout=10.0,
+        retry_after=1,
+    ):
+        self.method = normalize_method(method)
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy(retry_after=self.retry_after)
+
+        try:
+            future = _get_executor(self.workers).submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            _discard_executor(self.workers)
+            raise PasswordHasherBusy(retry_after=self.retry_after)
+        except BaseException:
+            self._slots.release()
+            raise
+        # the slot stays taken until the job really finishes, even after a
+        # timeout, so max_pending bounds the work queued on the pool
+        future.add_done_callback(lambda f: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise PasswordHasherBusy(retry_after=self.retry_after)
+        except BrokenProcessPool:
+            _discard_executor(self.workers)
+            raise PasswordHasherBusy(retry_after=self.retry_after)
+
+    def hash(self, password: str) -> str:
+        return self._run(
+            generate_password_hash, password, self.method, self.salt_length
+        )
+
+    def check(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        return pwhash.split("$", 1)[0] != self.method
+
+
+def hash_password(password: str) -> str:
+    return current_app.password_hasher.hash(password)
+
+
+def check_password(pwhash: str, password: str) -> bool:
+    return current_app.password_hasher.check(pwhash, password)
+
+
+def needs_rehash(pwhash: str) -> bool:
+    return current_app.password_hasher.needs_rehash(pwhash)
+
+
+def init_app(app):
+    app.password_hasher = PasswordHasher(
+        method=app.config.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1"),
+        salt_length=app.config.get("PASSWORD_HASH_SALT_LENGTH", 16),
+        workers=app.config.get("PASSWORD_HASH_WORKERS", 2),
+        max_pending=app.config.get("PASSWORD_HASH_MAX_PENDING", 32),
+        timeout=app.config.get("PASSWORD_HASH_TIMEOUT", 10.0),
+        retry_after=app.config.get("PASSWORD_HASH_RETRY_AFTER", 1),
+    )
@@ -0,0 +1,180 @@
+import os
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    MetaData,
+    Table,
+    bindparam,
+    create_engine,
+    delete,
+    func,
+    insert,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects import sqlite
+
+from flaskr.db import split_statements
+
+# sqlite keeps CURRENT_TIMESTAMP without fractions, bound values must match
+# it for keyset comparisons on created to work
+Timestamp = DateTime().with_variant(
+    sqlite.DATETIME(
+        storage_format="%(year)04d-%(month)02d-%(day)02d "
+        "%(hour)02d:%(minute)02d:%(second)02d",
+        regexp=r"(\d+)-(\d+)-(\d+) (\d+):(\d+):(\d+)",
+    ),
+    "sqlite",
+)
+
+
+def reflect_tables(schema_path=None) -> MetaData:
+    if schema_path is None:
+        schema_path = os.path.join(os.path.dirname(__file__), "schema_sqlite.sql")
+    with open(schema_path, "r", encoding="utf8") as f:
+        schema_sql = f.read()
+
+    engine = create_engine("sqlite://")
+    metadata = MetaData()
+    with engine.begin() as conn:
+        for statement in split_statements(schema_sql):
+            conn.exec_driver_sql(statement)
+        Table("user", metadata, autoload_with=conn)
+        Table(
+            "post",
+            metadata,
+            Column(
+                "created",
+                Timestamp,
+                nullable=False,
+                server_default=func.current_timestamp(),
+            ),
+            autoload_with=conn,
+        )
+    engine.dispose()
+    return metadata
+
+
+# statements are built once at import, so SQLAlchemy's compiled cache is hit
+# on every call, the tables come from schema_sqlite.sql loaded into an
+# in-memory database and need no connection to the real one
+metadata = reflect_tables()
+user = metadata.tables["user"]
+post = metadata.tables["post"]
+
+# users
+
+user_id_by_username = select(user.c.id).where(user.c.username == bindparam("username"))
+
+user_login_by_username = select(user.c.id, user.c.password).where(
+    user.c.username == bindparam("username")
+)
+
+username_by_id = select(user.c.username).where(user.c.id == bindparam("user_id"))
+
+password_by_id = select(user.c.password).where(user.c.id == bindparam("user_id"))
+
+# post_count is a counter cache kept by triggers on post
+author_by_username = select(user.c.id, user.c.username, user.c.post_count).where(
+    user.c.username == bindparam("username")
+)
+
+post_count_by_id = select(user.c.post_count).where(user.c.id == bindparam("user_id"))
+
+insert_user = insert(user)
+
+# the SET clause of the updates comes from the column named parameters
+update_user = update(user).where(user.c.id == bindparam("user_id"))
+
+# posts
+
+# author_username is kept in step with user.username by triggers, so the
+# listings read post alone
+post_listing = select(
+    post.c.id,
+    post.c.title,
+    post.c.body,
+    post.c.created,
+    post.c.author_id,
+    post.c.author_username.label("username"),
+)
+
+newest_first = (post.c.created.desc(), post.c.id.desc())
+
+posts_first_page = post_listing.order_by(*newest_first).limit(bindparam("limit"))
+
+# older than the cursor, written so both dialects range scan
+# idx_post_created_id
+posts_after = (
+    post_listing.where(
+        post.c.created <= bindparam("created"),
+        (post.c.created < bindparam("created")) | (post.c.id < bindparam("id")),
+    )
+    .order_by(*newest_first)
+    .limit(bindparam("limit"))
+)
+
+# newer than the cursor, read oldest first and reversed by the caller
+posts_before = (
+    post_listing.where(
+        post.c.created >= bindparam("created"),
+        (post.c.created > bindparam("created")) | (post.c.id > bindparam("id")),
+    )
+    .order_by(post.c.created.asc(), post.c.id.asc())
+    .limit(bindparam("limit"))
+)
+
+# one author's feed, the same pages range scan idx_post_author_created_id
+by_author = post.c.author_id == bindparam("author_id")
+
+author_posts_first_page = posts_first_page.where(by_author)
+
+author_posts_after = posts_after.where(by_author)
+
+author_posts_before = posts_before.where(by_author)
+
+all_posts = post_listing.order_by(*newest_first)
+
+post_by_id = post_listing.where(post.c.id == bindparam("post_id"))
+
+delete_posts_by_author = delete(post).where(by_author)
+
+insert_post = insert(post)
+
+update_post = update(post).where(post.c.id == bindparam("post_id"))
+
+delete_post = delete(post).where(post.c.id == bindparam("post_id"))
+
+delete_posts = delete(post).where(post.c.id.in_(bindparam("ids", expanding=True)))
+
+update_posts = update(post).where(post.c.id.in_(bindparam("ids", expanding=True)))
+
+# full-text search, each dialect has its own syntax
+
+search_posts_sqlite = text(
+    "SELECT p.id, p.title, p.body, p.created, p.author_id, "
+    "p.author_username AS username "
+    "FROM post_fts JOIN post p ON p.id = post_fts.rowid "
+    "WHERE post_fts MATCH :q "
+    "ORDER BY bm25(post_fts), p.id DESC "
+    "LIMIT :limit OFFSET :offset"
+).columns(
+    post.c.id,
+    post.c.title,
+    post.c.body,
+    post.c.created,
+    post.c.author_id,
+    post.c.author_username.label("username"),
+)
+
+search_posts_mariadb = text(
+    "SELECT p.id, p.title, p.body, p.created, p.author_id, "
+    "p.author_username AS username, "
+    "MATCH (p.title, p.body) AGAINST (:q IN NATURAL LANGUAGE MODE) AS score "
+    "FROM post p "
+    "WHERE MATCH (p.title, p.body) AGAINST (:q IN NATURAL LANGUAGE MODE) "
+    "ORDER BY score DESC, p.id DESC "
+    "LIMIT :limit OFFSET :offset"
+)
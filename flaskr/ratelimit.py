@@ -0,0 +1,180 @@
+import functools
+import inspect
+import math
+import os
+import threading
+import time
+
+from flask import current_app, g, request
+from sqlalchemy import create_engine, text
+from werkzeug.exceptions import TooManyRequests
+
+from flaskr.cache import LRUCache
+from flaskr.db import set_sqlite_pragmas
+
+
+class RateLimited(TooManyRequests):
+    description = "Too many attempts, please try again later."
+
+
+class MemoryRateLimitStore:
+    def __init__(self, maxsize=10000):
+        # an evicted bucket comes back full, the least recently used are the
+        # ones that had the most time to refill anyway
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """Take a token from the bucket, the seconds to wait if it's empty."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets.set(key, (tokens - 1, now))
+                return 0
+            self._buckets.set(key, (tokens, now))
+        return (1 - tokens) / rate
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class SqliteRateLimitStore:
+    # the refill and the take are one upsert, so workers sharing the file
+    # never race each other on the same bucket
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS rate_limit ("
+        " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL,"
+        " taken INTEGER NOT NULL)"
+    )
+    TAKE = text(
+        "INSERT INTO rate_limit (key, tokens, updated, taken) "
+        "VALUES (:key, :capacity - 1, :now, 1) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "tokens = MIN(:capacity, tokens + (:now - updated) * :rate)"
+        " - (MIN(:capacity, tokens + (:now - updated) * :rate) >= 1), "
+        "taken = MIN(:capacity, tokens + (:now - updated) * :rate) >= 1, "
+        "updated = :now "
+        "RETURNING tokens, taken"
+    )
+
+    PRUNE = text("DELETE FROM rate_limit WHERE updated < :cutoff")
+
+    def __init__(self, app, path, max_age=None, prune_interval=60):
+        self.engine = create_engine(f"sqlite:///{path}")
+        set_sqlite_pragmas(app, self.engine)
+        # a bucket left alone for its whole window is full again, the same
+        # as no row, so those rows are deleted every prune_interval
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(self.SCHEMA)
+
+    def take(self, key, capacity, rate):
+        now = time.time()
+        with self.engine.begin() as conn:
+            tokens, taken = conn.execute(
+                self.TAKE,
+                {"key": key, "capacity": capacity, "rate": rate, "now": now},
+            ).one()
+            if self.max_age is not None and now >= self._next_prune:
+                self._next_prune = now + self.prune_interval
+                conn.execute(self.PRUNE, {"cutoff": now - self.max_age})
+        if taken:
+            return 0
+        return (1 - tokens) / rate
+
+    def clear(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM rate_limit")
+
+
+def create_store(app):
+    backend = app.config.get("RATELIMIT_BACKEND")
+    match backend:
+        case None | "" | "null":
+            return None
+        case "memory":
+            return MemoryRateLimitStore(
+                maxsize=app.config.get("RATELIMIT_CACHE_SIZE", 10000)
+            )
+        case "sqlite":
+            windows = [
+                limit[1]
+                for limit in (
+                    app.config.get("RATELIMIT_PER_IP"),
+                    app.config.get("RATELIMIT_PER_USERNAME"),
+                )
+                if limit
+            ]
+            return SqliteRateLimitStore(
+                app,
+                app.config.get("RATELIMIT_DB_PATH")
+                or os.path.join(app.instance_path, "ratelimit.sqlite"),
+                max_age=max(windows, default=None),
+                prune_interval=app.config.get("RATELIMIT_PRUNE_INTERVAL", 60),
+            )
+        case str():
+            raise ValueError(f"Unsupported rate limit backend: {backend}")
+        case _:
+            # any object, or a factory taking the app, with take/clear
+            return backend(app) if callable(backend) else backend
+
+
+def client_ip():
+    header = current_app.config.get("CLIENT_IP_HEADER")
+    if header and request.headers.get(header):
+        return request.headers[header].strip()
+    # the proxy's address unless PROXY_FIX says who to trust
+    return request.remote_addr
+
+
+def _buckets():
+    # (key, limit), a limit is (requests, seconds) or None, the bucket holds
+    # up to `requests` tokens and refills them over `seconds`
+    yield f"ip:{client_ip()}", current_app.config.get("RATELIMIT_PER_IP")
+    username = request.form.get("username")
+    if not username and g.get("user"):
+        # a signed in user's own forms count against their name too
+        username = g.user["username"]
+    if username:
+        yield f"user:{username}", current_app.config.get("RATELIMIT_PER_USERNAME")
+
+
+def check_rate_limit():
+    store = current_app.rate_limit_store
+    if store is None or request.method != "POST":
+        return
+    for key, limit in _buckets():
+        if not limit:
+            continue
+        count, seconds = limit
+        wait = store.take(key, count, count / seconds)
+        if wait:
+            raise RateLimited(retry_after=math.ceil(wait))
+
+
+def rate_limited(view):
+    """Refuse POSTs over the per-IP and per-username limits with a 429,
+    before turnstile and password hashing get to spend anything on them."""
+    if inspect.iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapped_view(**kwargs):
+            check_rate_limit()
+            return await view(**kwargs)
+
+        return async_wrapped_view
+
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        check_rate_limit()
+        return view(**kwargs)
+
+    return wrapped_view
+
+
+def init_app(app):
+    app.rate_limit_store = create_store(app)
@@ -4,7 +4,8 @@ DROP TABLE IF EXISTS `user`;
 CREATE TABLE `user` (
   `id` INT AUTO_INCREMENT PRIMARY KEY,
   `username` VARCHAR(255) UNIQUE NOT NULL,
-  `password` VARCHAR(255) NOT NULL
+  `password` VARCHAR(255) NOT NULL,
+  `post_count` INT NOT NULL DEFAULT 0
 )ENGINE=InnoDB;
 
 CREATE TABLE `post` (
@@ -13,5 +14,36 @@ CREATE TABLE `post` (
   `created` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `title` VARCHAR(255) NOT NULL,
   `body` TEXT NOT NULL,
-  FOREIGN KEY (`author_id`) REFERENCES `user` (`id`)
-)ENGINE=InnoDB;
\ No newline at end of file
+  `author_username` VARCHAR(255) NULL,
+  FOREIGN KEY (`author_id`) REFERENCES `user` (`id`),
+  INDEX `idx_post_created_id` (`created`, `id`),
+  INDEX `idx_post_author_created_id` (`author_id`, `created`, `id`),
+  FULLTEXT INDEX `ft_post_title_body` (`title`, `body`)
+)ENGINE=InnoDB;
+
+-- author_username copies user.username so listings don't join user, writers
+-- may leave it out and get it filled in
+CREATE TRIGGER `post_author_username_insert` BEFORE INSERT ON `post` FOR EACH ROW BEGIN
+  SET NEW.`author_username` = COALESCE(
+    NEW.`author_username`,
+    (SELECT `username` FROM `user` WHERE `id` = NEW.`author_id`)
+  );
+END;
+
+-- the post_count triggers update user, which fires this trigger, it may only
+-- touch post when the username really changed
+CREATE TRIGGER `user_username_update` AFTER UPDATE ON `user` FOR EACH ROW BEGIN
+  IF NEW.`username` <> OLD.`username` THEN
+    UPDATE `post` SET `author_username` = NEW.`username` WHERE `author_id` = NEW.`id`;
+  END IF;
+END;
+
+-- post_count is kept by triggers so every writer, bulk deletes and imports
+-- included, keeps it right and nothing has to COUNT(*) posts
+CREATE TRIGGER `post_count_insert` AFTER INSERT ON `post` FOR EACH ROW BEGIN
+  UPDATE `user` SET `post_count` = `post_count` + 1 WHERE `id` = NEW.`author_id`;
+END;
+
+CREATE TRIGGER `post_count_delete` AFTER DELETE ON `post` FOR EACH ROW BEGIN
+  UPDATE `user` SET `post_count` = `post_count` - 1 WHERE `id` = OLD.`author_id`;
+END;
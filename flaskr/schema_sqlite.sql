@@ -1,10 +1,12 @@
+DROP TABLE IF EXISTS post_fts;
 DROP TABLE IF EXISTS post;
 DROP TABLE IF EXISTS user;
 
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   username TEXT UNIQUE NOT NULL,
-  password TEXT NOT NULL
+  password TEXT NOT NULL,
+  post_count INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE post (
@@ -13,5 +15,52 @@ CREATE TABLE post (
   created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   title TEXT NOT NULL,
   body TEXT NOT NULL,
+  author_username TEXT,
   FOREIGN KEY (author_id) REFERENCES user (id)
 );
+
+CREATE INDEX idx_post_created_id ON post (created, id);
+
+CREATE INDEX idx_post_author_created_id ON post (author_id, created, id);
+
+-- author_username copies user.username so listings don't join user, writers
+-- may leave it out and get it filled in
+CREATE TRIGGER post_author_username_insert AFTER INSERT ON post
+WHEN new.author_username IS NULL BEGIN
+  UPDATE post SET author_username = (SELECT username FROM user WHERE id = new.author_id)
+  WHERE id = new.id;
+END;
+
+CREATE TRIGGER user_username_update AFTER UPDATE OF username ON user BEGIN
+  UPDATE post SET author_username = new.username WHERE author_id = new.id;
+END;
+
+-- post_count is kept by triggers so every writer, bulk deletes and imports
+-- included, keeps it right and nothing has to COUNT(*) posts
+CREATE TRIGGER post_count_insert AFTER INSERT ON post BEGIN
+  UPDATE user SET post_count = post_count + 1 WHERE id = new.author_id;
+END;
+
+CREATE TRIGGER post_count_delete AFTER DELETE ON post BEGIN
+  UPDATE user SET post_count = post_count - 1 WHERE id = old.author_id;
+END;
+
+CREATE VIRTUAL TABLE post_fts USING fts5(
+  title,
+  body,
+  content='post',
+  content_rowid='id'
+);
+
+CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+
+CREATE TRIGGER post_fts_update AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
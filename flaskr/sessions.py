@@ -0,0 +1,276 @@
+import json
+import os
+import random
+import secrets
+import threading
+import time
+
+import click
+from flask import current_app, session
+from flask.cli import with_appcontext
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import create_engine, text
+from werkzeug.datastructures import CallbackDict
+
+from flaskr import queries
+from flaskr.cache import LRUCache
+from flaskr.db import get_db, set_sqlite_pragmas
+
+# the key this app keeps the logged in user's id under
+USER_ID_KEY = "id"
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, generation=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        # the user's generation when the session was loaded, saving never
+        # moves it forward, so a session revoked mid request stays revoked
+        self.generation = generation
+        self.modified = False
+
+
+class MemorySessionStore:
+    def __init__(self, maxsize=10000, ttl=None):
+        self._sessions = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        record = self._sessions.get(sid)
+        if record is None:
+            return None
+        data, user_id, generation = record
+        return data, generation, self.generation(user_id)
+
+    def save(self, sid, data, user_id, generation, ttl):
+        self._sessions.set(sid, (data, user_id, generation), ttl=ttl)
+
+    def delete(self, sid):
+        self._sessions.delete(sid)
+
+    def generation(self, user_id):
+        return self._generations.get(user_id, 0)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+
+class SqliteSessionStore:
+    # one file every worker process shares, a revocation is one upsert
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS session ("
+        " sid TEXT PRIMARY KEY, data TEXT NOT NULL, user_id INTEGER,"
+        " generation INTEGER NOT NULL, expires REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_session_expires ON session (expires)",
+        "CREATE TABLE IF NOT EXISTS user_generation ("
+        " user_id INTEGER PRIMARY KEY, generation INTEGER NOT NULL)",
+    )
+
+    def __init__(self, app, path):
+        self.engine = create_engine(f"sqlite:///{path}")
+        set_sqlite_pragmas(app, self.engine)
+        with self.engine.begin() as conn:
+            for statement in self.SCHEMA:
+                conn.exec_driver_sql(statement)
+
+    def load(self, sid):
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                text(
+                    "SELECT s.data, s.generation, COALESCE(u.generation, 0) "
+                    "FROM session s "
+                    "LEFT JOIN user_generation u ON u.user_id = s.user_id "
+                    "WHERE s.sid = :sid AND s.expires > :now"
+                ),
+                {"sid": sid, "now": time.time()},
+            ).first()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def save(self, sid, data, user_id, generation, ttl):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT OR REPLACE INTO session "
+                    "(sid, data, user_id, generation, expires) "
+                    "VALUES (:sid, :data, :user_id, :generation, :expires)"
+                ),
+                {
+                    "sid": sid,
+                    "data": json.dumps(data),
+                    "user_id": user_id,
+                    "generation": generation,
+                    "expires": now + ttl,
+                },
+            )
+            # expired rows are swept now and then instead of on every write
+            if random.random() < 0.01:
+                conn.execute(
+                    text("DELETE FROM session WHERE expires <= :now"), {"now": now}
+                )
+
+    def delete(self, sid):
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM session WHERE sid = :sid"), {"sid": sid})
+
+    def generation(self, user_id):
+        with self.engine.connect() as conn:
+            return (
+                conn.execute(
+                    text("SELECT generation FROM user_generation WHERE user_id = :id"),
+                    {"id": user_id},
+                ).scalar_one_or_none()
+                or 0
+            )
+
+    def revoke_user(self, user_id):
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO user_generation (user_id, generation) "
+                    "VALUES (:id, 1) ON CONFLICT (user_id) "
+                    "DO UPDATE SET generation = generation + 1"
+                ),
+                {"id": user_id},
+            )
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """The cookie only carries a random id, the data stays on the server.
+
+    Every session of a user is revoked at once by bumping the user's
+    generation, so the logged in user kept in the session can be trusted
+    without looking it up again on each request.
+    """
+
+    session_class = ServerSideSession
+    revocable = True
+
+    def __init__(self, store):
+        self.store = store
+
+    def _ttl(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            record = self.store.load(sid)
+            if record is not None:
+                data, generation, current = record
+                if generation == current:
+                    return self.session_class(data, sid=sid, generation=generation)
+                # revoked, drop it and hand out a fresh session
+                self.store.delete(sid)
+        return self.session_class(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified and not self.should_set_cookie(app, session):
+            return
+
+        user_id = session.get(USER_ID_KEY)
+        generation = session.generation
+        if generation is None:
+            generation = self.store.generation(user_id) if user_id else 0
+        self.store.save(session.sid, dict(session), user_id, generation, self._ttl(app))
+        response.vary.add("Cookie")
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            partitioned=self.get_cookie_partitioned(app),
+        )
+
+
+def create_store(app):
+    backend = app.config.get("SESSION_BACKEND")
+    match backend:
+        case None | "" | "cookie":
+            return None
+        case "memory":
+            return MemorySessionStore(
+                maxsize=app.config.get("SESSION_CACHE_SIZE", 10000),
+                ttl=app.permanent_session_lifetime.total_seconds(),
+            )
+        case "sqlite":
+            return SqliteSessionStore(
+                app,
+                app.config.get("SESSION_DB_PATH")
+                or os.path.join(app.instance_path, "sessions.sqlite"),
+            )
+        case str():
+            raise ValueError(f"Unsupported session backend: {backend}")
+        case _:
+            # any object, or a factory taking the app, with the store methods
+            return backend(app) if callable(backend) else backend
+
+
+def trusts_session():
+    return getattr(current_app.session_interface, "revocable", False)
+
+
+def regenerate_session():
+    """Move the session to a new id, so an id handed out before login is
+    worthless afterwards."""
+    if isinstance(session, ServerSideSession):
+        current_app.session_interface.store.delete(session.sid)
+        session.sid = secrets.token_urlsafe(32)
+        session.generation = None
+        session.modified = True
+
+
+def revoke_user_sessions(user_id):
+    if trusts_session():
+        current_app.session_interface.store.revoke_user(user_id)
+
+
+@click.command("revoke-sessions")
+@click.argument("username")
+@with_appcontext
+def revoke_sessions_command(username):
+    """Log a user out everywhere."""
+    if not trusts_session():
+        raise click.ClickException("Cookie sessions can't be revoked.")
+    # the memory store lives in each worker, this process can't reach it
+    if current_app.config.get("SESSION_BACKEND") != "sqlite":
+        raise click.ClickException(
+            'Only the "sqlite" session backend can be revoked from the command line.'
+        )
+    user_id = (
+        get_db()
+        .execute(queries.user_id_by_username, {"username": username})
+        .scalar_one_or_none()
+    )
+    if user_id is None:
+        raise click.ClickException(f"User {username} doesn't exist.")
+    revoke_user_sessions(user_id)
+    click.echo(f"Revoked every session of {username}.")
+
+
+def init_app(app):
+    app.cli.add_command(revoke_sessions_command)
+    store = create_store(app)
+    if store is not None:
+        app.session_interface = ServerSideSessionInterface(store)
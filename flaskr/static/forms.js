@@ -113,6 +113,16 @@ const forms = [
         title: "Register", text: "Are you sure you want to register?",
         auto: false,
     },
+    {
+        id: 'bulk-form', target: 'cf-turnstile-bulk',
+        title: "Bulk operation", text: "Are you sure you want to apply this to every selected post?",
+        auto: false,
+    },
+    {
+        id: 'author-delete-form', target: 'cf-turnstile-author-delete',
+        title: "Delete posts by author", text: "Are you sure you want to delete every post by this user?",
+        auto: false,
+    },
 ];
 
 
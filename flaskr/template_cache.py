@@ -0,0 +1,44 @@
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+
+
+def compile_templates(app):
+    """Load every template once, which writes its bytecode to the cache."""
+    names = app.jinja_env.list_templates(extensions=("html",))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+templates_cli = AppGroup("templates", help="Compiled Jinja templates.")
+
+
+@templates_cli.command("compile")
+def compile_command():
+    """Compile every template into TEMPLATE_CACHE_DIR."""
+    cache_dir = current_app.config.get("TEMPLATE_CACHE_DIR")
+    if not cache_dir:
+        raise click.ClickException("TEMPLATE_CACHE_DIR isn't set.")
+    start = time.perf_counter()
+    names = compile_templates(current_app)
+    click.echo(
+        f"Compiled {len(names)} templates into {cache_dir} "
+        f"in {(time.perf_counter() - start) * 1000:.1f}ms."
+    )
+
+
+def init_app(app):
+    app.cli.add_command(templates_cli)
+    cache_dir = app.config.get("TEMPLATE_CACHE_DIR")
+    if cache_dir:
+        # a new worker loads the compiled code instead of parsing the
+        # templates again, entries are keyed on the source so edits still show
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    if app.config.get("TEMPLATE_WARM_UP", False):
+        compile_templates(app)
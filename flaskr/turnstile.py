@@ -1,41 +1,247 @@
+import atexit
 import functools
-from typing import Tuple
+import inspect
+import logging
+import secrets
+import threading
+import time
+from typing import TYPE_CHECKING, List, Tuple
 
-import httpx
 from flask import (
     current_app,
     flash,
+    g,
+    has_request_context,
     redirect,
     request,
+    session,
 )
 
+from flaskr.cache import LRUCache
+from flaskr.metrics import timed
 
-def cf_turnstile_verify(cf_response_token: str) -> Tuple[bool, str]:
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# httpx is imported on the first verification, most requests never need it
+_client_lock = threading.Lock()
+
+CF_TURNSTILE_VERIFY_URL = "https://challenges.cloudflare.com/turnstile/v0/siteverify"
+# names the session a verified token belongs to
+CLIENT_KEY = "turnstile_client"
+
+
+def _client_options(app) -> dict:
+    import httpx
+
+    timeout = app.config.get("CF_TURNSTILE_TIMEOUT", 5.0)
+    max_connections = app.config.get("CF_TURNSTILE_MAX_CONNECTIONS", 10)
+    return dict(
+        timeout=httpx.Timeout(timeout, connect=min(timeout, 2.0)),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30.0,
+        ),
+    )
+
+
+def create_client(app) -> "httpx.Client":
+    import httpx
+
+    # transport retries only cover failures to connect, a token that already
+    # reached siteverify is spent and retrying it would fail anyway
+    return httpx.Client(
+        transport=httpx.HTTPTransport(
+            retries=app.config.get("CF_TURNSTILE_RETRIES", 2)
+        ),
+        **_client_options(app),
+    )
+
+
+def create_async_client(app) -> "httpx.AsyncClient":
+    import httpx
+
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            retries=app.config.get("CF_TURNSTILE_RETRIES", 2)
+        ),
+        **_client_options(app),
+    )
+
+
+def get_client(app) -> "httpx.Client":
+    if app.turnstile_client is None:
+        with _client_lock:
+            if app.turnstile_client is None:
+                client = create_client(app)
+                atexit.register(client.close)
+                app.turnstile_client = client
+    return app.turnstile_client
+
+
+def _verify_request(cf_response_token: str):
     cf_secret = current_app.config.get("CF_TURNSTILE_SECRET_KEY")
     if not cf_secret:
-        return False, ["turnstile secret key not set"]
+        return None, ["turnstile secret key not set"]
 
     if not cf_response_token:
-        return False, ["missing-input-response"]
+        return None, ["missing-input-response"]
 
     # Prepare data for the POST request
     data = {
         "secret": cf_secret,
         "response": cf_response_token,
     }
-    # First validation request
-    url = "https://challenges.cloudflare.com/turnstile/v0/siteverify"
+    return data, None
+
+
+def _client_id():
+    """The session and endpoint a token was verified for, behind a proxy
+    every client shares remote_addr so it can't tell them apart."""
+    if not has_request_context():
+        return None
+    client = session.get(CLIENT_KEY)
+    if client is None:
+        client = session[CLIENT_KEY] = secrets.token_urlsafe(16)
+    return client, request.endpoint
+
+
+def _cached_outcome(cf_response_token: str):
+    # siteverify answers a token only once, so the outcome is kept until the
+    # form goes through: resubmitting it after a validation error in the same
+    # session gets it again, a replay by anyone else is refused without a
+    # round trip
+    cached = current_app.turnstile_cache.get(cf_response_token)
+    if cached is None:
+        return None
+    success, error_codes, client_id = cached
+    if client_id != _client_id():
+        success, error_codes = False, ["timeout-or-duplicate"]
+    current_app.metrics.inc(
+        "flaskr_turnstile_cache_hits_total", ["success" if success else "failure"]
+    )
+    return success, error_codes
+
+
+def _record_outcome(cf_response_token, success, error_codes, elapsed=None):
+    metrics = current_app.metrics
+    if elapsed is not None:
+        metrics.inc("flaskr_turnstile_verify_duration_seconds_sum", [], elapsed)
+        metrics.inc("flaskr_turnstile_verify_duration_seconds_count", [])
+    metrics.inc("flaskr_turnstile_verify_total", ["success" if success else "failure"])
+    for code in error_codes:
+        metrics.inc("flaskr_turnstile_errors_total", [code])
+    if cf_response_token and elapsed is not None:
+        current_app.turnstile_cache.set(
+            cf_response_token, (success, error_codes, _client_id())
+        )
+    return success, error_codes
+
 
-    client = httpx.Client()
+def allow_retry():
+    """Called by a view that shows its form again for a validation error, the
+    same token may then be sent with the corrected form."""
+    g.turnstile_retry = True
+
+
+def _consume(cf_response_token):
+    """Once the view acted on the form the token is spent, unless it asked
+    for a retry."""
+    if g.pop("turnstile_retry", False):
+        return
+    current_app.turnstile_cache.set(
+        cf_response_token, (False, ["timeout-or-duplicate"], None)
+    )
+
+
+def _parse_response(response) -> Tuple[bool, List[str]]:
+    return response.get("success") is True, list(response.get("error-codes") or [])
+
+
+def cf_turnstile_verify(cf_response_token: str) -> Tuple[bool, List[str]]:
+    data, error = _verify_request(cf_response_token)
+    if error is not None:
+        return _record_outcome(cf_response_token, False, error)
+
+    cached = _cached_outcome(cf_response_token)
+    if cached is not None:
+        return cached
+
+    url = current_app.config.get("CF_TURNSTILE_VERIFY_URL", CF_TURNSTILE_VERIFY_URL)
+    start = time.perf_counter()
     try:
-        response = client.post(url, data=data).json()
-        return response.get("success"), response.get("error-codes")
+        with timed("turnstile"):
+            response = get_client(current_app).post(url, data=data).json()
+    except Exception as e:
+        # nothing was learned about the token, so nothing is cached
+        logger.warning("turnstile siteverify failed: %s", e)
+        return _record_outcome(cf_response_token, False, ["request-failed"])
+    success, error_codes = _parse_response(response)
+    return _record_outcome(
+        cf_response_token, success, error_codes, time.perf_counter() - start
+    )
+
+
+async def cf_turnstile_verify_async(cf_response_token: str) -> Tuple[bool, List[str]]:
+    data, error = _verify_request(cf_response_token)
+    if error is not None:
+        return _record_outcome(cf_response_token, False, error)
+
+    cached = _cached_outcome(cf_response_token)
+    if cached is not None:
+        return cached
 
+    url = current_app.config.get("CF_TURNSTILE_VERIFY_URL", CF_TURNSTILE_VERIFY_URL)
+    # an async client is bound to its event loop, so the shared one is only
+    # used when a long running loop (ASGI) installed it, otherwise use one
+    # client per call
+    client = current_app.turnstile_async_client
+    start = time.perf_counter()
+    try:
+        with timed("turnstile"):
+            if client is not None:
+                response = await client.post(url, data=data)
+            else:
+                async with create_async_client(current_app) as client:
+                    response = await client.post(url, data=data)
+        response = response.json()
     except Exception as e:
-        return False, f"{e}"
+        logger.warning("turnstile siteverify failed: %s", e)
+        return _record_outcome(cf_response_token, False, ["request-failed"])
+    success, error_codes = _parse_response(response)
+    return _record_outcome(
+        cf_response_token, success, error_codes, time.perf_counter() - start
+    )
 
 
 def cf_turnstile_required(view):
+    if inspect.iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapped_view(**kwargs):
+            testing = current_app.config.get("TESTING", False)
+
+            if request.method == "POST" and testing is False:
+                cf_response_token = request.form.get("cf-turnstile-response")
+
+                result, message = await cf_turnstile_verify_async(cf_response_token)
+
+                if result is False:
+                    flash(f"Captcha verification failed {', '.join(message)}")
+                    return redirect(request.url)
+
+                try:
+                    return await view(**kwargs)
+                finally:
+                    _consume(cf_response_token)
+
+            return await view(**kwargs)
+
+        return async_wrapped_view
+
     @functools.wraps(view)
     def wrapped_view(**kwargs):
         testing = current_app.config.get("TESTING", False)
@@ -47,15 +253,27 @@ def cf_turnstile_required(view):
             result, message = cf_turnstile_verify(cf_response_token)
 
             if result is False:
-                flash(f"Captcha verification failed {message}")
+                flash(f"Captcha verification failed {', '.join(message)}")
                 return redirect(request.url)
 
+            try:
+                return view(**kwargs)
+            finally:
+                _consume(cf_response_token)
+
         return view(**kwargs)
 
     return wrapped_view
 
 
 def init_app(app):
+    app.turnstile_client = None
+    app.turnstile_async_client = None
+    app.turnstile_cache = LRUCache(
+        maxsize=app.config.get("CF_TURNSTILE_CACHE_SIZE", 10000),
+        ttl=app.config.get("CF_TURNSTILE_CACHE_TTL", 300),
+    )
+
     @app.context_processor
     def inject_config():
         return dict(cf_site_key=app.config.get("CF_TURNSTILE_SITE_KEY"))
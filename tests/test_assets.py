@@ -0,0 +1,96 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from flaskr import assets
+
+
+@pytest.fixture
+def built(app, tmp_path):
+    app.config["ASSETS_DIR"] = str(tmp_path / "assets")
+    result = app.test_cli_runner().invoke(args=["assets", "build"])
+    assert "style.css -> style." in result.output
+    return app
+
+
+def test_build(built):
+    target = built.config["ASSETS_DIR"]
+    with open(os.path.join(target, "manifest.json")) as f:
+        manifest = json.load(f)
+    assert set(manifest) == {"style.css", "turnstile.js", "forms.js"}
+    assert built.asset_manifest == manifest
+
+    with open(os.path.join(built.static_folder, "style.css"), "rb") as f:
+        source = f.read()
+    path = os.path.join(target, manifest["style.css"])
+    assert manifest["style.css"] == assets.fingerprint("style.css", source)
+    with gzip.open(path + ".gz") as f:
+        assert f.read() == source
+
+    # module imports point at the fingerprinted file
+    with open(os.path.join(target, manifest["turnstile.js"])) as f:
+        assert f"from './{manifest['forms.js']}'" in f.read()
+
+
+def test_build_rewrites_references(tmp_path):
+    source = tmp_path / "static"
+    (source / "img").mkdir(parents=True)
+    (source / "img" / "logo.svg").write_text("<svg></svg>")
+    (source / "site.css").write_text("a { background: url('img/logo.svg'); }")
+    manifest = assets.build(str(source), str(tmp_path / "out"))
+    css = (tmp_path / "out" / manifest["site.css"]).read_text()
+    assert f"url('img/{os.path.basename(manifest['img/logo.svg'])}')" in css
+
+    # a changed reference changes the file referring to it
+    (source / "img" / "logo.svg").write_text("<svg><g/></svg>")
+    rebuilt = assets.build(str(source), str(tmp_path / "out"))
+    assert rebuilt["site.css"] != manifest["site.css"]
+    assert (tmp_path / "out" / manifest["site.css"]).exists()
+
+
+def test_asset_url(app, built, client):
+    response = client.get("/")
+    assert f'href="/assets/{built.asset_manifest["style.css"]}"'.encode() in (
+        response.data
+    )
+    assert f'"/assets/{built.asset_manifest["turnstile.js"]}"'.encode() in (
+        response.data
+    )
+
+
+def test_asset_url_before_build(client):
+    response = client.get("/")
+    assert b'href="/static/style.css"' in response.data
+
+
+def test_serve_precompressed(built, client):
+    name = built.asset_manifest["style.css"]
+    response = client.get(f"/assets/{name}", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.content_encoding == "gzip"
+    assert response.mimetype == "text/css"
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == assets.MAX_AGE
+    assert "Accept-Encoding" in response.vary
+    with open(os.path.join(built.static_folder, "style.css"), "rb") as f:
+        assert gzip.decompress(response.get_data()) == f.read()
+    response.close()
+
+    response = client.get(f"/assets/{name}")
+    assert response.content_encoding is None
+    assert response.cache_control.immutable
+    response.close()
+
+    assert client.get("/assets/manifest.json").status_code == 404
+    assert client.get(f"/assets/{name}.gz").status_code == 404
+    assert client.get("/assets/missing.css").status_code == 404
+
+
+def test_serve_brotli(built, client):
+    pytest.importorskip("brotli")
+    name = built.asset_manifest["style.css"]
+    response = client.get(f"/assets/{name}", headers={"Accept-Encoding": "gzip, br"})
+    assert response.content_encoding == "br"
+    response.close()
@@ -0,0 +1,186 @@
+import asyncio
+import inspect
+import threading
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("asgiref")
+
+from asgiref.testing import ApplicationCommunicator  # noqa: E402
+from sqlalchemy import NullPool, text  # noqa: E402
+
+from flaskr import async_db, async_views  # noqa: E402
+from flaskr.asgi import create_asgi_app  # noqa: E402
+from flaskr.async_db import async_database_uri  # noqa: E402
+from flaskr.db import dispose_engines, get_db  # noqa: E402
+
+
+@pytest.fixture
+def async_app(app):
+    async_views.init_app(app)
+    yield app
+    asyncio.run(app.async_db_pool.dispose())
+
+
+@pytest.fixture
+def async_client(async_app):
+    return async_app.test_client()
+
+
+@pytest.mark.parametrize(
+    ("uri", "expected"),
+    (
+        ("sqlite:///flaskr.sqlite", "sqlite+aiosqlite:///flaskr.sqlite"),
+        (
+            "mariadb+mariadbconnector://root:pw@localhost:3306/flaskr",
+            "mysql+asyncmy://root:pw@localhost:3306/flaskr",
+        ),
+    ),
+)
+def test_async_database_uri(uri, expected):
+    assert async_database_uri(uri).render_as_string(hide_password=False) == expected
+
+
+def test_memory_database_rejected(app):
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    with pytest.raises(ValueError):
+        async_views.init_app(app)
+
+
+def test_views_swapped(async_app):
+    for endpoint in async_views.ASYNC_VIEWS:
+        view = async_app.view_functions[endpoint]
+        assert inspect.iscoroutinefunction(inspect.unwrap(view))
+
+
+def test_index(async_client):
+    response = async_client.get("/")
+    assert b"test title" in response.data
+    assert "db;dur=" in response.headers["Server-Timing"]
+
+
+def test_index_from_threads(async_app):
+    # every request runs its own event loop, they must not wait on each other
+    async_app.page_cache = None
+    statuses = []
+
+    def worker():
+        client = async_app.test_client()
+        for _ in range(10):
+            statuses.append(client.get("/").status_code)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert statuses == [200] * 40
+
+
+def test_search(async_client):
+    assert b"test title" in async_client.get("/search?q=body").data
+    assert b"test title" not in async_client.get("/search?q=missing").data
+
+
+def test_register_login_create(async_client, async_app):
+    response = async_client.post(
+        "/auth/register", data={"username": "async", "password": "secret"}
+    )
+    assert response.headers["Location"] == "/auth/login"
+
+    response = async_client.post(
+        "/auth/register",
+        data={"username": "async", "password": "secret"},
+        follow_redirects=True,
+    )
+    assert b"already registered" in response.data
+
+    response = async_client.post(
+        "/auth/login",
+        data={"username": "async", "password": "wrong"},
+        follow_redirects=True,
+    )
+    assert b"Incorrect username or password." in response.data
+
+    response = async_client.post(
+        "/auth/login", data={"username": "async", "password": "secret"}
+    )
+    assert response.headers["Location"] == "/"
+
+    response = async_client.post("/create", data={"title": "async post", "body": ""})
+    assert response.headers["Location"] == "/"
+    assert b"async post" in async_client.get("/").data
+
+    with async_app.app_context():
+        count = get_db().execute(text("SELECT COUNT(id) FROM post")).scalar()
+    assert count == 2
+
+
+def test_create_login_required(async_client):
+    response = async_client.post("/create", data={"title": "x", "body": ""})
+    assert response.headers["Location"] == "/auth/login"
+
+
+async def _asgi_get(application, path):
+    communicator = ApplicationCommunicator(
+        application,
+        {
+            "type": "http",
+            "http_version": "1.1",
+            "method": "GET",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "scheme": "http",
+            "headers": [(b"host", b"localhost")],
+            "client": ("127.0.0.1", 1234),
+            "server": ("localhost", 80),
+        },
+    )
+    await communicator.send_input({"type": "http.request", "body": b""})
+    start = await communicator.receive_output(5)
+    body = b""
+    while True:
+        message = await communicator.receive_output(5)
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return start["status"], body
+
+
+def test_asgi_app(app):
+    application = create_asgi_app(dict(app.config))
+
+    async def run():
+        results = await asyncio.gather(*(_asgi_get(application, "/") for _ in range(5)))
+        await application.app.async_db_pool.dispose()
+        await application.app.turnstile_async_client.aclose()
+        dispose_engines(application.app)
+        return results
+
+    for status, body in asyncio.run(run()):
+        assert status == 200
+        assert b"test title" in body
+
+
+def test_asgi_app_initialises_async_views_once(app, monkeypatch):
+    engines = []
+    create_engine = async_db.create_async_db_engine
+
+    def counting_create_engine(app, pooled=False):
+        engines.append(pooled)
+        return create_engine(app, pooled=pooled)
+
+    monkeypatch.setattr(async_db, "create_async_db_engine", counting_create_engine)
+    application = create_asgi_app(dict(app.config, ASYNC_VIEWS=True))
+    assert engines == [True]
+    assert not isinstance(application.app.async_db_pool.sync_engine.pool, NullPool)
+
+    async def close():
+        await application.app.async_db_pool.dispose()
+        await application.app.turnstile_async_client.aclose()
+
+    asyncio.run(close())
+    dispose_engines(application.app)
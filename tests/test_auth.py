@@ -118,3 +118,58 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert "id" not in session
+
+
+def test_user_cache(client, auth, app):
+    auth.login()
+    client.get("/")
+    assert app.user_cache.get(1) == "test"
+
+    # cached identity is used, the renamed user is not seen until invalidated
+    with app.app_context():
+        db = get_db()
+        db.execute(text("UPDATE user SET username = 'renamed' WHERE id = 1"))
+        db.commit()
+    with client:
+        client.get("/")
+        assert g.user["username"] == "test"
+
+    app.user_cache.delete(1)
+    with client:
+        client.get("/")
+        assert g.user is None
+
+
+def test_change_password_invalidates_user_cache(client, auth, app):
+    auth.login()
+    client.get("/")
+    assert 1 in app.user_cache
+    client.post(
+        "/auth/change_password",
+        data={
+            "current_password": "test",
+            "new_password": "newpassword",
+            "confirm_new_password": "newpassword",
+        },
+    )
+    assert 1 not in app.user_cache
+
+
+def test_skip_user_lookup(client, auth, app, monkeypatch):
+    auth.login()
+
+    def fail_verify_user(user_id, username):
+        raise AssertionError("verify_user should not be called")
+
+    monkeypatch.setattr("flaskr.auth.verify_user", fail_verify_user)
+    with client:
+        assert client.get("/hello").status_code == 200
+        assert g.user is None
+        assert client.get("/static/style.css").status_code == 200
+
+    monkeypatch.undo()
+    auth.logout()
+    monkeypatch.setattr("flaskr.auth.verify_user", fail_verify_user)
+    with client:
+        client.get("/")
+        assert g.user is None
@@ -0,0 +1,214 @@
+import json
+
+import click
+import pytest
+from sqlalchemy import text
+
+from flaskr.bench import (
+    STARTUP_SCRIPT,
+    compare,
+    parse_importtime,
+    percentile,
+    run_scenario,
+    seed,
+)
+from flaskr.db import get_db
+
+
+def test_seed(app):
+    with app.app_context():
+        db = get_db()
+        seed(db, users=3, posts=25, batch_size=10)
+        assert db.execute(text("SELECT COUNT(*) FROM user")).scalar() == 5
+        assert db.execute(text("SELECT COUNT(*) FROM post")).scalar() == 26
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 51
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) is None
+
+
+def test_bench_command(runner, tmp_path):
+    output = tmp_path / "results.json"
+    result = runner.invoke(
+        args=[
+            "bench",
+            "--users",
+            "3",
+            "--posts",
+            "30",
+            "--requests",
+            "4",
+            "--concurrency",
+            "2",
+            "--database",
+            f"sqlite:///{tmp_path / 'bench.sqlite'}",
+            "--yes",
+            "--output",
+            str(output),
+        ]
+    )
+    assert result.exit_code == 0, result.output
+    assert "blog.index" in result.output
+
+    results = json.loads(output.read_text())
+    assert results["seed"]["posts"] == 30
+    for name in ("blog.index", "auth.login", "blog.create", "manage.index"):
+        assert results["results"][name]["requests"] == 4
+        assert results["results"][name]["errors"] == 0
+        assert results["results"][name]["p99_ms"] > 0
+
+    result = runner.invoke(
+        args=[
+            "bench",
+            "--no-seed",
+            "--scenario",
+            "blog.index",
+            "--requests",
+            "2",
+            "--database",
+            f"sqlite:///{tmp_path / 'bench.sqlite'}",
+            "--output",
+            str(tmp_path / "second.json"),
+            "--compare",
+            str(output),
+        ]
+    )
+    assert result.exit_code == 0, result.output
+    assert "blog.index     throughput" in result.output
+
+
+def test_bench_asks_before_seeding_database(runner, tmp_path):
+    database = f"sqlite:///{tmp_path / 'bench.sqlite'}"
+    result = runner.invoke(args=["bench", "--database", database], input="n\n")
+    assert result.exit_code == 1
+    assert "Seeding drops every table" in result.output
+    assert not (tmp_path / "bench.sqlite").exists()
+
+
+def test_bench_counts_wrong_page(runner, app, tmp_path):
+    output = tmp_path / "results.json"
+    result = runner.invoke(
+        args=[
+            "bench",
+            "--no-seed",
+            "--scenario",
+            "auth.login",
+            "--requests",
+            "2",
+            "--database",
+            app.config["SQLALCHEMY_DATABASE_URI"],
+            "--output",
+            str(output),
+        ]
+    )
+    assert result.exit_code == 0, result.output
+    # there's no bench0, the login redirects back to the form
+    results = json.loads(output.read_text())
+    assert results["results"]["auth.login"]["errors"] == 2
+
+
+def test_compare():
+    baseline = {"results": {"blog.index": {"throughput": 100.0, "p50_ms": 2.0}}}
+    results = {"results": {"blog.index": {"throughput": 150.0, "p50_ms": 1.0}}}
+    lines = compare(baseline, results)
+    assert any("+50.0%" in line for line in lines)
+    assert any("-50.0%" in line for line in lines)
+
+
+def test_bench_queries_command(runner):
+    result = runner.invoke(args=["bench-queries", "--calls", "20", "--rows", "10"])
+    assert result.exit_code == 0, result.output
+    assert "post_by_id" in result.output
+    assert "insert_post" in result.output
+
+
+def test_bench_feed_command(runner, tmp_path):
+    result = runner.invoke(
+        args=[
+            "bench-feed",
+            "--posts",
+            "100",
+            "--users",
+            "5",
+            "--calls",
+            "5",
+            "--database",
+            f"sqlite:///{tmp_path / 'feed.sqlite'}",
+            "--yes",
+        ]
+    )
+    assert result.exit_code == 0, result.output
+    assert "first_page" in result.output
+    assert "middle_page" in result.output
+
+
+def test_bench_templates_command(runner):
+    result = runner.invoke(args=["bench-templates", "--rounds", "1"])
+    assert result.exit_code == 0, result.output
+    for mode in ("compile", "bytecode_cache", "warm_up"):
+        assert mode in result.output
+
+
+def test_parse_importtime():
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   flaskr.cache\n"
+        "import time:      2000 |       2120 | flaskr\n"
+        "some other output\n"
+    )
+    assert parse_importtime(output) == {
+        "flaskr.cache": (0.12, 0.12),
+        "flaskr": (2.0, 2.12),
+    }
+
+
+def test_startup_profile_command(runner, tmp_path, monkeypatch, base_config):
+    # the child interpreter builds an app too, keep it out of instance/
+    monkeypatch.setattr(
+        "flaskr.bench.STARTUP_SCRIPT",
+        STARTUP_SCRIPT.replace("create_app()", f"create_app({base_config!r})"),
+    )
+    output = tmp_path / "startup.json"
+    result = runner.invoke(
+        args=["startup-profile", "--rounds", "1", "--top", "1000", "--output", output]
+    )
+    assert result.exit_code == 0, result.output
+    results = json.loads(output.read_text())
+    assert len(results["slowest"]) == results["modules"]
+    assert results["total_ms"] > 0
+    # httpx only comes in with the first turnstile verification
+    assert "httpx" not in {module["module"] for module in results["slowest"]}
+
+    result = runner.invoke(
+        args=[
+            "startup-profile",
+            "--rounds",
+            "1",
+            "--compare",
+            output,
+            "--budget-ms",
+            "1",
+        ]
+    )
+    assert result.exit_code == 1
+    assert "total_ms" in result.output
+    assert "over the 1ms budget" in result.output
+
+
+def test_run_scenario_token_per_request(app, turnstile_server):
+    app.config["TESTING"] = False
+    with app.app_context():
+        seed(get_db(), users=1, posts=0)
+    result = run_scenario(app.test_client, "auth.login", 3)
+    assert result["errors"] == 0
+    tokens = {form["response"][0] for form in turnstile_server.requests}
+    assert len(tokens) == 3
+
+
+def test_run_scenario_rate_limited(app):
+    app.config["RATELIMIT_PER_IP"] = (1, 60)
+    with pytest.raises(click.ClickException, match="RATELIMIT_BACKEND = None"):
+        run_scenario(app.test_client, "auth.login", 3)
@@ -1,3 +1,5 @@
+import re
+
 import pytest
 from sqlalchemy import text
 
@@ -26,6 +28,7 @@ def test_dashboard(client, auth):
     auth.login()
     response = client.get("/auth/dashboard")
     assert b"Dashboard" in response.data
+    assert b'href="/u/test">1 post</a>' in response.data
 
 
 @pytest.mark.parametrize(
@@ -157,3 +160,174 @@ def test_delete(client, auth, app):
             {"id": 1},
         ).fetchone()
         assert no_result is None
+
+
+def test_index_pagination(client, app):
+    app.config["POSTS_PER_PAGE"] = 2
+    with app.app_context():
+        db = get_db()
+        for i in range(4):
+            db.execute(
+                text(
+                    "INSERT INTO post (title, body, author_id, created) VALUES (:title, :body, :author_id, :created)"
+                ),
+                {
+                    "title": f"page post {i}",
+                    "body": "",
+                    "author_id": 1,
+                    "created": f"2019-01-0{i + 1} 00:00:00",
+                },
+            )
+        db.commit()
+
+    response = client.get("/")
+    assert b"page post 3" in response.data
+    assert b"page post 2" in response.data
+    assert b"page post 1" not in response.data
+    assert b"Newer" not in response.data
+    next_link = re.search(rb'href="/\?after=([^"]+)"', response.data)
+    assert next_link is not None
+
+    response = client.get(f"/?after={next_link.group(1).decode()}")
+    assert b"page post 1" in response.data
+    assert b"page post 0" in response.data
+    assert b"page post 2" not in response.data
+    prev_link = re.search(rb'href="/\?before=([^"]+)"', response.data)
+    assert prev_link is not None
+    next_link = re.search(rb'href="/\?after=([^"]+)"', response.data)
+
+    response = client.get(f"/?after={next_link.group(1).decode()}")
+    assert b"test title" in response.data
+    assert b"page post 0" not in response.data
+    assert b"Older" not in response.data
+
+    response = client.get(f"/?before={prev_link.group(1).decode()}")
+    assert b"page post 3" in response.data
+    assert b"page post 2" in response.data
+    assert b"page post 1" not in response.data
+    assert b"Newer" not in response.data
+
+
+def _post_count(app, user_id=1):
+    with app.app_context():
+        return (
+            get_db()
+            .execute(
+                text("SELECT post_count FROM user WHERE id = :id"), {"id": user_id}
+            )
+            .scalar_one()
+        )
+
+
+def test_post_count(client, auth, app):
+    assert _post_count(app) == 1
+    auth.login()
+    client.post("/create", data={"title": "counted", "body": ""})
+    assert _post_count(app) == 2
+    client.post("/1/delete")
+    assert _post_count(app) == 1
+    assert _post_count(app, 2) == 0
+
+
+def test_author_page(client, app):
+    app.config["POSTS_PER_PAGE"] = 2
+    with app.app_context():
+        db = get_db()
+        for i in range(3):
+            db.execute(
+                text(
+                    "INSERT INTO post (title, body, author_id, created) VALUES (:title, :body, :author_id, :created)"
+                ),
+                {
+                    "title": f"other post {i}",
+                    "body": "",
+                    "author_id": 2,
+                    "created": f"2019-01-0{i + 1} 00:00:00",
+                },
+            )
+        db.commit()
+
+    response = client.get("/u/other")
+    assert b"Posts by other" in response.data
+    assert b"3 posts" in response.data
+    assert b"other post 2" in response.data
+    assert b"other post 1" in response.data
+    assert b"test title" not in response.data
+    next_link = re.search(rb'href="/u/other\?after=([^"]+)"', response.data)
+    assert next_link is not None
+
+    response = client.get(f"/u/other?after={next_link.group(1).decode()}")
+    assert b"other post 0" in response.data
+    assert b"other post 1" not in response.data
+    assert b"test title" not in response.data
+    assert b"Older" not in response.data
+    assert re.search(rb'href="/u/other\?before=', response.data)
+
+    response = client.get("/u/test")
+    assert b"1 post<" in response.data
+    assert b"test title" in response.data
+    assert b"other post" not in response.data
+
+    assert client.get("/u/nobody").status_code == 404
+
+
+def test_index_bad_cursor(client):
+    response = client.get("/?after=not-a-cursor")
+    assert response.status_code == 200
+    assert b"test title" in response.data
+
+
+def test_search(client, auth, app):
+    response = client.get("/search")
+    assert response.status_code == 200
+    assert b"No posts found" not in response.data
+
+    response = client.get("/search?q=body")
+    assert b"test title" in response.data
+
+    response = client.get("/search?q=missing")
+    assert b"No posts found" in response.data
+    assert b"test title" not in response.data
+
+    # user input is never parsed as FTS5 syntax
+    response = client.get('/search?q=test" AND OR (')
+    assert response.status_code == 200
+    assert b"System error" not in response.data
+
+
+def test_search_follows_writes(client, auth, app):
+    auth.login()
+    client.post("/1/update", data={"title": "renamed", "body": "fresh words"})
+    assert b"renamed" in client.get("/search?q=fresh").data
+    assert b"renamed" not in client.get("/search?q=body").data
+
+    client.post("/1/delete")
+    assert b"No posts found" in client.get("/search?q=fresh").data
+
+
+def test_search_ranked_and_paginated(client, app):
+    app.config["POSTS_PER_PAGE"] = 2
+    with app.app_context():
+        db = get_db()
+        for title, body in (
+            ("one kiwi", "nothing"),
+            ("kiwi kiwi kiwi", "kiwi kiwi"),
+            ("another kiwi", "kiwi"),
+        ):
+            db.execute(
+                text(
+                    "INSERT INTO post (title, body, author_id) VALUES (:title, :body, 1)"
+                ),
+                {"title": title, "body": body},
+            )
+        db.commit()
+
+    response = client.get("/search?q=kiwi")
+    assert response.data.index(b"kiwi kiwi kiwi") < response.data.index(b"another kiwi")
+    assert b"one kiwi" not in response.data
+    assert b"page=2" in response.data
+
+    response = client.get("/search?q=kiwi&page=2")
+    assert b"one kiwi" in response.data
+    assert b"page=1" in response.data
+    assert b"page=3" not in response.data
@@ -0,0 +1,143 @@
+import gzip
+import zlib
+
+import pytest
+
+from flaskr import compress, queries
+from flaskr.db import get_db
+from flaskr.page_cache import FilePageCache
+
+
+def _decode(response):
+    data = response.get_data()
+    match response.content_encoding:
+        case "gzip":
+            return gzip.decompress(data)
+        case "br":
+            return pytest.importorskip("brotli").decompress(data)
+        case "zstd":
+            zstandard = pytest.importorskip("zstandard")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+@pytest.mark.parametrize(
+    ("accept", "expected"),
+    (
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("gzip, br, zstd", "zstd"),
+        ("br;q=0.5, gzip", "gzip"),
+        ("identity", None),
+        ("", None),
+    ),
+)
+def test_negotiate(app, accept, expected):
+    if expected == "br":
+        pytest.importorskip("brotli")
+    if expected == "zstd":
+        pytest.importorskip("zstandard")
+    with app.test_request_context(headers={"Accept-Encoding": accept}):
+        assert compress.negotiate() == expected
+
+
+def test_compressed_page(client):
+    response = client.get("/search?q=test", headers={"Accept-Encoding": "gzip"})
+    assert response.content_encoding == "gzip"
+    assert "Accept-Encoding" in response.vary
+    assert int(response.headers["Content-Length"]) == len(response.get_data())
+    assert b"test title" in _decode(response)
+
+    response = client.get("/search?q=test")
+    assert response.content_encoding is None
+    assert "Accept-Encoding" in response.vary
+    assert b"test title" in response.data
+
+
+def test_min_size(client):
+    response = client.get("/hello", headers={"Accept-Encoding": "gzip"})
+    assert response.content_encoding is None
+    assert response.data == b"Hello, World!"
+
+
+def test_streamed_page(client, auth, app):
+    app.config.update(
+        {
+            "STREAM_LISTINGS": True,
+            "STREAM_CHUNK_SIZE": 1,
+            "COMPRESS_STREAM_BUFFER": 1,
+        }
+    )
+    auth.login()
+    response = client.get("/manage/", headers={"Accept-Encoding": "gzip"})
+    assert response.is_streamed
+    assert response.content_encoding == "gzip"
+    assert "Content-Length" not in response.headers
+    chunks = list(response.response)
+    # every flushed block decodes on its own as it arrives
+    decoder = zlib.decompressobj(31)
+    assert b"<html>" in decoder.decompress(chunks[0])
+    data = decoder.decompress(b"".join(chunks[1:]))
+    assert b"test title" in data
+
+
+def test_streamed_page_buffered(client, auth, app):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            queries.insert_post,
+            [
+                {"title": f"post {i}", "body": "body " * 20, "author_id": 1}
+                for i in range(20)
+            ],
+        )
+        db.commit()
+    app.config.update({"STREAM_LISTINGS": True, "STREAM_CHUNK_SIZE": 5})
+    auth.login()
+    headers = {"Accept-Encoding": "gzip"}
+    streamed = client.get("/manage/", headers=headers)
+    body = _decode(streamed)
+    one_shot = gzip.compress(body, compresslevel=app.config["COMPRESS_LEVELS"]["gzip"])
+    # a flush per template fragment made it about three times this
+    assert len(streamed.get_data()) < len(one_shot) * 1.2
+
+
+def test_memory_cache_keeps_bytes(client, app, tmp_path):
+    client.get("/", headers={"Accept-Encoding": "gzip"})
+    entry = app.page_cache.get("/?|anon")
+    assert isinstance(entry["encoded"]["gzip"], bytes)
+
+    app.page_cache = FilePageCache(tmp_path)
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert b"test title" in _decode(response)
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert b"test title" in _decode(response)
+
+
+def test_cached_page_compressed_once(client, app, monkeypatch):
+    headers = {"Accept-Encoding": "gzip"}
+    response = client.get("/", headers=headers)
+    assert response.content_encoding == "gzip"
+    body = _decode(response)
+
+    def fail_compress(*args, **kwargs):
+        raise AssertionError("compressed again")
+
+    monkeypatch.setattr(compress, "compress", fail_compress)
+    response = client.get("/", headers=headers)
+    assert response.content_encoding == "gzip"
+    assert _decode(response) == body
+    assert client.get("/").data == body
+
+
+@pytest.mark.parametrize("encoding", ("br", "zstd"))
+def test_optional_encodings(client, auth, encoding):
+    pytest.importorskip({"br": "brotli", "zstd": "zstandard"}[encoding])
+    response = client.get("/", headers={"Accept-Encoding": encoding})
+    assert response.content_encoding == encoding
+    assert b"test title" in _decode(response)
+
+    auth.login()
+    response = client.get("/manage/", headers={"Accept-Encoding": encoding})
+    assert response.content_encoding == encoding
+    assert b"test title" in _decode(response)
@@ -1,7 +1,19 @@
+import os
+import sqlite3
+
 import pytest
-from sqlalchemy import text
+from sqlalchemy import NullPool, QueuePool, SingletonThreadPool, text
 
-from flaskr.db import get_db
+import flaskr
+from flaskr.db import (
+    WRITTEN_AT_KEY,
+    create_replica_engines,
+    executescript,
+    get_db,
+    get_engine,
+    split_statements,
+)
+from flaskr.page_cache import MemoryPageCache, invalidate_pages
 
 
 def test_get_close_db(app):
@@ -24,3 +36,187 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=["init-db"])
     assert "Initialized" in result.output
     assert Recorder.called
+
+
+def test_sqlite_tuning(app):
+    assert isinstance(get_engine(app).pool, QueuePool)
+    with app.app_context():
+        db = get_db()
+        assert db.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL
+        assert db.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert db.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        assert db.execute(text("PRAGMA cache_size")).scalar() == -20000
+
+
+@pytest.mark.parametrize(
+    ("pool", "poolclass"),
+    (
+        ("queue", QueuePool),
+        ("singleton", SingletonThreadPool),
+        ("null", NullPool),
+    ),
+)
+def test_sqlite_pool_config(make_app, tmp_path, pool, poolclass):
+    app = make_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'pool.sqlite'}",
+            "SQLITE_POOL": pool,
+            "SQLITE_JOURNAL_MODE": "DELETE",
+            "SQLITE_BUSY_TIMEOUT": 100,
+        }
+    )
+    assert isinstance(get_engine(app).pool, poolclass)
+    with app.app_context():
+        db = get_db()
+        assert db.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+        assert db.execute(text("PRAGMA busy_timeout")).scalar() == 100
+
+
+def test_sqlite_memory_uses_singleton_pool(make_app):
+    app = make_app({"SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    assert isinstance(get_engine(app).pool, SingletonThreadPool)
+
+
+def test_engine_created_on_first_use(app, make_app):
+    app = make_app(dict(app.config))
+    assert app.db_pool is None
+    assert app.db_replicas is None
+    with app.app_context():
+        db = get_db()
+        assert db.engine is app.db_pool
+        # only reads that may go to a replica build those
+        assert app.db_replicas is None
+    # later connections reuse it
+    with app.app_context():
+        assert get_db().engine is app.db_pool
+
+
+def test_split_statements():
+    script = """
+    CREATE TABLE t (a TEXT);
+    CREATE TRIGGER t_insert AFTER INSERT ON t BEGIN
+      UPDATE t SET a = 'x;y' WHERE rowid = new.rowid;
+    END;
+    INSERT INTO t (a) VALUES ('a;b');
+    """
+    statements = list(split_statements(script))
+    assert len(statements) == 3
+    assert statements[1].startswith("CREATE TRIGGER")
+    assert statements[1].endswith("END")
+    assert statements[2] == "INSERT INTO t (a) VALUES ('a;b')"
+
+
+def test_split_statements_mariadb():
+    script = r"""
+    # a comment; with a semicolon
+    INSERT INTO t (a) VALUES ('it\'s; here'), ("x;y");
+    CREATE TRIGGER t_insert BEFORE INSERT ON t FOR EACH ROW BEGIN
+      IF NEW.a IS NULL THEN SET NEW.a = 'x;y'; END IF;
+      SET NEW.b = CASE WHEN NEW.a = '' THEN 1 ELSE 2 END;
+    END;
+    DELIMITER //
+    CREATE PROCEDURE p() BEGIN SELECT 1; END//
+    DELIMITER ;
+    BEGIN;
+    """
+    statements = list(split_statements(script, "mariadb"))
+    assert len(statements) == 4
+    assert statements[0].endswith(r"""VALUES ('it\'s; here'), ("x;y")""")
+    assert statements[1].startswith("CREATE TRIGGER")
+    assert statements[1].endswith("END")
+    assert statements[2] == "CREATE PROCEDURE p() BEGIN SELECT 1; END"
+    assert statements[3] == "BEGIN"
+
+
+def test_mariadb_scripts_split():
+    path = os.path.join(os.path.dirname(flaskr.__file__), "schema_mariadb.sql")
+    with open(path, encoding="utf8") as f:
+        statements = list(split_statements(f.read(), "mariadb"))
+    # two DROPs, two tables, four triggers each ending at its own END
+    assert len(statements) == 8
+    assert [statement.split()[-1] for statement in statements[4:]] == ["END"] * 4
+
+
+def test_executescript_semicolon_in_string(app):
+    with app.app_context():
+        executescript(
+            "INSERT INTO post (title, body, author_id) VALUES ('a;b', 'c; d;', 1);"
+            "INSERT INTO post (title, body, author_id) VALUES ('e', ';', 2);"
+        )
+        rows = get_db().execute(
+            text("SELECT title, body FROM post WHERE id > 1 ORDER BY id")
+        )
+        assert list(rows) == [("a;b", "c; d;"), ("e", ";")]
+
+
+@pytest.fixture
+def replica(app, tmp_path):
+    # a copy of the primary whose post title gives away where a read went
+    path = tmp_path / "replica.sqlite"
+    with app.app_context():
+        get_db().execute(text(f"VACUUM INTO '{path}'"))
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE post SET title = 'replica title'")
+    app.config.update(
+        {
+            "SQLALCHEMY_REPLICA_URIS": [
+                {"uri": f"sqlite:///{path}", "pool_size": 2, "max_overflow": 0}
+            ],
+            "PAGE_CACHE_BACKEND": None,
+        }
+    )
+    app.db_replicas = create_replica_engines(app)
+    app.page_cache = None
+    yield app.db_replicas[0]
+    app.db_replicas[0].dispose()
+
+
+def test_replica_pool_size(replica):
+    assert replica.pool.size() == 2
+    assert replica.pool._max_overflow == 0
+
+
+def test_reads_go_to_replica(client, auth, replica):
+    assert b"replica title" in client.get("/").data
+    auth.login()
+    # the ownership check reads the primary
+    assert b"test title" in client.get("/1/update").data
+
+
+def test_replica_page_not_cached_after_write(client, app, replica, monkeypatch):
+    app.page_cache = MemoryPageCache()
+    now = [1000.0]
+    monkeypatch.setattr("flaskr.page_cache.time.time", lambda: now[0])
+    with app.app_context():
+        invalidate_pages()
+    assert b"replica title" in client.get("/").data
+    assert len(app.page_cache._cache) == 0
+    now[0] += app.config["REPLICA_STICKY_SECONDS"]
+    client.get("/")
+    assert len(app.page_cache._cache) == 1
+
+
+def test_read_your_writes(client, auth, app, replica, monkeypatch):
+    auth.login()
+    client.post("/create", data={"title": "fresh post", "body": ""})
+    response = client.get("/")
+    assert b"fresh post" in response.data
+    assert b"test title" in response.data
+
+    with client.session_transaction() as session:
+        written_at = session[WRITTEN_AT_KEY]
+    monkeypatch.setattr(
+        "flaskr.db.time.time",
+        lambda: written_at + app.config["REPLICA_STICKY_SECONDS"] + 1,
+    )
+    assert b"replica title" in client.get("/").data
+
+
+def test_replica_down_falls_back(client, app, tmp_path):
+    app.config["SQLALCHEMY_REPLICA_URIS"] = [
+        f"sqlite:///{tmp_path / 'missing' / 'replica.sqlite'}"
+    ]
+    app.db_replicas = create_replica_engines(app)
+    app.page_cache = None
+    assert b"test title" in client.get("/").data
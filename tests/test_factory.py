@@ -1,11 +1,16 @@
-from flaskr import create_app
-
-
-def test_config():
-    assert not create_app().testing
-    assert create_app({"TESTING": True}).testing
+def test_config(make_app):
+    assert not make_app({"TESTING": False}).testing
+    assert make_app().testing
 
 
 def test_hello(client):
     response = client.get("/hello")
     assert response.data == b"Hello, World!"
+
+
+def test_secret_key_file_only_read_when_unset(make_app, monkeypatch):
+    def fail(path):
+        raise AssertionError("secret key file read")
+
+    monkeypatch.setattr("flaskr.get_secret_key", fail)
+    assert make_app({"SECRET_KEY": "configured"}).secret_key == "configured"
@@ -0,0 +1,155 @@
+import pytest
+from flask import stream_template
+from sqlalchemy import text
+
+import flaskr.blog
+import flaskr.manage
+from flaskr.db import get_db
+
+
+def test_index_requires_admin(client, auth):
+    auth.login("other", "other")
+    response = client.get("/manage/", follow_redirects=True)
+    assert b"You don&#39;t had permission to access /manage/" in response.data
+
+
+@pytest.mark.parametrize("stream", (True, False))
+def test_index_stream(client, auth, app, monkeypatch, stream):
+    app.config.update({"STREAM_LISTINGS": stream, "STREAM_CHUNK_SIZE": 2})
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            text("INSERT INTO post (title, body, author_id) VALUES (:title, '', 1)"),
+            [{"title": f"streamed post {i}"} for i in range(5)],
+        )
+        db.commit()
+
+    streamed = []
+
+    def spy_stream_template(*args, **kwargs):
+        streamed.append(args[0])
+        return stream_template(*args, **kwargs)
+
+    monkeypatch.setattr(flaskr.blog, "stream_template", spy_stream_template)
+
+    auth.login()
+    data = client.get("/manage/").data
+    assert streamed == (["manage/index.html"] if stream else [])
+    assert b"Manage Posts" in data
+    assert b"test title" in data
+    for i in range(5):
+        assert f"streamed post {i}".encode() in data
+
+
+def _add_posts(app, count, author_id=1):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            text(
+                "INSERT INTO post (title, body, author_id) VALUES (:title, '', :author_id)"
+            ),
+            [{"title": f"bulk post {i}", "author_id": author_id} for i in range(count)],
+        )
+        db.commit()
+
+
+def _titles(app):
+    with app.app_context():
+        return (
+            get_db().execute(text("SELECT title FROM post ORDER BY id")).scalars().all()
+        )
+
+
+def test_bulk_delete(client, auth, app):
+    app.config["BULK_CHUNK_SIZE"] = 2
+    _add_posts(app, 5)
+    auth.login()
+    response = client.post(
+        "/manage/bulk",
+        data={"action": "delete", "ids": ["2", "3", "4", "6", "999"]},
+        follow_redirects=True,
+    )
+    assert b"Deleted 4 of 5 selected posts, 2 per chunk." in response.data
+    assert _titles(app) == ["test title", "bulk post 3"]
+
+
+def test_bulk_update(client, auth, app):
+    app.config["BULK_CHUNK_SIZE"] = 2
+    _add_posts(app, 3)
+    auth.login()
+    response = client.post(
+        "/manage/bulk",
+        data={"action": "update", "ids": ["1", "2", "3"], "title": "cleaned"},
+        follow_redirects=True,
+    )
+    assert b"Updated 3 of 3 selected posts, 2 per chunk." in response.data
+    assert _titles(app) == ["cleaned", "cleaned", "cleaned", "bulk post 2"]
+
+
+@pytest.mark.parametrize(
+    ("data", "message"),
+    (
+        ({"action": "delete"}, b"No post selected."),
+        ({"action": "update", "ids": ["1"]}, b"Title or body is required."),
+        ({"action": "explode", "ids": ["1"]}, b"Unknown bulk action explode"),
+    ),
+)
+def test_bulk_validate(client, auth, app, data, message):
+    auth.login()
+    response = client.post("/manage/bulk", data=data, follow_redirects=True)
+    assert message in response.data
+    assert _titles(app) == ["test title"]
+
+
+def test_delete_by_author(client, auth, app):
+    _add_posts(app, 5, author_id=2)
+    auth.login()
+    response = client.post(
+        "/manage/delete_by_author", data={"username": "other"}, follow_redirects=True
+    )
+    assert b"Deleted 5 posts by other." in response.data
+    assert _titles(app) == ["test title"]
+    with app.app_context():
+        counts = get_db().execute(text("SELECT post_count FROM user ORDER BY id"))
+        assert [count for count, in counts] == [1, 0]
+
+    response = client.post(
+        "/manage/delete_by_author", data={"username": "nobody"}, follow_redirects=True
+    )
+    assert b"User nobody doesn&#39;t exist." in response.data
+
+
+@pytest.mark.parametrize("path", ("/manage/bulk", "/manage/delete_by_author"))
+def test_bulk_requires_admin(client, auth, app, path):
+    auth.login("other", "other")
+    response = client.post(
+        path,
+        data={"action": "delete", "ids": ["1"], "username": "test"},
+        follow_redirects=True,
+    )
+    assert b"You don&#39;t had permission todo this operation" in response.data
+    assert _titles(app) == ["test title"]
+
+
+def test_bulk_rolls_back(client, auth, app, monkeypatch):
+    app.config["BULK_CHUNK_SIZE"] = 1
+    _add_posts(app, 2)
+    calls = []
+    original = flaskr.manage.chunked
+
+    def failing_chunked(items, size):
+        for chunk in original(items, size):
+            calls.append(chunk)
+            if len(calls) == 2:
+                raise RuntimeError("boom")
+            yield chunk
+
+    monkeypatch.setattr(flaskr.manage, "chunked", failing_chunked)
+    auth.login()
+    response = client.post(
+        "/manage/bulk",
+        data={"action": "delete", "ids": ["1", "2"]},
+        follow_redirects=True,
+    )
+    assert b"System error boom, rolled back at 1 of 2 posts." in response.data
+    assert _titles(app) == ["test title", "bulk post 0", "bulk post 1"]
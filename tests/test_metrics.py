@@ -0,0 +1,142 @@
+import logging
+import os
+
+from flaskr.metrics import Metrics, collect, render_prometheus
+
+
+def test_server_timing(client):
+    response = client.get("/")
+    timing = response.headers["Server-Timing"]
+    assert "db;dur=" in timing
+    assert "template;dur=" in timing
+    assert "total;dur=" in timing
+
+    response = client.get("/hello")
+    assert response.headers["Server-Timing"].startswith("total;dur=")
+
+
+def test_streamed_listing(client, app):
+    app.config["STREAM_LISTINGS"] = True
+    app.page_cache = None
+    response = client.get("/")
+    assert "Server-Timing" not in response.headers
+    assert app.metrics.snapshot() == []
+    response.get_data()
+    response.close()
+    totals = {
+        (metric, tuple(labels)): value
+        for metric, labels, value in app.metrics.snapshot()
+    }
+    assert totals[("flaskr_requests_total", ("blog.index", "GET", "200"))] == 1
+    assert totals[("flaskr_db_queries_total", ("blog.index",))] >= 1
+    assert ("flaskr_template_duration_seconds_total", ("blog.index",)) in totals
+
+
+def test_query_counts(client, app):
+    client.get("/")
+    client.get("/")
+    totals = {
+        (metric, tuple(labels)): value
+        for metric, labels, value in app.metrics.snapshot()
+    }
+    assert totals[("flaskr_requests_total", ("blog.index", "GET", "200"))] == 2
+    assert totals[("flaskr_request_duration_seconds_count", ("blog.index",))] == 2
+    # the second hit is served from the page cache
+    assert totals[("flaskr_db_queries_total", ("blog.index",))] == 1
+
+
+def test_slow_query_log(client, app, caplog):
+    app.config["SLOW_QUERY_THRESHOLD"] = 0
+    with caplog.at_level(logging.WARNING, logger="flaskr.metrics"):
+        client.get("/")
+    assert "slow query" in caplog.text
+    assert "FROM post ORDER BY" in caplog.text
+
+
+def test_metrics_endpoint(client, app):
+    assert client.get("/metrics").status_code == 404
+    app.config["METRICS_ENDPOINT"] = True
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert b"# TYPE flaskr_requests_total counter" in response.data
+    assert (
+        b'flaskr_requests_total{endpoint="blog.index",method="GET",status="200"} 1'
+        in response.data
+    )
+    assert b"# TYPE flaskr_request_duration_seconds summary" in response.data
+
+
+def test_metrics_token(client, app):
+    app.config.update({"METRICS_ENDPOINT": True, "METRICS_TOKEN": "secret"})
+    assert client.get("/metrics").status_code == 401
+    headers = {"Authorization": "Bearer wrong"}
+    assert client.get("/metrics", headers=headers).status_code == 401
+    headers = {"Authorization": "Bearer secret"}
+    assert client.get("/metrics", headers=headers).status_code == 200
+
+
+def test_metrics_aggregate_workers(client, app, tmp_path):
+    app.config.update({"METRICS_DIR": str(tmp_path), "METRICS_ENDPOINT": True})
+    # another worker process that already flushed its counters
+    other = Metrics()
+    other.inc("flaskr_requests_total", ["blog.index", "GET", "200"], 41)
+    other.flush(str(tmp_path), force=True)
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / "1.json")
+
+    client.get("/")
+    response = client.get("/metrics")
+    assert (
+        b'flaskr_requests_total{endpoint="blog.index",method="GET",status="200"} 42'
+        in response.data
+    )
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+
+def _counter(app, path):
+    with app.app_context():
+        return collect(str(path))[
+            ("flaskr_requests_total", ("blog.index", "GET", "200"))
+        ]
+
+
+def test_dead_workers_retained(app, tmp_path, monkeypatch):
+    app.metrics = Metrics()
+    dead = Metrics()
+    dead.inc("flaskr_requests_total", ["blog.index", "GET", "200"], 5)
+    dead.flush(str(tmp_path), force=True)
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / "999999.json")
+    monkeypatch.setattr("flaskr.metrics._alive", lambda pid: pid != 999999)
+
+    app.metrics.inc("flaskr_requests_total", ["blog.index", "GET", "200"], 1)
+    assert _counter(app, tmp_path) == 6
+    assert not (tmp_path / "999999.json").exists()
+    # counts don't go backwards when this worker exits too
+    app.metrics.close(str(tmp_path))
+    assert not (tmp_path / f"{os.getpid()}.json").exists()
+    app.metrics = Metrics()
+    assert _counter(app, tmp_path) == 6
+
+
+def test_reused_pid_kept(app, tmp_path):
+    # a file under this pid left by a process that had it before
+    gone = Metrics()
+    gone.inc("flaskr_requests_total", ["blog.index", "GET", "200"], 5)
+    gone.flush(str(tmp_path), force=True)
+
+    app.metrics = Metrics()
+    app.metrics.inc("flaskr_requests_total", ["blog.index", "GET", "200"], 1)
+    assert _counter(app, tmp_path) == 6
+
+
+def test_render_prometheus():
+    text = render_prometheus(
+        {
+            ("flaskr_request_duration_seconds_sum", ("blog.index",)): 0.5,
+            ("flaskr_request_duration_seconds_count", ("blog.index",)): 2,
+        }
+    )
+    assert text.count("# TYPE flaskr_request_duration_seconds summary") == 1
+    assert 'flaskr_request_duration_seconds_sum{endpoint="blog.index"} 0.5' in text
+    assert 'flaskr_request_duration_seconds_count{endpoint="blog.index"} 2' in text
@@ -0,0 +1,145 @@
+import pytest
+from sqlalchemy import inspect, text
+
+from flaskr.db import get_db
+from flaskr.migrate import load_migrations
+
+
+def _schema(db):
+    rows = db.execute(
+        text(
+            "SELECT type, name FROM sqlite_master "
+            "WHERE name NOT LIKE 'sqlite_%' AND name NOT LIKE 'post_fts_%'"
+        )
+    )
+    return set(rows)
+
+
+@pytest.fixture
+def empty_app(make_app, tmp_path):
+    return make_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'empty.sqlite'}",
+            "MIGRATION_BATCH_PAUSE": 0,
+        }
+    )
+
+
+@pytest.mark.parametrize("db_type", ("sqlite", "mariadb"))
+def test_migrations_per_dialect(db_type):
+    migrations = load_migrations(db_type)
+    assert [m.version for m in migrations] == [1, 2, 3]
+    for migration in migrations:
+        assert {"up", "down"} <= set(migration.scripts)
+
+
+def test_upgrade_matches_schema_file(empty_app, app):
+    result = empty_app.test_cli_runner().invoke(args=["db", "upgrade"])
+    assert "Applying 0001_initial" in result.output
+    assert "Applying 0002_post_author_username" in result.output
+    assert "up to date" in result.output
+
+    with empty_app.app_context():
+        upgraded = _schema(get_db())
+    with app.app_context():
+        assert upgraded == _schema(get_db())
+
+
+def test_init_db_stamps(runner):
+    result = runner.invoke(args=["db", "status"])
+    assert "pending" not in result.output
+    assert "0002_post_author_username" in result.output
+
+
+def test_backfill_in_batches(empty_app):
+    runner = empty_app.test_cli_runner()
+    runner.invoke(args=["db", "upgrade", "--to", "1"])
+    with empty_app.app_context():
+        db = get_db()
+        db.execute(
+            text("INSERT INTO user (username, password) VALUES ('a', 'x'), ('b', 'x')")
+        )
+        db.execute(
+            text(
+                "INSERT INTO post (title, body, author_id) "
+                "VALUES ('1', '', 1), ('2', '', 2), ('3', '', 1)"
+            )
+        )
+        db.commit()
+
+    result = runner.invoke(args=["db", "upgrade", "--batch-size", "2"])
+    assert "up to 2, 2 rows updated" in result.output
+    assert "up to 3, 3 rows updated" in result.output
+
+    with empty_app.app_context():
+        rows = get_db().execute(
+            text("SELECT title, author_username FROM post ORDER BY id")
+        )
+        assert list(rows) == [("1", "a"), ("2", "b"), ("3", "a")]
+
+
+def test_post_count_backfill(empty_app):
+    runner = empty_app.test_cli_runner()
+    runner.invoke(args=["db", "upgrade", "--to", "2"])
+    with empty_app.app_context():
+        db = get_db()
+        db.execute(
+            text("INSERT INTO user (username, password) VALUES ('a', 'x'), ('b', 'x')")
+        )
+        db.execute(
+            text(
+                "INSERT INTO post (title, body, author_id) "
+                "VALUES ('1', '', 1), ('2', '', 2), ('3', '', 1)"
+            )
+        )
+        db.commit()
+
+    result = runner.invoke(args=["db", "upgrade"])
+    assert "Backfilling 0003_author_posts" in result.output
+
+    with empty_app.app_context():
+        db = get_db()
+        counts = db.execute(text("SELECT username, post_count FROM user ORDER BY id"))
+        assert list(counts) == [("a", 2), ("b", 1)]
+        # and kept from then on
+        db.execute(text("DELETE FROM post WHERE author_id = 1"))
+        db.commit()
+        counts = db.execute(text("SELECT post_count FROM user ORDER BY id"))
+        assert [count for count, in counts] == [0, 1]
+
+
+def test_interrupted_backfill_resumes(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.execute(text("UPDATE post SET author_username = NULL"))
+        db.execute(
+            text("UPDATE schema_version SET backfilled_at = NULL WHERE version = 2")
+        )
+        db.commit()
+
+    assert "backfill pending" in runner.invoke(args=["db", "status"]).output
+    result = runner.invoke(args=["db", "upgrade"])
+    assert "Applying" not in result.output
+    assert "1 rows updated" in result.output
+    assert "backfill pending" not in runner.invoke(args=["db", "status"]).output
+
+
+def test_downgrade(app, runner):
+    result = runner.invoke(args=["db", "downgrade"])
+    assert "Reverting 0003_author_posts" in result.output
+    with app.app_context():
+        columns = {c["name"] for c in inspect(get_db()).get_columns("user")}
+        assert "post_count" not in columns
+
+    result = runner.invoke(args=["db", "downgrade"])
+    assert "Reverting 0002_post_author_username" in result.output
+    with app.app_context():
+        columns = {c["name"] for c in inspect(get_db()).get_columns("post")}
+        assert "author_username" not in columns
+
+    result = runner.invoke(args=["db", "upgrade"])
+    assert "Applying 0002_post_author_username" in result.output
+
+    runner.invoke(args=["db", "downgrade", "--to", "0"])
+    with app.app_context():
+        assert set(inspect(get_db()).get_table_names()) == {"schema_version"}
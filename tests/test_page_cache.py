@@ -0,0 +1,158 @@
+import os
+
+import pytest
+from sqlalchemy import text
+
+from flaskr.db import get_db
+from flaskr.page_cache import (
+    FilePageCache,
+    MemoryPageCache,
+    create_backend,
+    invalidate_pages,
+)
+
+
+def _rename_post(app, title):
+    # write behind the app's back, a cached page must not notice
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            text("UPDATE post SET title = :title WHERE id = 1"), {"title": title}
+        )
+        db.commit()
+
+
+def test_index_is_cached(client, app):
+    assert b"test title" in client.get("/").data
+    _rename_post(app, "sneaky title")
+    assert b"test title" in client.get("/").data
+
+
+def test_cache_varies_on_user(client, auth, app):
+    client.get("/")
+    _rename_post(app, "sneaky title")
+    auth.login()
+    response = client.get("/")
+    assert b"sneaky title" in response.data
+    assert b"Log Out" in response.data
+
+
+def test_write_invalidates(client, auth, app):
+    auth.login()
+    client.get("/")
+    client.post("/1/update", data={"title": "updated", "body": ""})
+    assert b"updated" in client.get("/").data
+
+
+def test_conditional_get(client, app, monkeypatch):
+    response = client.get("/")
+    etag = response.headers["ETag"]
+    assert "Last-Modified" not in response.headers
+
+    def fail_get_posts_page(*args, **kwargs):
+        raise AssertionError("query should not run")
+
+    monkeypatch.setattr("flaskr.blog.get_posts_page", fail_get_posts_page)
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    monkeypatch.undo()
+
+    response = client.get("/", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+
+def test_write_in_same_second_not_304(client, auth, app, monkeypatch):
+    now = [1000.25]
+    monkeypatch.setattr("flaskr.page_cache.time.time", lambda: now[0])
+    client.get("/")
+    now[0] = 1000.75
+    auth.login()
+    client.post("/1/update", data={"title": "updated", "body": ""})
+    client.get("/auth/logout")
+    # what a browser sends when it fetched the page in that same second
+    response = client.get(
+        "/", headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:16:40 GMT"}
+    )
+    assert response.status_code == 200
+    assert b"updated" in response.data
+
+
+def test_unread_args_share_entry(client, app):
+    client.get("/")
+    for i in range(5):
+        client.get(f"/?junk={i}")
+    _rename_post(app, "sneaky title")
+    assert b"test title" in client.get("/?junk=6").data
+    assert len(app.page_cache._cache) == 1
+
+
+def test_disabled(app, client):
+    app.page_cache = None
+    client.get("/")
+    _rename_post(app, "sneaky title")
+    assert b"sneaky title" in client.get("/").data
+
+
+@pytest.mark.parametrize("backend", ("memory", "file"))
+def test_create_backend(app, tmp_path, backend):
+    app.config.update({"PAGE_CACHE_BACKEND": backend, "PAGE_CACHE_DIR": tmp_path})
+    cache = create_backend(app)
+    assert isinstance(cache, (MemoryPageCache, FilePageCache))
+    cache.set("key", {"body": "value"})
+    assert cache.get("key") == {"body": "value"}
+    cache.clear()
+    assert cache.get("key") is None
+
+
+def test_file_backend_shared(tmp_path):
+    first = FilePageCache(tmp_path)
+    second = FilePageCache(tmp_path)
+    first.set("key", "value")
+    assert second.get("key") == "value"
+    second.clear()
+    assert first.get("key") is None
+
+
+def test_file_backend_bounded(tmp_path):
+    cache = FilePageCache(tmp_path, maxsize=3)
+    cache.set_generation(1.5)
+    for i in range(5):
+        cache.set(f"key{i}", i)
+        os.utime(cache._filename(f"key{i}"), (1000 + i, 1000 + i))
+    assert [cache.get(f"key{i}") for i in range(5)] == [None, None, 2, 3, 4]
+    # the generation isn't a page, it's never evicted or cleared
+    cache.clear()
+    assert cache.get_generation() == 1.5
+
+
+def test_memory_generation_not_evicted():
+    cache = MemoryPageCache(maxsize=2)
+    cache.set_generation(1.5)
+    for i in range(3):
+        cache.set(f"key{i}", i)
+    cache.clear()
+    assert cache.get_generation() == 1.5
+
+
+def test_memory_generation_shared(tmp_path):
+    first = MemoryPageCache(generation_file=str(tmp_path / "generation"))
+    second = MemoryPageCache(generation_file=str(tmp_path / "generation"))
+    first.set_generation(1.5)
+    assert second.get_generation() == 1.5
+
+
+def test_write_in_other_worker_invalidates(client, app, make_app):
+    other = make_app(dict(app.config))
+    client.get("/")
+    _rename_post(app, "sneaky title")
+    # what a write served by the other worker does
+    with other.app_context():
+        invalidate_pages()
+    assert b"sneaky title" in client.get("/").data
+
+
+def test_file_backend_ttl(tmp_path, monkeypatch):
+    cache = FilePageCache(tmp_path, ttl=10)
+    cache.set("key", "value")
+    monkeypatch.setattr("flaskr.page_cache.time.time", lambda: 2**40)
+    assert cache.get("key") is None
@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import text
+
+from flaskr.db import get_db
+from flaskr.passwords import PasswordHasher, PasswordHasherBusy, normalize_method
+
+
+def _stored_hash(app, username):
+    with app.app_context():
+        return (
+            get_db()
+            .execute(
+                text("SELECT password FROM user WHERE username = :username"),
+                {"username": username},
+            )
+            .scalar_one()
+        )
+
+
+def test_rehash_legacy_hash_on_login(client, auth, app):
+    assert _stored_hash(app, "other").startswith("pbkdf2:sha256:50000$")
+    response = auth.login("other", "other")
+    assert response.headers["Location"] == "/"
+    assert _stored_hash(app, "other").startswith("scrypt:32768:8:1$")
+
+    auth.logout()
+    assert auth.login("other", "other").headers["Location"] == "/"
+
+
+def test_no_rehash_for_current_hash(client, auth, app):
+    before = _stored_hash(app, "test")
+    auth.login()
+    assert _stored_hash(app, "test") == before
+
+
+def test_configured_method(client, app):
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    from flaskr import passwords
+
+    passwords.init_app(app)
+    client.post("/auth/register", data={"username": "a", "password": "a"})
+    assert _stored_hash(app, "a").startswith("pbkdf2:sha256:1000$")
+
+
+@pytest.mark.parametrize(
+    ("method", "expected"),
+    (
+        ("scrypt", "scrypt:32768:8:1"),
+        ("scrypt:16384:8:1", "scrypt:16384:8:1"),
+        ("pbkdf2:sha256:1000", "pbkdf2:sha256:1000"),
+    ),
+)
+def test_normalize_method(method, expected):
+    assert normalize_method(method) == expected
+
+
+@pytest.mark.parametrize("workers", (0, 1))
+def test_hash_and_check(workers):
+    hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=workers)
+    pwhash = hasher.hash("secret")
+    assert hasher.check(pwhash, "secret")
+    assert not hasher.check(pwhash, "wrong")
+    assert not hasher.needs_rehash(pwhash)
+
+
+def test_busy_returns_503(client, app):
+    hasher = PasswordHasher(workers=1, max_pending=1, retry_after=3)
+    app.password_hasher = hasher
+    # hold the only slot, as a hash still running would
+    assert hasher._slots.acquire(blocking=False)
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash("secret")
+        response = client.post(
+            "/auth/login", data={"username": "test", "password": "test"}
+        )
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "3"
+    finally:
+        hasher._slots.release()
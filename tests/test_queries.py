@@ -0,0 +1,79 @@
+from datetime import datetime
+
+from flaskr import queries
+from flaskr.db import get_db
+
+
+def test_reflected_tables():
+    assert set(queries.user.c.keys()) == {"id", "username", "password", "post_count"}
+    assert set(queries.post.c.keys()) == {
+        "id",
+        "author_id",
+        "created",
+        "title",
+        "body",
+        "author_username",
+    }
+
+
+def test_listing_reads_post_only():
+    assert [t.name for t in queries.posts_first_page.get_final_froms()] == ["post"]
+
+
+def test_author_username_filled_in(app):
+    with app.app_context():
+        db = get_db()
+        post = db.execute(queries.post_by_id, {"post_id": 1}).fetchone()
+        # conftest inserts the post without it
+        assert post.username == "test"
+        db.execute(queries.update_user, {"user_id": 1, "username": "renamed"})
+        post = db.execute(queries.post_by_id, {"post_id": 1}).fetchone()
+        assert post.username == "renamed"
+
+
+def test_created_round_trip(app):
+    with app.app_context():
+        db = get_db()
+        post = db.execute(queries.post_by_id, {"post_id": 1}).fetchone()
+        assert post.created == datetime(2018, 1, 1)
+        # a bound datetime compares equal to the stored CURRENT_TIMESTAMP text
+        rows = db.execute(
+            queries.posts_after, {"created": post.created, "id": 2, "limit": 5}
+        ).fetchall()
+        assert [row.id for row in rows] == [1]
+
+
+def test_executemany_insert(app):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            queries.insert_post,
+            [{"title": f"many {i}", "body": "", "author_id": 1} for i in range(3)],
+        )
+        db.commit()
+        rows = db.execute(queries.all_posts).fetchall()
+        assert len(rows) == 4
+
+
+def test_author_pages_use_index(app):
+    with app.app_context():
+        db = get_db()
+        params = {"author_id": 1, "created": datetime(2019, 1, 1), "id": 5}
+        for statement in (
+            queries.author_posts_first_page,
+            queries.author_posts_after,
+            queries.author_posts_before,
+        ):
+            compiled = statement.compile(
+                db, compile_kwargs={"render_postcompile": True}
+            )
+            plan = db.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {compiled}",
+                tuple(
+                    dict(compiled.params, limit=5, **params)[name]
+                    for name in compiled.positiontup
+                ),
+            ).fetchall()
+            details = " ".join(row[-1] for row in plan)
+            assert "idx_post_author_created_id" in details
+            assert "TEMP B-TREE" not in details
@@ -0,0 +1,145 @@
+import time
+
+import pytest
+
+from flaskr.ratelimit import (
+    MemoryRateLimitStore,
+    SqliteRateLimitStore,
+    create_store,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(app, request, tmp_path):
+    if request.param == "memory":
+        return MemoryRateLimitStore()
+    return SqliteRateLimitStore(app, str(tmp_path / "ratelimit.sqlite"))
+
+
+def test_take(store):
+    assert store.take("a", 2, 0.1) == 0
+    assert store.take("a", 2, 0.1) == 0
+    wait = store.take("a", 2, 0.1)
+    assert 0 < wait <= 10
+    # other keys have their own bucket
+    assert store.take("b", 2, 0.1) == 0
+
+
+def test_refill(store):
+    assert store.take("a", 1, 100) == 0
+    assert store.take("a", 1, 100) > 0
+    time.sleep(0.02)
+    assert store.take("a", 1, 100) == 0
+    store.clear()
+    assert store.take("a", 1, 0.001) == 0
+
+
+def test_create_store(app, tmp_path):
+    assert isinstance(create_store(app), MemoryRateLimitStore)
+    app.config["RATELIMIT_BACKEND"] = "sqlite"
+    app.config["RATELIMIT_DB_PATH"] = str(tmp_path / "ratelimit.sqlite")
+    assert isinstance(create_store(app), SqliteRateLimitStore)
+    app.config["RATELIMIT_BACKEND"] = None
+    assert create_store(app) is None
+    app.config["RATELIMIT_BACKEND"] = "redis"
+    with pytest.raises(ValueError):
+        create_store(app)
+
+
+def test_per_username(client, app):
+    app.config["RATELIMIT_PER_USERNAME"] = (2, 60)
+    for _ in range(2):
+        response = client.post(
+            "/auth/login", data={"username": "test", "password": "a"}
+        )
+        assert response.status_code == 302
+    response = client.post("/auth/login", data={"username": "test", "password": "a"})
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 30
+    # the account is limited, not the client
+    response = client.post("/auth/login", data={"username": "other", "password": "a"})
+    assert response.status_code == 302
+
+
+def test_per_ip(client, app):
+    app.config["RATELIMIT_PER_IP"] = (2, 60)
+    for username in ("a", "b"):
+        response = client.post(
+            "/auth/register", data={"username": username, "password": "a"}
+        )
+        assert response.status_code == 302
+    response = client.post("/auth/login", data={"username": "c", "password": "a"})
+    assert response.status_code == 429
+    # only POSTs spend tokens
+    assert client.get("/auth/login").status_code == 200
+
+
+def test_sqlite_prunes_full_buckets(app, tmp_path, monkeypatch):
+    store = SqliteRateLimitStore(
+        app, str(tmp_path / "ratelimit.sqlite"), max_age=60, prune_interval=10
+    )
+    now = [1000.0]
+    monkeypatch.setattr("flaskr.ratelimit.time.time", lambda: now[0])
+    for i in range(5):
+        store.take(f"user:{i}", 10, 10 / 60)
+    now[0] += 61
+    store.take("user:fresh", 10, 10 / 60)
+    with store.engine.connect() as conn:
+        keys = conn.exec_driver_sql("SELECT key FROM rate_limit").scalars().all()
+    assert keys == ["user:fresh"]
+
+
+def test_client_ip_header(client, app):
+    app.config.update(
+        {"RATELIMIT_PER_IP": (1, 60), "CLIENT_IP_HEADER": "CF-Connecting-IP"}
+    )
+    for ip in ("203.0.113.1", "203.0.113.2"):
+        response = client.post(
+            "/auth/login",
+            data={"username": "a", "password": "a"},
+            headers={"CF-Connecting-IP": ip},
+        )
+        assert response.status_code == 302
+    response = client.post(
+        "/auth/login",
+        data={"username": "a", "password": "a"},
+        headers={"CF-Connecting-IP": "203.0.113.1"},
+    )
+    assert response.status_code == 429
+
+
+def test_proxy_fix(app, make_app):
+    app = make_app(dict(app.config, PROXY_FIX={"x_for": 1}, RATELIMIT_PER_IP=(1, 60)))
+    client = app.test_client()
+    for ip in ("203.0.113.1", "203.0.113.2"):
+        response = client.post(
+            "/auth/login",
+            data={"username": "a", "password": "a"},
+            headers={"X-Forwarded-For": ip},
+        )
+        assert response.status_code == 302
+
+
+def test_before_turnstile(client, app, turnstile_server):
+    app.config.update({"TESTING": False, "RATELIMIT_PER_IP": (1, 60)})
+    data = {
+        "username": "test",
+        "password": "a",
+        "cf-turnstile-response": "XXXX.DUMMY.TOKEN.XXXX",
+    }
+    client.post("/auth/login", data=data)
+    response = client.post("/auth/login", data=data)
+    assert response.status_code == 429
+    assert len(turnstile_server.requests) == 1
+
+
+def test_change_password(client, auth, app):
+    auth.login()
+    app.config["RATELIMIT_PER_USERNAME"] = (1, 60)
+    data = {
+        "current_password": "wrong",
+        "new_password": "new",
+        "confirm_new_password": "new",
+    }
+    assert client.post("/auth/change_password", data=data).status_code == 302
+    assert client.post("/auth/change_password", data=data).status_code == 429
@@ -0,0 +1,124 @@
+import pytest
+from flask import g
+
+from flaskr import auth as auth_module
+from flaskr.sessions import (
+    MemorySessionStore,
+    ServerSideSessionInterface,
+    SqliteSessionStore,
+    create_store,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def session_app(app, request, tmp_path):
+    app.config["SESSION_BACKEND"] = request.param
+    app.config["SESSION_DB_PATH"] = str(tmp_path / "sessions.sqlite")
+    app.session_interface = ServerSideSessionInterface(create_store(app))
+    return app
+
+
+def login(client, username="test", password="test"):
+    return client.post("/auth/login", data={"username": username, "password": password})
+
+
+def test_create_store(app, tmp_path):
+    assert create_store(app) is None
+    app.config["SESSION_BACKEND"] = "memory"
+    assert isinstance(create_store(app), MemorySessionStore)
+    app.config["SESSION_BACKEND"] = "sqlite"
+    app.config["SESSION_DB_PATH"] = str(tmp_path / "sessions.sqlite")
+    assert isinstance(create_store(app), SqliteSessionStore)
+    app.config["SESSION_BACKEND"] = "redis"
+    with pytest.raises(ValueError):
+        create_store(app)
+
+
+def test_login_skips_user_lookup(session_app, monkeypatch):
+    client = session_app.test_client()
+    login(client)
+    cookie = client.get_cookie("session")
+    # an opaque id, nothing of the session travels in the cookie
+    assert "." not in cookie.value and len(cookie.value) >= 32
+
+    def fail_verify_user(user_id, username):
+        raise AssertionError("user looked up")
+
+    monkeypatch.setattr(auth_module, "verify_user", fail_verify_user)
+    with client:
+        client.get("/")
+        assert g.user == {"id": 1, "username": "test"}
+
+
+def test_login_regenerates_id(session_app):
+    client = session_app.test_client()
+    client.get("/auth/login")
+    client.post("/auth/login", data={"username": "test", "password": "a"})
+    before = client.get_cookie("session").value
+    login(client)
+    assert client.get_cookie("session").value != before
+    assert session_app.session_interface.store.load(before) is None
+
+
+def test_change_password_revokes_other_sessions(session_app):
+    other = session_app.test_client()
+    login(other)
+    client = session_app.test_client()
+    login(client)
+    client.post(
+        "/auth/change_password",
+        data={
+            "current_password": "test",
+            "new_password": "newpassword",
+            "confirm_new_password": "newpassword",
+        },
+    )
+
+    with other:
+        other.get("/")
+        assert g.user is None
+
+    # logging in again after the change works as usual
+    login(other, password="newpassword")
+    with other:
+        other.get("/")
+        assert g.user["id"] == 1
+
+
+def test_logout_deletes_session(session_app):
+    client = session_app.test_client()
+    login(client)
+    sid = client.get_cookie("session").value
+    client.get("/auth/logout")
+    assert session_app.session_interface.store.load(sid) is None
+    assert client.get_cookie("session") is None
+
+
+@pytest.mark.parametrize("session_app", ["sqlite"], indirect=True)
+def test_revoke_sessions_command(session_app):
+    client = session_app.test_client()
+    login(client)
+    runner = session_app.test_cli_runner()
+
+    result = runner.invoke(args=["revoke-sessions", "test"])
+    assert "Revoked every session of test." in result.output
+    with client:
+        client.get("/")
+        assert g.user is None
+
+    result = runner.invoke(args=["revoke-sessions", "nobody"])
+    assert "User nobody doesn't exist." in result.output
+
+
+@pytest.mark.parametrize("session_app", ["memory"], indirect=True)
+def test_revoke_sessions_refused_for_memory_store(session_app):
+    result = session_app.test_cli_runner().invoke(args=["revoke-sessions", "test"])
+    assert result.exit_code == 1
+    assert 'Only the "sqlite" session backend' in result.output
+    assert "Revoked" not in result.output
+
+
+def test_revoke_sessions_needs_server_side_sessions(runner):
+    result = runner.invoke(args=["revoke-sessions", "test"])
+    assert result.exit_code == 1
+    assert "Cookie sessions can't be revoked." in result.output
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+from jinja2 import FileSystemBytecodeCache
+
+
+@pytest.fixture
+def cache_app(make_app, tmp_path):
+    def cache_app(**config):
+        return make_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'db.sqlite'}",
+                "TEMPLATE_CACHE_DIR": str(tmp_path / "jinja_cache"),
+                **config,
+            }
+        )
+
+    return cache_app
+
+
+def test_bytecode_cache(cache_app, tmp_path):
+    app = cache_app()
+    assert isinstance(app.jinja_env.bytecode_cache, FileSystemBytecodeCache)
+    assert os.listdir(tmp_path / "jinja_cache") == []
+    app.test_client().get("/auth/login")
+    # base.html and auth/login.html
+    assert len(os.listdir(tmp_path / "jinja_cache")) == 2
+
+
+def test_compile_command(cache_app, tmp_path):
+    app = cache_app()
+    result = app.test_cli_runner().invoke(args=["templates", "compile"])
+    names = app.jinja_env.list_templates(extensions=("html",))
+    assert f"Compiled {len(names)} templates" in result.output
+    assert len(os.listdir(tmp_path / "jinja_cache")) == len(names)
+
+    # a new worker renders without compiling anything
+    app = cache_app()
+
+    def fail_compile(*args, **kwargs):
+        raise AssertionError("template compiled again")
+
+    app.jinja_env.compile = fail_compile
+    assert app.test_client().get("/auth/login").status_code == 200
+
+
+def test_warm_up(cache_app, tmp_path):
+    app = cache_app(TEMPLATE_WARM_UP=True)
+    names = app.jinja_env.list_templates(extensions=("html",))
+    assert len(os.listdir(tmp_path / "jinja_cache")) == len(names)
+
+
+def test_disabled(cache_app):
+    app = cache_app(TEMPLATE_CACHE_DIR=None)
+    assert app.jinja_env.bytecode_cache is None
+    result = app.test_cli_runner().invoke(args=["templates", "compile"])
+    assert "TEMPLATE_CACHE_DIR isn't set." in result.output
@@ -0,0 +1,126 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+from flaskr.db import get_db, init_db
+from flaskr.page_cache import create_backend
+
+
+@pytest.fixture
+def empty_app(make_app, tmp_path):
+    app = make_app(
+        {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'empty.sqlite'}"}
+    )
+    with app.app_context():
+        init_db()
+    return app
+
+
+def _dump(app):
+    with app.app_context():
+        db = get_db()
+        return (
+            db.execute(text("SELECT * FROM user ORDER BY id")).fetchall(),
+            db.execute(text("SELECT * FROM post ORDER BY id")).fetchall(),
+        )
+
+
+@pytest.mark.parametrize("extension", ("ndjson", "csv"))
+def test_round_trip(runner, app, empty_app, tmp_path, extension):
+    for table in ("users", "posts"):
+        path = tmp_path / f"{table}.{extension}"
+        result = runner.invoke(args=["export", table, "-o", str(path)])
+        assert result.exit_code == 0, result.output
+
+    empty_runner = empty_app.test_cli_runner()
+    for table in ("users", "posts"):
+        path = tmp_path / f"{table}.{extension}"
+        result = empty_runner.invoke(
+            args=["import", table, str(path), "--chunk-size", "1"]
+        )
+        assert result.exit_code == 0, result.output
+
+    assert _dump(empty_app) == _dump(app)
+    assert b"test title" in empty_app.test_client().get("/search?q=body").data
+    # the workers share the page cache generation
+    assert "in-memory page cache" not in result.stderr
+
+
+def test_import_notes_per_worker_cache(empty_app, runner, tmp_path):
+    path = tmp_path / "users.ndjson"
+    runner.invoke(args=["export", "users", "-o", str(path)])
+    empty_app.config["PAGE_CACHE_GENERATION_FILE"] = None
+    empty_app.page_cache = create_backend(empty_app)
+    result = empty_app.test_cli_runner().invoke(args=["import", "users", str(path)])
+    assert result.exit_code == 0, result.output
+    assert "in-memory page cache" in result.stderr
+
+
+def test_import_deferred_index(empty_app, runner, tmp_path):
+    path = tmp_path / "users.ndjson"
+    runner.invoke(args=["export", "users", "-o", str(path)])
+    empty_runner = empty_app.test_cli_runner()
+    empty_runner.invoke(args=["import", "users", str(path)])
+    path = tmp_path / "posts.ndjson"
+    runner.invoke(args=["export", "posts", "-o", str(path)])
+    result = empty_runner.invoke(args=["import", "posts", str(path), "--defer-index"])
+    assert result.exit_code == 0, result.output
+    # the full-text index was rebuilt after the triggerless load
+    assert b"test title" in empty_app.test_client().get("/search?q=body").data
+
+
+def test_export_stdout(runner):
+    result = runner.invoke(args=["export", "posts"])
+    post = json.loads(result.stdout.splitlines()[0])
+    assert post["title"] == "test title"
+    assert post["body"] == "test\nbody"
+    assert post["created"] == "2018-01-01 00:00:00"
+    assert post["author_username"] == "test"
+
+
+def test_import_partial_columns(empty_app, tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text("username,password,ignored\nfirst,x,y\nsecond,x,y\n")
+    result = empty_app.test_cli_runner().invoke(
+        args=["import", "users", str(path), "--chunk-size", "1"]
+    )
+    assert "Imported 1 users..." in result.stderr
+    assert "Imported 2 users." in result.stdout
+    assert [row.username for row in _dump(empty_app)[0]] == ["first", "second"]
+
+
+def test_import_chunk_size_config(empty_app, tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text("username,password\nfirst,x\nsecond,x\n")
+    empty_app.config["IMPORT_CHUNK_SIZE"] = 1
+    result = empty_app.test_cli_runner().invoke(args=["import", "users", str(path)])
+    assert "Imported 1 users..." in result.stderr
+
+
+def test_import_failure_keeps_committed_chunks(app, runner, tmp_path):
+    path = tmp_path / "posts.ndjson"
+    rows = [
+        {"id": 10, "author_id": 1, "title": "new", "body": ""},
+        {"id": 1, "author_id": 1, "title": "clash", "body": ""},
+    ]
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    result = runner.invoke(
+        args=["import", "posts", str(path), "--chunk-size", "1", "--defer-index"]
+    )
+    assert result.exit_code != 0
+    assert "Imported 1 posts before the error." in result.stderr
+
+    with app.app_context():
+        db = get_db()
+        titles = db.execute(text("SELECT title FROM post ORDER BY id")).scalars()
+        assert list(titles) == ["test title", "new"]
+        # the trigger is back, new posts are searchable again
+        assert (
+            db.execute(
+                text(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE name = 'post_fts_insert'"
+                )
+            ).scalar()
+            == 1
+        )
@@ -1,11 +1,13 @@
+import asyncio
+
 import pytest
 
-from flaskr.turnstile import cf_turnstile_verify
+from flaskr.turnstile import cf_turnstile_verify, cf_turnstile_verify_async
 
 TURNSTILE_DUMMY_TOKEN = "XXXX.DUMMY.TOKEN.XXXX"
 
 
-def test_captcha_fail(client, app):
+def test_captcha_fail(client, app, turnstile_server):
     with app.app_context():
         app.config.update(
             {
@@ -43,7 +45,13 @@ def test_captcha_fail(client, app):
     ),
 )
 def test_verify(
-    client, app, cf_secret_key, cf_site_key, expected_result, expected_message
+    client,
+    app,
+    turnstile_server,
+    cf_secret_key,
+    cf_site_key,
+    expected_result,
+    expected_message,
 ):
     with app.app_context():
         app.config.update(
@@ -65,3 +73,187 @@ def test_verify_failed(client, app):
         # Assertions
         assert cf_response is False
         assert "missing-input-response" in cf_message
+
+
+def test_verify_reuses_client(app, turnstile_server):
+    # created on the first verification, not with the app
+    assert app.turnstile_client is None
+    with app.app_context():
+        assert cf_turnstile_verify(TURNSTILE_DUMMY_TOKEN) == (True, [])
+        client = app.turnstile_client
+        assert cf_turnstile_verify("another token") == (True, [])
+    assert client is not None
+    assert app.turnstile_client is client
+    assert len(turnstile_server.requests) == 2
+    assert turnstile_server.requests[0]["response"] == [TURNSTILE_DUMMY_TOKEN]
+
+
+def test_verify_unreachable(app):
+    app.config.update(
+        {
+            "CF_TURNSTILE_VERIFY_URL": "http://127.0.0.1:9/siteverify",
+            "CF_TURNSTILE_RETRIES": 0,
+        }
+    )
+    with app.app_context():
+        result, message = cf_turnstile_verify(TURNSTILE_DUMMY_TOKEN)
+        assert result is False
+        assert message == ["request-failed"]
+        # a failed round trip says nothing about the token
+        assert TURNSTILE_DUMMY_TOKEN not in app.turnstile_cache
+
+
+@pytest.mark.parametrize(
+    ("cf_secret_key", "expected_result", "expected_message"),
+    (
+        ("1x0000000000000000000000000000000AA", True, []),
+        ("2x0000000000000000000000000000000AA", False, ["invalid-input-response"]),
+    ),
+)
+def test_verify_async(
+    app, turnstile_server, cf_secret_key, expected_result, expected_message
+):
+    app.config["CF_TURNSTILE_SECRET_KEY"] = cf_secret_key
+    with app.app_context():
+        cf_response, cf_message = asyncio.run(
+            cf_turnstile_verify_async(TURNSTILE_DUMMY_TOKEN)
+        )
+        assert expected_result is cf_response
+        assert expected_message == cf_message
+
+        cf_response, cf_message = asyncio.run(cf_turnstile_verify_async(""))
+        assert cf_response is False
+        assert "missing-input-response" in cf_message
+
+
+def test_verify_cached(app, turnstile_server):
+    with app.test_request_context():
+        assert cf_turnstile_verify(TURNSTILE_DUMMY_TOKEN) == (True, [])
+        assert cf_turnstile_verify(TURNSTILE_DUMMY_TOKEN) == (True, [])
+    # the same token from another session, even at the same address, is a replay
+    with app.test_request_context():
+        assert cf_turnstile_verify(TURNSTILE_DUMMY_TOKEN) == (
+            False,
+            ["timeout-or-duplicate"],
+        )
+    assert len(turnstile_server.requests) == 1
+
+    app.config["CF_TURNSTILE_SECRET_KEY"] = "2x0000000000000000000000000000000AA"
+    with app.test_request_context():
+        for _ in range(2):
+            assert cf_turnstile_verify("bad token") == (
+                False,
+                ["invalid-input-response"],
+            )
+    assert len(turnstile_server.requests) == 2
+
+
+def test_verify_metrics(app, turnstile_server):
+    with app.test_request_context():
+        cf_turnstile_verify(TURNSTILE_DUMMY_TOKEN)
+        cf_turnstile_verify(TURNSTILE_DUMMY_TOKEN)
+        cf_turnstile_verify("")
+    values = {
+        (metric, tuple(labels)): value
+        for metric, labels, value in app.metrics.snapshot()
+    }
+    assert values[("flaskr_turnstile_verify_total", ("success",))] == 1
+    assert values[("flaskr_turnstile_verify_total", ("failure",))] == 1
+    assert values[("flaskr_turnstile_cache_hits_total", ("success",))] == 1
+    assert values[("flaskr_turnstile_errors_total", ("missing-input-response",))] == 1
+    assert values[("flaskr_turnstile_verify_duration_seconds_count", ())] == 1
+
+
+def test_resubmit_after_validation_error(client, auth, app, turnstile_server):
+    auth.login()
+    app.config["TESTING"] = False
+    data = {"title": "", "body": "", "cf-turnstile-response": TURNSTILE_DUMMY_TOKEN}
+    response = client.post("/create", data=data)
+    assert b"Title is required." in response.data
+    data["title"] = "resubmitted"
+    response = client.post("/create", data=data)
+    assert response.status_code == 302
+    assert len(turnstile_server.requests) == 1
+
+
+def test_token_spent_once_form_goes_through(client, auth, app, turnstile_server):
+    auth.login()
+    app.config["TESTING"] = False
+    data = {
+        "title": "first",
+        "body": "",
+        "cf-turnstile-response": TURNSTILE_DUMMY_TOKEN,
+    }
+    response = client.post("/create", data=data)
+    assert response.headers["Location"] == "/"
+    data["title"] = "replayed"
+    response = client.post("/create", data=data, follow_redirects=True)
+    assert b"Captcha verification failed timeout-or-duplicate" in response.data
+    assert b"replayed" not in response.data
+    assert len(turnstile_server.requests) == 1
+
+
+def test_token_bound_to_endpoint(client, auth, app, turnstile_server):
+    auth.login()
+    app.config["TESTING"] = False
+    data = {"title": "", "body": "", "cf-turnstile-response": TURNSTILE_DUMMY_TOKEN}
+    client.post("/create", data=data)
+    response = client.post(
+        "/1/update",
+        data=dict(data, title="updated"),
+        follow_redirects=True,
+    )
+    assert b"timeout-or-duplicate" in response.data
+
+
+def test_token_spent_by_wrong_password(client, app, turnstile_server):
+    app.config["TESTING"] = False
+    data = {
+        "username": "test",
+        "password": "wrong",
+        "cf-turnstile-response": TURNSTILE_DUMMY_TOKEN,
+    }
+    response = client.post("/auth/login", data=data, follow_redirects=True)
+    assert b"Incorrect username or password." in response.data
+    data["password"] = "test"
+    response = client.post("/auth/login", data=data, follow_redirects=True)
+    assert b"Captcha verification failed timeout-or-duplicate" in response.data
+    with client.session_transaction() as session:
+        assert "id" not in session
+
+
+def test_change_password_token_spent_by_wrong_password(
+    client, auth, app, turnstile_server
+):
+    auth.login()
+    app.config["TESTING"] = False
+    data = {
+        "current_password": "wrong",
+        "new_password": "new",
+        "confirm_new_password": "new",
+        "cf-turnstile-response": TURNSTILE_DUMMY_TOKEN,
+    }
+    response = client.post("/auth/change_password", data=data, follow_redirects=True)
+    assert b"Current password is incorrect." in response.data
+    data["current_password"] = "test"
+    response = client.post("/auth/change_password", data=data, follow_redirects=True)
+    assert b"Captcha verification failed timeout-or-duplicate" in response.data
+
+
+def test_change_password_resubmit_after_validation_error(
+    client, auth, app, turnstile_server
+):
+    auth.login()
+    app.config["TESTING"] = False
+    data = {
+        "current_password": "test",
+        "new_password": "new",
+        "confirm_new_password": "other",
+        "cf-turnstile-response": TURNSTILE_DUMMY_TOKEN,
+    }
+    response = client.post("/auth/change_password", data=data, follow_redirects=True)
+    assert b"New passwords do not match." in response.data
+    data["confirm_new_password"] = "new"
+    response = client.post("/auth/change_password", data=data)
+    assert response.headers["Location"] == "/auth/login"
+    assert len(turnstile_server.requests) == 1